@@ -51,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'device_overview.sql_instrumentation.DeviceDbQueryMiddleware',
 ]
 
 ROOT_URLCONF = 'abschlussarbeit.urls'
@@ -94,7 +95,9 @@ DATABASES = {
         #},
         
          'device_db': {   # neue MariaDB-Verbindung
-         'ENGINE': 'django.db.backends.mysql',
+         # wie django.db.backends.mysql, aber mit Connection-Pool
+         # (device_overview/db_pool.py)
+         'ENGINE': 'device_overview.db_backends.pooled_mysql',
          'NAME': 'device_overview',
          'USER': 'devapp',
          'PASSWORD': 'admin',
@@ -102,6 +105,19 @@ DATABASES = {
          'PORT': '3306',
          'OPTIONS': {
              'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+             # nötig für DEVICE_IMPORT_ENGINE = "load_data"
+             #'local_infile': 1,
+         },
+         # Pool pro Worker-Prozess: höchstens MAX_SIZE Verbindungen, MIN_SIZE
+         # werden beim Start geöffnet; nach MAX_LIFETIME s neu verbinden, nach
+         # PING_INTERVAL s Leerlauf vor Benutzung pingen; wer länger als
+         # CHECKOUT_TIMEOUT s auf eine Verbindung wartet, bekommt einen Fehler
+         'POOL': {
+             'MAX_SIZE': 10,
+             'MIN_SIZE': 2,
+             'MAX_LIFETIME': 1800,
+             'PING_INTERVAL': 30,
+             'CHECKOUT_TIMEOUT': 10,
          },
     }
 }
@@ -154,4 +170,42 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = "login"
 LOGIN_REDIRECT_URL = "index"
-LOGOUT_REDIRECT_URL = "index"
\ No newline at end of file
+LOGOUT_REDIRECT_URL = "index"
+
+# CSV-Import (device_overview/db_sql.py)
+# Zeilen pro Batch beim Laden in staging_devices
+DEVICE_IMPORT_BATCH_SIZE = 5000
+# "executemany" (INSERT in Batches) oder "load_data" (LOAD DATA LOCAL INFILE,
+# braucht 'local_infile' in den OPTIONS von device_db und local_infile=ON
+# am Server; sonst automatischer Fallback auf executemany)
+DEVICE_IMPORT_ENGINE = "executemany"
+# "full"   (alle Tabellen leeren + neu aufbauen),
+# "delta"  (Abgleich über CI_ID bzw. SERIALNUMBER, Lookup-Tabellen werden
+#           nur ergänzt) oder
+# "shadow" (Neuaufbau in DEVICE_SHADOW_SCHEMA, danach atomarer RENAME TABLE;
+#           devapp braucht dafür CREATE/DROP/ALTER auf beiden Schemas)
+DEVICE_IMPORT_MODE = "full"
+DEVICE_SHADOW_SCHEMA = "device_overview_shadow"
+# device_flat als indizierte Tabelle statt View; wird am Ende jedes Imports
+# aus der Join-View device_flat_source neu gebaut und atomar getauscht
+DEVICE_FLAT_MATERIALIZED = False
+# Zwischenablage für Uploads, bis der Hintergrund-Import sie verarbeitet
+# (Default: <tempdir>/device_overview_imports)
+# DEVICE_IMPORT_SPOOL_DIR = BASE_DIR / "import_spool"
+# Optionaler Alias aus CACHES für abgeleitete Daten (Dropdown-Werte usw.),
+# zusätzlich zum Cache im Prozess; Schlüssel enthalten die Daten-Generation
+# DEVICE_CACHE_ALIAS = "default"
+# Speicherbudget des LRU-Caches für die vordefinierten Reports (Bytes)
+DEVICE_REPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Zusätzliche Site-Gruppen für die Tabelle site_groups (DACH ist fest
+# in device_overview/site_groups.py hinterlegt), z.B.
+# DEVICE_SITE_GROUPS = {"NORDICS": ["OSL", "STO"]}
+# device_db-Statements ab dieser Laufzeit (ms) im Log "device_overview.sql"
+DEVICE_SLOW_QUERY_MS = 500
+# Threads für parallele device_db-Abfragen (device_overview/concurrent_db.py);
+# jede belegt eine Verbindung, also unter POOL['MAX_SIZE'] bleiben
+DEVICE_QUERY_WORKERS = 4
+# device_flat zusätzlich spaltenweise im Speicher jedes Worker-Prozesses
+# halten (device_overview/snapshot.py); Analyse-Filter ohne Freitext und
+# Site-Counts werden dann per Bitmap statt per SQL beantwortet
+DEVICE_COLUMNAR_SNAPSHOT = False
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'abschlussarbeit.settings')
 
 application = get_wsgi_application()
+
+# device_db-Pool beim Start des Workers füllen statt beim ersten Request;
+# Pools gelten pro Prozess, mit --preload füllt das nur den Master
+# (für die Worker warm_up_pools() im post_fork-Hook aufrufen)
+from device_overview.db_pool import warm_up_pools  # noqa: E402
+
+warm_up_pools()
@@ -0,0 +1,329 @@
+# device_overview/benchmark.py
+
+"""
+Reproduzierbarer Import-/Lese-Benchmark gegen eine lokale device_db.
+
+- generate_cmdb_rows()/write_cmdb_csv(): synthetische CMDB-CSV mit allen
+  CSV_COLUMNS und realistischen Kardinalitäten (Sites, Räume, Modelle,
+  Status); gleicher Seed -> gleiche Datei
+- run_benchmark(): misst die Import-Phasen und die Lesepfade und liefert
+  ein JSON-fähiges Dict
+
+Aufruf über die Management-Commands generate_cmdb_csv und benchmark_import.
+ACHTUNG: run_benchmark() leert die device_db.
+"""
+
+import csv
+import datetime
+import itertools
+import platform
+import random
+import statistics
+import subprocess
+import time
+
+from django.db import connections
+
+from . import db_sql, rollup, search
+from .concurrent_db import run_concurrently
+from .db_schema import migrate
+from .db_sql_analysis import (
+    _query_filter_options,
+    fetch_counts_and_total,
+    fetch_device_chunk,
+    fetch_device_page,
+)
+from .db_sql_reports import (
+    build_dach_deployed_t3_devices_query,
+    fetch_dach_deployed_t3_counts_by_site,
+    fetch_dach_deployed_t3_devices_rows,
+    fetch_dach_deployed_t3_devices_total,
+)
+from .generation import bump_generation
+from .pagination import clear_count_cache
+from .report_cache import report_cache
+from .site_groups import DACH, SITE_GROUPS
+from .streaming import stream_rows
+
+# Kardinalitäten der synthetischen Daten
+REGIONS = ["EMEA-DACH", "EMEA-West", "EMEA-East", "Americas", "APAC"]
+COMPANY_COUNT = 30
+SITE_COUNT = 400
+ROOMS_PER_SITE = 25
+MODEL_COUNT = 800
+MANUFACTURERS = [
+    "Dell", "HP", "Lenovo", "Fujitsu", "Apple", "Microsoft", "Cisco",
+    "Igel", "Zebra", "Brother", "Canon", "Samsung", "LG", "Eizo", "Panasonic",
+]
+TIERS = {
+    "Hardware": {
+        "Client": [
+            "Computer", "Notebook", "Notebook-Special", "ThinClient",
+            "Workstation", "Workstation-Mobile", "Tablet",
+        ],
+        "Peripheral": ["Monitor", "Printer", "Scanner", "Dockingstation"],
+        "Network": ["Switch", "Router", "Access Point"],
+    },
+}
+# (Wert, Gewicht)
+CI_STATUSES = [
+    ("Deployed", 70), ("In Stock", 12), ("Ordered", 4), ("In Repair", 3),
+    ("Retired", 8), ("Disposed", 3),
+]
+PL_STATUSES = [("Active", 85), ("Inactive", 10), ("Planned", 5)]
+DEPARTMENT_COUNT = 120
+COST_CENTER_COUNT = 600
+PERSON_COUNT = 5000
+SUPPLIERS = ["Bechtle", "Cancom", "Computacenter", "Dell Direct", "HP Direct", "SVA"]
+DEPOTS = ["Central", "North", "South", "East", "West"]
+TYPES = ["Physical", "Virtual", "Loan"]
+RELATIONS = ["Primary", "Secondary", "Shared"]
+
+BENCHMARK_SIZES = (10_000, 100_000, 1_000_000)
+
+
+def _weighted(rnd, choices):
+    values, weights = zip(*choices)
+    return rnd.choices(values, weights)[0]
+
+
+def _site_codes(rnd):
+    """DACH-Sites aus site_groups + zufällige weitere 3-Buchstaben-Codes."""
+    codes = list(SITE_GROUPS[DACH])
+    used = set(codes)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    while len(codes) < SITE_COUNT:
+        code = "".join(rnd.choice(letters) for _ in range(3))
+        if code not in used:
+            used.add(code)
+            codes.append(code)
+    return codes
+
+
+def _date(rnd, start_year=2015):
+    day = datetime.date(start_year, 1, 1) + datetime.timedelta(days=rnd.randrange(3650))
+    return day.isoformat()
+
+
+def generate_cmdb_rows(rows, seed=42):
+    """
+    Generator über ``rows`` synthetische CSV-Zeilen (Dicts mit CSV_COLUMNS).
+    """
+    rnd = random.Random(seed)
+
+    dach = set(SITE_GROUPS[DACH])
+    sites = []
+    for code in _site_codes(rnd):
+        region = REGIONS[0] if code in dach else rnd.choice(REGIONS[1:])
+        sites.append({
+            "SITE": code,
+            "REGION": region,
+            "COMPANY": f"Company {rnd.randrange(COMPANY_COUNT):02d}",
+            "SITEGROUP": region.split("-")[-1],
+        })
+    # größere Standorte haben mehr Geräte (kumulierte Gewichte -> bisect)
+    site_weights = list(itertools.accumulate(rnd.paretovariate(1.2) for _ in sites))
+
+    tier_paths = [
+        (tier1, tier2, tier3)
+        for tier1, level2 in TIERS.items()
+        for tier2, level3 in level2.items()
+        for tier3 in level3
+    ]
+    models = []
+    for i in range(MODEL_COUNT):
+        tier1, tier2, tier3 = rnd.choice(tier_paths)
+        manufacturer = rnd.choice(MANUFACTURERS)
+        models.append({
+            "MODEL": f"{manufacturer} {tier3} {1000 + i}",
+            "MANUFACTURERNAME": manufacturer,
+            "TIER1": tier1,
+            "TIER2": tier2,
+            "TIER3": tier3,
+            "PARTNUMBER": f"PN-{manufacturer[:3].upper()}-{i:05d}",
+        })
+    model_weights = list(itertools.accumulate(rnd.paretovariate(1.5) for _ in models))
+
+    for n in range(rows):
+        site = rnd.choices(sites, cum_weights=site_weights)[0]
+        model = rnd.choices(models, cum_weights=model_weights)[0]
+        room = rnd.randrange(ROOMS_PER_SITE)
+        serial = f"{model['MANUFACTURERNAME'][:2].upper()}{seed:02d}{n:09d}"
+        has_ci = rnd.random() < 0.97
+
+        row = {
+            "PL_NAME": f"{site['SITE']}-{model['TIER3'][:2].upper()}{n:07d}",
+            "REGION": site["REGION"],
+            "COMPANY": site["COMPANY"],
+            "SITEGROUP": site["SITEGROUP"],
+            "SITE": site["SITE"],
+            "ROOM": f"R{room:03d}",
+            "PHYSICALPOSITION": f"Desk {rnd.randrange(60)}",
+            "SHORTDESCRIPTION": f"{model['TIER3']} {model['MANUFACTURERNAME']}",
+            "DEPARTMENT": f"Dept {rnd.randrange(DEPARTMENT_COUNT):03d}",
+            "OWNED_BY": f"owner{rnd.randrange(PERSON_COUNT):05d}",
+            "USED_BY": f"user{rnd.randrange(PERSON_COUNT):05d}",
+            "SUPPORTED_BY": f"IT-Support {site['REGION']}",
+            "PL_COST_CENTER": f"CC{rnd.randrange(COST_CENTER_COUNT):05d}",
+            "PL_STATUS": _weighted(rnd, PL_STATUSES),
+            "RELATION": rnd.choice(RELATIONS),
+            "DESTINATION_CLASSID": "BMC_COMPUTERSYSTEM",
+            "TIER1": model["TIER1"],
+            "TIER2": model["TIER2"],
+            "TIER3": model["TIER3"],
+            "MODEL": model["MODEL"],
+            "MANUFACTURERNAME": model["MANUFACTURERNAME"],
+            "CI_NAME": f"CI{n:09d}",
+            "SERIALNUMBER": serial,
+            "CI_ID": f"OI-{seed:02d}{n:010d}" if has_ci else "",
+            "BUDGETCODE": f"B{rnd.randrange(50):02d}",
+            "CI_ROOM": f"{site['SITE']}-R{room:03d}",
+            "FLOOR": str(room // 5),
+            "PARTNUMBER": model["PARTNUMBER"],
+            "SUPPLIERNAME": rnd.choice(SUPPLIERS),
+            "CI_STATUS": _weighted(rnd, CI_STATUSES),
+            "PURCHASE_DATE": _date(rnd),
+            "RECEIVED_DATE": _date(rnd),
+            "INSTALLATION_DATE": _date(rnd),
+            "AVAILABLE_DATE": _date(rnd),
+            "RETURN_DATE": "",
+            "DISPOSAL_DATE": "",
+            "MARK_AS_DELETED": "No",
+            "CREATE_DATE": _date(rnd),
+            "MODIFIED_DATE": _date(rnd, 2024),
+            "ROLE": "Client",
+            "CHILDNAME": "",
+            "CONFBASICNUMBER": f"CB{rnd.randrange(200):03d}",
+            "BUILDNUMBER": f"{rnd.randrange(10, 25)}.{rnd.randrange(10)}",
+            "TYPE": rnd.choice(TYPES),
+            "ADDITIONAL_INFORMATION": "",
+            "DEPOT": rnd.choice(DEPOTS),
+            "SUPPORTED": "Yes",
+        }
+        yield row
+
+
+def write_cmdb_csv(path, rows, seed=42):
+    """Synthetische CMDB-CSV (Semikolon, UTF-8) nach ``path`` schreiben."""
+    with open(path, "w", encoding="utf-8", newline="") as out:
+        writer = csv.DictWriter(out, fieldnames=db_sql.CSV_COLUMNS, delimiter=";")
+        writer.writeheader()
+        writer.writerows(generate_cmdb_rows(rows, seed))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def _count_stream(sql, params):
+    rows = stream_rows(sql, params)
+    next(rows)  # Kopfzeile
+    return sum(1 for _ in rows)
+
+
+def _analysis_first_block(filters):
+    """Abfragen der Analyse-Seite: erster Zeilenblock + Counts."""
+    return fetch_device_chunk(filters), fetch_counts_and_total(filters)
+
+
+def _report_first_page():
+    """Wie die Report-View: erste Seite + Gesamtanzahl parallel."""
+    return run_concurrently(
+        (fetch_dach_deployed_t3_devices_rows,),
+        (fetch_dach_deployed_t3_devices_total,),
+    )
+
+
+def _read_paths():
+    """Lesepfade der Views (ohne Caches, die würden nur sich selbst messen)."""
+    export_sql, export_params = build_dach_deployed_t3_devices_query()
+    return [
+        ("database_first_page", lambda: fetch_device_page({})),
+        ("analysis_dach_page_and_counts",
+         lambda: _analysis_first_block({"dach_only": True})),
+        ("analysis_search_serial",
+         lambda: _analysis_first_block({"search": "0000042"})),
+        ("analysis_search_text",
+         lambda: _analysis_first_block({"search": "Notebook Dell"})),
+        ("filter_options", _query_filter_options),
+        ("report_devices_page", _report_first_page),
+        ("report_counts", fetch_dach_deployed_t3_counts_by_site),
+        ("report_devices_export",
+         lambda: _count_stream(export_sql, export_params)),
+    ]
+
+
+def run_benchmark(csv_path, repeat=3):
+    """
+    Vollimport von ``csv_path`` phasenweise messen, danach jeden Lesepfad
+    ``repeat``-mal (Median). Leert dabei die device_db!
+    """
+    migrate()
+    phases = {}
+
+    seconds, _ = _timed(db_sql.clear_all_tables)
+    phases["clear_all_tables"] = seconds
+
+    with open(csv_path, "rb") as csv_file:
+        seconds, stats = _timed(lambda: db_sql.import_csv_to_staging(csv_file))
+    phases["import_csv_to_staging"] = seconds
+
+    seconds, _ = _timed(db_sql.populate_normalized_from_staging)
+    phases["populate_normalized_from_staging"] = seconds
+
+    seconds, _ = _timed(db_sql.recreate_device_flat_view)
+    phases["recreate_device_flat_view"] = seconds
+
+    seconds, _ = _timed(search.rebuild_search_index)
+    phases["rebuild_search_index"] = seconds
+
+    seconds, _ = _timed(rollup.rebuild_device_rollup)
+    phases["rebuild_device_rollup"] = seconds
+
+    bump_generation()
+
+    reads = {}
+    for name, fn in _read_paths():
+        runs = []
+        for _ in range(repeat):
+            clear_count_cache()
+            report_cache.clear()
+            seconds, _ = _timed(fn)
+            runs.append(seconds)
+        reads[name] = {"median": statistics.median(runs), "runs": runs}
+
+    with connections[db_sql.DEVICE_ALIAS].cursor() as cur:
+        cur.execute("SELECT VERSION();")
+        server_version = cur.fetchone()[0]
+
+    return {
+        "commit": _git_commit(),
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "csv": str(csv_path),
+        "rows": stats["rows"],
+        "settings": {
+            "engine": stats["engine"],
+            "batch_size": db_sql.STAGING_BATCH_SIZE,
+            "device_flat_materialized": db_sql.DEVICE_FLAT_MATERIALIZED,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "server": server_version,
+        },
+        "phases": phases,
+        "import_seconds": sum(phases.values()),
+        "rows_per_second": stats["rows"] / sum(phases.values()) if sum(phases.values()) else None,
+        "reads": reads,
+    }
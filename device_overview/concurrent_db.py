@@ -0,0 +1,119 @@
+# device_overview/concurrent_db.py
+
+"""
+Unabhängige device_db-Abfragen parallel ausführen.
+
+Django-Verbindungen gehören zu einem Thread; jede Abfrage läuft deshalb in
+einem Worker-Thread auf einer eigenen device_db-Verbindung, die danach
+geschlossen (mit dem Pool-Backend: zurückgegeben) wird. Die Laufzeit ist
+dann etwa die der langsamsten Abfrage statt der Summe.
+
+- run_concurrently(): aus synchronem Code
+- gather_queries():   aus async Views
+
+Beide nutzen denselben Thread-Pool mit MAX_WORKERS Threads; mehr
+device_db-Verbindungen als MAX_WORKERS belegen die Worker zusammen also
+nie. Verschachtelte Aufrufe (run_concurrently in einem Worker) laufen
+nacheinander im Worker, und wer auf Worker wartet, gibt vorher seine
+eigene Verbindung zurück - niemand hält eine Verbindung, während er auf
+eine weitere wartet.
+
+Aufrufe werden als Tupel (funktion, *argumente) übergeben, die Ergebnisse
+kommen in derselben Reihenfolge zurück.
+"""
+
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from .db_pool import DEFAULT_POOL_OPTIONS
+from .sql_instrumentation import instrument_current_thread
+
+DEVICE_ALIAS = "device_db"
+
+
+def _max_workers():
+    """
+    DEVICE_QUERY_WORKERS, bei Pool-Backend höchstens POOL["MAX_SIZE"] - 1
+    (mindestens eine Verbindung bleibt für Request-Threads).
+    """
+    workers = getattr(settings, "DEVICE_QUERY_WORKERS", 4)
+    pool = settings.DATABASES.get(DEVICE_ALIAS, {}).get("POOL")
+    if pool is not None:
+        max_size = pool.get("MAX_SIZE", DEFAULT_POOL_OPTIONS["MAX_SIZE"])
+        workers = min(workers, max_size - 1)
+    return max(workers, 1)
+
+
+MAX_WORKERS = _max_workers()
+
+_executor = None
+_executor_lock = threading.Lock()
+_worker = threading.local()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix="device-query",
+            )
+        return _executor
+
+
+def in_worker():
+    """True in einem Worker-Thread von run_concurrently/gather_queries."""
+    return getattr(_worker, "active", False)
+
+
+def _call_closing(fn, args):
+    """
+    ``fn(*args)`` im Worker: mit SQL-Messung, verschachtelte Aufrufe
+    inline; die Verbindung des Threads wird danach geschlossen.
+    """
+    _worker.active = True
+    try:
+        with instrument_current_thread():
+            return fn(*args)
+    finally:
+        _worker.active = False
+        connections[DEVICE_ALIAS].close()
+
+
+def _submit(calls):
+    executor = _get_executor()
+    return [
+        executor.submit(contextvars.copy_context().run, _call_closing, fn, args)
+        for fn, *args in calls
+    ]
+
+
+def run_concurrently(*calls):
+    """
+    Aufrufe parallel im Thread-Pool ausführen.
+
+    Nacheinander im aufrufenden Thread, wenn es nur einen Aufruf gibt, der
+    Aufrufer selbst ein Worker ist (sonst könnten sich wartende Worker
+    gegenseitig blockieren) oder eine Transaktion offen ist (andere
+    Verbindungen sähen deren Änderungen nicht). Sonst wird die Verbindung
+    des Aufrufers vor dem Warten geschlossen; offene Cursor darauf darf es
+    dann nicht geben.
+    """
+    conn = connections[DEVICE_ALIAS]
+    if len(calls) < 2 or in_worker() or conn.in_atomic_block:
+        return [fn(*args) for fn, *args in calls]
+
+    conn.close()
+    return [future.result() for future in _submit(calls)]
+
+
+async def gather_queries(*calls):
+    """Aufrufe aus einer async View parallel im Thread-Pool ausführen."""
+    return await asyncio.gather(*(
+        asyncio.wrap_future(future) for future in _submit(calls)
+    ))
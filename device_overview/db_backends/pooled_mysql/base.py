@@ -0,0 +1,95 @@
+# device_overview/db_backends/pooled_mysql/base.py
+
+"""
+MySQL/MariaDB-Backend mit Connection-Pool (siehe device_overview/db_pool.py).
+
+Einsatz in settings.DATABASES:
+
+    "device_db": {
+        "ENGINE": "device_overview.db_backends.pooled_mysql",
+        ...
+        "POOL": {"MAX_SIZE": 10, "MIN_SIZE": 2},
+    }
+
+Django öffnet und schließt Verbindungen wie gewohnt; statt wirklich zu
+verbinden bzw. zu trennen, wird eine Verbindung aus dem Pool geholt bzw.
+zurückgegeben. Der Sitzungs-Setup (init_command, SQL_AUTO_IS_NULL, ...)
+läuft dadurch nur einmal pro physischer Verbindung.
+
+Beim Zurückgeben gibt _reset_session() benannte Sperren (GET_LOCK) frei und
+wählt wieder die konfigurierte Datenbank (nach ``USE shadow``), damit der
+nächste Benutzer der Verbindung davon nichts erbt.
+"""
+
+import logging
+
+from django.db.backends.mysql.base import Database
+from django.db.backends.mysql.base import DatabaseWrapper as MySQLDatabaseWrapper
+
+from device_overview.db_pool import PoolTimeout, get_pool
+
+logger = logging.getLogger(__name__)
+
+
+def _reset_session(connection, db_name):
+    """Sitzungszustand einer Verbindung vor dem Zurücklegen in den Pool zurücksetzen."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT RELEASE_ALL_LOCKS();")
+        (released,) = cursor.fetchone()
+        if released:
+            logger.warning("%d benannte Sperre(n) beim Einchecken freigegeben", released)
+        cursor.execute(f"USE `{db_name}`;")
+    finally:
+        cursor.close()
+
+
+class DatabaseWrapper(MySQLDatabaseWrapper):
+
+    def _pool(self, conn_params=None):
+        if conn_params is None:
+            conn_params = self.get_connection_params()
+        parent = super()
+
+        db_name = self.settings_dict["NAME"]
+
+        def factory():
+            return parent.get_new_connection(conn_params)
+
+        def reset(connection):
+            _reset_session(connection, db_name)
+
+        return get_pool(self.alias, factory, self.settings_dict.get("POOL"), reset)
+
+    def get_new_connection(self, conn_params):
+        try:
+            return self._pool(conn_params).checkout()
+        except PoolTimeout as exc:
+            # als OperationalError, damit Django ihn wie einen
+            # Verbindungsfehler behandelt
+            raise Database.OperationalError(str(exc)) from exc
+
+    def init_connection_state(self):
+        # Sitzungs-Setup nur einmal pro physischer Verbindung
+        if getattr(self.connection, "_device_pool_initialized", False):
+            return
+        super().init_connection_state()
+        self.connection._device_pool_initialized = True
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # nach Fehlern oder mitten in einer Transaktion nicht wiederverwenden
+        discard = (
+            self.in_atomic_block
+            or self.errors_occurred
+            or not self.get_autocommit()
+        )
+        with self.wrap_database_errors:
+            self._pool().checkin(self.connection, discard=discard)
+
+    def warm_up_pool(self):
+        return self._pool().warm_up()
+
+    def pool_stats(self):
+        return self._pool().stats()
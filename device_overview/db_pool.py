@@ -0,0 +1,288 @@
+# device_overview/db_pool.py
+
+"""
+Connection-Pool für die device_db (MariaDB).
+
+Django hält ohne CONN_MAX_AGE pro Request eine neue Verbindung auf (inkl.
+init_command). Der Pool hält geöffnete MySQLdb-Verbindungen pro Prozess
+vor; das Backend device_overview.db_backends.pooled_mysql holt sie beim
+Verbindungsaufbau hier ab und gibt sie beim Schließen zurück.
+
+- begrenzte Größe (MAX_SIZE), Warten höchstens CHECKOUT_TIMEOUT Sekunden
+- Health-Check (ping) beim Auschecken, wenn die Verbindung länger als
+  PING_INTERVAL unbenutzt war
+- Verbindungen älter als MAX_LIFETIME werden geschlossen statt verwendet
+- Sitzungszustand wird beim Einchecken per ``reset(conn)`` zurückgesetzt;
+  schlägt das fehl, wird die Verbindung geschlossen
+- Kennzahlen (Wartezeit, Auslastung, ...) über stats()
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_OPTIONS = {
+    "MAX_SIZE": 10,
+    "MIN_SIZE": 2,           # so viele Verbindungen beim Warm-up öffnen
+    "MAX_LIFETIME": 1800,    # Sekunden
+    "PING_INTERVAL": 30,     # Sekunden Leerlauf, ab denen vor Benutzung gepingt wird
+    "CHECKOUT_TIMEOUT": 10,  # Sekunden
+}
+
+
+class PoolTimeout(Exception):
+    """Keine freie Verbindung innerhalb von CHECKOUT_TIMEOUT."""
+
+
+class ConnectionPool:
+    """
+    Thread-sicherer Pool für DB-API-Verbindungen; ``factory()`` öffnet eine
+    neue Verbindung, ``reset(conn)`` setzt vor dem Zurücklegen den
+    Sitzungszustand zurück.
+    """
+
+    def __init__(self, factory, options=None, reset=None):
+        options = {**DEFAULT_POOL_OPTIONS, **(options or {})}
+        self.factory = factory
+        self.reset = reset
+        self.max_size = options["MAX_SIZE"]
+        self.min_size = min(options["MIN_SIZE"], self.max_size)
+        self.max_lifetime = options["MAX_LIFETIME"]
+        self.ping_interval = options["PING_INTERVAL"]
+        self.checkout_timeout = options["CHECKOUT_TIMEOUT"]
+
+        self._cond = threading.Condition()
+        self._idle = deque()     # (conn, created_at, last_used)
+        self._created_at = {}    # id(conn) -> created_at der ausgecheckten
+        self._size = 0           # offene Verbindungen (frei + ausgecheckt)
+
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "created": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+            "timeouts": 0,
+            "reset_failures": 0,
+        }
+
+    # -- intern -------------------------------------------------------------
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _drop(self, conn):
+        """Verbindung schließen und ihren Platz im Pool freigeben."""
+        self._close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _create(self):
+        try:
+            conn = self.factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats["created"] += 1
+        return conn, time.monotonic()
+
+    def _usable(self, conn, created_at, last_used):
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            with self._cond:
+                self._stats["recycled"] += 1
+            return False
+        if now - last_used > self.ping_interval:
+            try:
+                conn.ping()
+            except Exception:
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                return False
+        return True
+
+    # -- API ----------------------------------------------------------------
+
+    def checkout(self):
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"Keine freie device_db-Verbindung nach "
+                            f"{self.checkout_timeout}s (Pool: {self.max_size})"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                else:
+                    self._size += 1
+                    conn = None
+
+            if conn is None:
+                conn, created_at = self._create()
+            elif not self._usable(conn, created_at, last_used):
+                self._drop(conn)
+                continue
+
+            wait_seconds = time.monotonic() - started
+            with self._cond:
+                self._created_at[id(conn)] = created_at
+                self._stats["checkouts"] += 1
+                if waited:
+                    self._stats["waits"] += 1
+                self._stats["wait_seconds"] += wait_seconds
+                self._stats["max_wait_seconds"] = max(
+                    self._stats["max_wait_seconds"], wait_seconds
+                )
+            return conn
+
+    def checkin(self, conn, discard=False):
+        """
+        Verbindung zurückgeben; ``discard`` (z.B. nach Fehlern) oder zu alte
+        Verbindungen werden geschlossen.
+        """
+        with self._cond:
+            created_at = self._created_at.pop(id(conn), None)
+
+        if created_at is None:
+            # nicht aus diesem Pool
+            self._close_quietly(conn)
+            return
+
+        if discard or time.monotonic() - created_at > self.max_lifetime:
+            self._drop(conn)
+            return
+
+        if self.reset is not None:
+            try:
+                self.reset(conn)
+            except Exception:
+                logger.warning("Sitzung nicht zurückgesetzt, Verbindung wird geschlossen",
+                               exc_info=True)
+                with self._cond:
+                    self._stats["reset_failures"] += 1
+                self._drop(conn)
+                return
+
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def warm_up(self):
+        """Bis zu MIN_SIZE Verbindungen vorab öffnen."""
+        opened = []
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    break
+                self._size += 1
+            opened.append(self._create())
+
+        with self._cond:
+            now = time.monotonic()
+            for conn, created_at in opened:
+                self._idle.append((conn, created_at, now))
+            self._cond.notify_all()
+        return len(opened)
+
+    def stats(self):
+        with self._cond:
+            in_use = self._size - len(self._idle)
+            checkouts = self._stats["checkouts"]
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "max_size": self.max_size,
+                "utilisation": in_use / self.max_size if self.max_size else None,
+                "avg_wait_ms": (
+                    self._stats["wait_seconds"] * 1000 / checkouts if checkouts else 0.0
+                ),
+                "max_wait_ms": self._stats["max_wait_seconds"] * 1000,
+                **{
+                    key: value
+                    for key, value in self._stats.items()
+                    if key not in ("wait_seconds", "max_wait_seconds")
+                },
+            }
+
+
+# (pid, alias) -> ConnectionPool; die PID im Schlüssel sorgt dafür, dass
+# ein per fork() erzeugter Worker (z.B. gunicorn --preload) nicht die
+# Verbindungen des Elternprozesses weiterbenutzt, sondern eigene öffnet.
+# Die geerbten Einträge bleiben unangetastet (Schließen würde die Sockets
+# des Elternprozesses trennen).
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _reset_lock_after_fork():
+    # ein zum fork()-Zeitpunkt gehaltener Lock bliebe im Kind für immer gesperrt
+    global _pools_lock
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+def get_pool(alias, factory, options=None, reset=None):
+    """Pool für ``alias`` (einer pro Prozess), beim ersten Aufruf angelegt."""
+    key = (os.getpid(), alias)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(factory, options, reset)
+        return pool
+
+
+def pool_stats(alias):
+    """Kennzahlen des Pools für ``alias`` oder None (kein Pool-Backend)."""
+    pool = _pools.get((os.getpid(), alias))
+    return pool.stats() if pool is not None else None
+
+
+def warm_up_pools():
+    """
+    Pools aller Aliase mit Pool-Backend vorab füllen (beim Start des
+    Worker-Prozesses, siehe wsgi.py/asgi.py). Fehler werden nur geloggt,
+    damit der Worker auch ohne erreichbare DB startet.
+
+    Wird die Anwendung vor dem fork() geladen (gunicorn --preload), füllt
+    das nur den Pool des Master-Prozesses; die Worker öffnen ihre
+    Verbindungen dann beim ersten Request bzw. per post_fork-Hook, der
+    warm_up_pools() erneut aufruft.
+    """
+    for conn in connections.all():
+        warm_up = getattr(conn, "warm_up_pool", None)
+        if warm_up is None:
+            continue
+        try:
+            opened = warm_up()
+            logger.info("Pool %s: %d Verbindungen vorab geöffnet", conn.alias, opened)
+        except Exception:
+            logger.exception("Warm-up des Pools %s fehlgeschlagen", conn.alias)
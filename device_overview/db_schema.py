@@ -0,0 +1,340 @@
+# device_overview/db_schema.py
+
+"""
+Verwaltete DDL für die device_db.
+
+Alle technischen Tabellen, Spalten und Indizes, die der Import und die
+Abfragen brauchen, werden hier als nummerierte Migrationen angelegt und in
+schema_migrations protokolliert. Jede Migration ist idempotent
+(IF NOT EXISTS bzw. Prüfung über information_schema), parallele
+Deployments dürfen migrate() also gleichzeitig aufrufen.
+
+Die fachlichen Tabellen selbst (devices, sites, ..., staging_devices)
+werden weiterhin außerhalb angelegt; hier kommen nur Ergänzungen dazu.
+
+Angewendet werden die Migrationen beim Deployment per
+``manage.py migrate_device_db``; zur Laufzeit prüft ensure_schema() nur,
+ob alle angewendet sind, und führt selbst keine DDL aus.
+"""
+
+import logging
+import threading
+
+from django.db import connections
+
+from .db_sql import DEVICE_ALIAS, SIMPLE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Präfixlänge für Indizes auf TEXT-Spalten bzw. sehr langen VARCHARs
+# (191 Zeichen * 4 Byte utf8mb4 < 767 Byte, passt bei jedem Row-Format)
+INDEX_PREFIX_LENGTH = 191
+TEXT_TYPES = ("tinytext", "text", "mediumtext", "longtext", "blob")
+
+# Natürliche Schlüssel der Lookup-Tabellen (Joins in _insert_lookups und
+# DEVICE_FK_JOINS_SQL)
+NATURAL_KEY_INDEXES = [
+    (table, column) for table, column, _ in SIMPLE_LOOKUPS
+] + [
+    ("sites", "site"),
+    ("models", "model"),
+    ("rooms", "site_id"),
+]
+
+# Staging-Spalten, über die gejoint bzw. gruppiert wird
+STAGING_INDEXES = [
+    ("staging_devices", "SITE"),
+    ("staging_devices", "MODEL"),
+    ("staging_devices", "CI_ID"),
+    ("staging_devices", "SERIALNUMBER"),
+]
+
+# FK-Spalten der Joins in device_flat (falls keine FK-Constraints mit
+# eigenem Index existieren)
+FOREIGN_KEY_INDEXES = [
+    ("devices", "pl_name_id"),
+    ("devices", "owner_id"),
+    ("devices", "user_id"),
+    ("devices", "supporter_id"),
+    ("devices", "costcenter_id"),
+    ("devices", "pl_status_id"),
+    ("devices", "ci_status_id"),
+    ("devices", "relation_id"),
+    ("devices", "department_id"),
+    ("devices", "room_id"),
+    ("devices", "type_id"),
+    ("devices", "depot_id"),
+    ("devices", "model_id"),
+    ("devices", "supplier_id"),
+    ("sites", "region_id"),
+    ("models", "partnumber_id"),
+    ("models", "manu_id"),
+    ("models", "tier1_id"),
+    ("models", "tier2_id"),
+    ("models", "tier3_id"),
+]
+
+_ensured = False
+_ensure_lock = threading.Lock()
+
+
+def _conn():
+    return connections[DEVICE_ALIAS]
+
+
+def live_table(name):
+    """
+    Tabellenname im Live-Schema; bleibt gültig, auch wenn die Verbindung
+    gerade per shadow_build() im Shadow-Schema arbeitet.
+    """
+    return f"`{_conn().settings_dict['NAME']}`.{name}"
+
+
+# ---------------------------------------------------------------------------
+# Hilfsfunktionen für Indizes
+# ---------------------------------------------------------------------------
+
+def _column_info(cur, table, column):
+    """(DATA_TYPE, CHARACTER_MAXIMUM_LENGTH) oder None, wenn es die Spalte nicht gibt."""
+    cur.execute(
+        """
+        SELECT DATA_TYPE, CHARACTER_MAXIMUM_LENGTH
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s;
+        """,
+        [table, column],
+    )
+    return cur.fetchone()
+
+
+def _has_leading_index(cur, table, column):
+    """Gibt es schon einen Index (auch PK/FK), der mit ``column`` beginnt?"""
+    cur.execute(
+        """
+        SELECT 1
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+          AND COLUMN_NAME = %s AND SEQ_IN_INDEX = 1
+        LIMIT 1;
+        """,
+        [table, column],
+    )
+    return cur.fetchone() is not None
+
+
+def _index_column_sql(data_type, max_length, column, max_chars=INDEX_PREFIX_LENGTH * 4):
+    """
+    TEXT und VARCHARs länger als ``max_chars`` bekommen einen Präfix-Index
+    (in zusammengesetzten Indizes INDEX_PREFIX_LENGTH, damit die Summe unter
+    3072 Byte bleibt).
+    """
+    if data_type.lower() in TEXT_TYPES or (max_length or 0) > max_chars:
+        return f"`{column}`({INDEX_PREFIX_LENGTH})"
+    return f"`{column}`"
+
+
+def _create_indexes(cur, indexes):
+    for table, column in indexes:
+        info = _column_info(cur, table, column)
+        if info is None:
+            logger.warning("Index übersprungen: %s.%s existiert nicht", table, column)
+            continue
+        if _has_leading_index(cur, table, column):
+            continue
+        index_name = f"ix_{table}_{column.lower()}"
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS {index_name} "
+            f"ON {table} ({_index_column_sql(info[0], info[1], column)});"
+        )
+
+
+# ---------------------------------------------------------------------------
+# Migrationen
+# ---------------------------------------------------------------------------
+
+def _0001_devices_delta_columns(cur):
+    """
+    Technische Spalten in devices für den Delta-Import:
+    - device_key: CI:<CI_ID>, ersatzweise SN:<SERIALNUMBER>
+    - row_hash:   MD5 über alle CSV-Spalten der Quellzeile
+    - deleted_at: gesetzt, wenn das Gerät im letzten Import fehlte
+    """
+    cur.execute("""
+        ALTER TABLE devices
+            ADD COLUMN IF NOT EXISTS device_key VARCHAR(255) NULL,
+            ADD COLUMN IF NOT EXISTS row_hash CHAR(32) NULL,
+            ADD COLUMN IF NOT EXISTS deleted_at DATETIME NULL;
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS ix_devices_device_key
+            ON devices (device_key);
+    """)
+
+
+def _0002_import_jobs(cur):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {live_table('import_jobs')} (
+            job_id          BIGINT AUTO_INCREMENT PRIMARY KEY,
+            file_name       VARCHAR(255) NOT NULL,
+            file_path       VARCHAR(1024) NOT NULL,
+            status          VARCHAR(16) NOT NULL,
+            phase           VARCHAR(32) NOT NULL,
+            rows_processed  BIGINT NOT NULL DEFAULT 0,
+            error           TEXT NULL,
+            created_at      DATETIME(3) NOT NULL,
+            started_at      DATETIME(3) NULL,
+            finished_at     DATETIME(3) NULL,
+            INDEX ix_import_jobs_status (status)
+        );
+    """)
+
+
+def _0003_data_generation(cur):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {live_table('data_generation')} (
+            id          TINYINT NOT NULL PRIMARY KEY,
+            generation  BIGINT NOT NULL,
+            updated_at  DATETIME(3) NOT NULL
+        );
+    """)
+
+
+def _0004_site_groups(cur):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {live_table('site_groups')} (
+            group_name  VARCHAR(32) NOT NULL,
+            site        VARCHAR(64) NOT NULL,
+            PRIMARY KEY (group_name, site),
+            INDEX ix_site_groups_site (site)
+        );
+    """)
+
+
+def _0005_natural_key_indexes(cur):
+    _create_indexes(cur, NATURAL_KEY_INDEXES)
+
+
+def _0006_staging_indexes(cur):
+    _create_indexes(cur, STAGING_INDEXES)
+
+
+def _0007_foreign_key_indexes(cur):
+    _create_indexes(cur, FOREIGN_KEY_INDEXES)
+
+
+MIGRATIONS = [
+    ("0001_devices_delta_columns", _0001_devices_delta_columns),
+    ("0002_import_jobs", _0002_import_jobs),
+    ("0003_data_generation", _0003_data_generation),
+    ("0004_site_groups", _0004_site_groups),
+    ("0005_natural_key_indexes", _0005_natural_key_indexes),
+    ("0006_staging_indexes", _0006_staging_indexes),
+    ("0007_foreign_key_indexes", _0007_foreign_key_indexes),
+]
+
+
+class SchemaNotMigrated(RuntimeError):
+    """Es fehlen Migrationen (manage.py migrate_device_db ausführen)."""
+
+
+def applied_migrations():
+    """Namen der angewendeten Migrationen (leer, solange es schema_migrations nicht gibt)."""
+    with _conn().cursor() as cur:
+        cur.execute(
+            """
+            SELECT 1
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'schema_migrations';
+            """,
+            [_conn().settings_dict["NAME"]],
+        )
+        if cur.fetchone() is None:
+            return set()
+        cur.execute(f"SELECT name FROM {live_table('schema_migrations')};")
+        return {row[0] for row in cur.fetchall()}
+
+
+def pending_migrations():
+    """Namen der noch nicht angewendeten Migrationen, in Reihenfolge."""
+    done = applied_migrations()
+    return [name for name, _ in MIGRATIONS if name not in done]
+
+
+def migrate():
+    """
+    Alle noch fehlenden Migrationen in Reihenfolge ausführen
+    (nur aus migrate_device_db bzw. Werkzeugen, nicht im Request-Pfad).
+    Rückgabe: Namen der neu angewendeten Migrationen.
+    """
+    with _conn().cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {live_table('schema_migrations')} (
+                name        VARCHAR(128) NOT NULL PRIMARY KEY,
+                applied_at  DATETIME(3) NOT NULL
+            );
+        """)
+
+    done = applied_migrations()
+    applied = []
+
+    with _conn().cursor() as cur:
+        for name, migration in MIGRATIONS:
+            if name in done:
+                continue
+            logger.info("device_db-Migration %s", name)
+            migration(cur)
+            cur.execute(
+                f"""
+                INSERT IGNORE INTO {live_table('schema_migrations')} (name, applied_at)
+                VALUES (%s, NOW(3));
+                """,
+                [name],
+            )
+            applied.append(name)
+
+        # Site-Gruppen kommen aus dem Code/den Settings, deshalb bei jedem
+        # Lauf abgleichen (Import hier, site_groups importiert db_schema)
+        from .site_groups import sync_site_groups
+
+        sync_site_groups(cur)
+
+    if applied:
+        for problem in verify_indexes():
+            logger.warning("device_db-Index fehlt: %s", problem)
+    return applied
+
+
+def ensure_schema():
+    """
+    Prüfen, ob alle Migrationen angewendet sind (für Aufrufer, die die
+    Tabellen brauchen); sonst SchemaNotMigrated. Nach dem ersten Erfolg
+    wird pro Prozess nicht mehr nachgesehen.
+    """
+    global _ensured
+    with _ensure_lock:
+        if _ensured:
+            return
+        pending = pending_migrations()
+        if pending:
+            raise SchemaNotMigrated(
+                "device_db-Migrationen fehlen: " + ", ".join(pending)
+                + " (manage.py migrate_device_db ausführen)"
+            )
+        _ensured = True
+
+
+def verify_indexes():
+    """
+    Prüfen, ob es für die Gleichheits-Lookups auf den natürlichen Schlüsseln
+    und Staging-Spalten einen Index gibt, der mit der Spalte beginnt
+    (information_schema.STATISTICS, unabhängig von Tabellengröße und Plan).
+    Rückgabe: Liste von Problemen als Text (leer = alles gut).
+    """
+    problems = []
+    with _conn().cursor() as cur:
+        for table, column in NATURAL_KEY_INDEXES + STAGING_INDEXES:
+            if _column_info(cur, table, column) is None:
+                continue
+            if not _has_leading_index(cur, table, column):
+                problems.append(f"{table}.{column}")
+    return problems
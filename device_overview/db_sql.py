@@ -2,12 +2,45 @@
 
 import csv
 import io
+import itertools
+import logging
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
 
-from django.db import connections, transaction
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+logger = logging.getLogger(__name__)
 
 # Alias aus settings.DATABASES (zweite DB = MariaDB)
 DEVICE_ALIAS = "device_db"
 
+# Zeilen pro executemany beim Import in staging_devices
+STAGING_BATCH_SIZE = getattr(settings, "DEVICE_IMPORT_BATCH_SIZE", 5000)
+
+# Lade-Engine für staging_devices: "executemany" oder "load_data"
+STAGING_ENGINES = ("executemany", "load_data")
+STAGING_ENGINE = getattr(settings, "DEVICE_IMPORT_ENGINE", "executemany")
+
+# MariaDB/MySQL-Fehlercodes, wenn LOAD DATA LOCAL INFILE nicht erlaubt ist
+# (1148 ER_NOT_ALLOWED_COMMAND, 2068 CR_LOAD_DATA_LOCAL_INFILE_REJECTED,
+#  3948 ER_CLIENT_LOCAL_FILES_DISABLED)
+LOCAL_INFILE_REJECTED_CODES = (1148, 2068, 3948)
+
+# "full":   alles leeren und neu aufbauen
+# "delta":  Abgleich über CI_ID/SERIALNUMBER
+# "shadow": Neuaufbau im Shadow-Schema, danach atomarer Tausch
+IMPORT_MODE = getattr(settings, "DEVICE_IMPORT_MODE", "full")
+
+# Zweites Schema für den Shadow-Import (gleicher Server wie device_db)
+SHADOW_SCHEMA = getattr(settings, "DEVICE_SHADOW_SCHEMA", "device_overview_shadow")
+# Suffix, mit dem FK-Namen zwischen Live- und Shadow-Tabellen wechseln
+# (FK-Namen dürfen deshalb höchstens 61 Zeichen lang sein)
+SHADOW_FK_SUFFIX = "__s"
+
 # Spalten der CSV und der Staging-Tabelle staging_devices
 CSV_COLUMNS = [
     "PL_NAME",
@@ -60,62 +93,119 @@ CSV_COLUMNS = [
 ]
 
 
+# Fachliche Tabellen (ohne Staging), Reihenfolge wie beim Leeren
+DOMAIN_TABLES = [
+    "devices",
+    "partnumbers",
+    "models",
+    "tbltier3",
+    "tbltier2",
+    "tbltier1",
+    "manufacturers",
+    "rooms",
+    "sites",
+    "regions",
+    "cost_centers",
+    "suppliers",
+    "departments",
+    "pl_names",
+    "owned_bys",
+    "used_bys",
+    "supported_bys",
+    "relations",
+    "types",
+    "depots",
+    "tblpl_status",
+    "tblci_status",
+]
+
+# Einfache Lookup-Tabellen: (Tabelle, Spalte, Staging-Spalte)
+SIMPLE_LOOKUPS = [
+    ("regions", "region", "REGION"),
+    ("pl_names", "pl_name", "PL_NAME"),
+    ("owned_bys", "owned_by", "OWNED_BY"),
+    ("used_bys", "used_by", "USED_BY"),
+    ("supported_bys", "supported_by", "SUPPORTED_BY"),
+    ("suppliers", "suppliername", "SUPPLIERNAME"),
+    ("departments", "department", "DEPARTMENT"),
+    ("cost_centers", "pl_cost_center", "PL_COST_CENTER"),
+    ("manufacturers", "manufacturername", "MANUFACTURERNAME"),
+    ("tbltier1", "tier1", "TIER1"),
+    ("tbltier2", "tier2", "TIER2"),
+    ("tbltier3", "tier3", "TIER3"),
+    ("relations", "relation", "RELATION"),
+    ("types", "type", "TYPE"),
+    ("depots", "depot", "DEPOT"),
+    ("tblpl_status", "pl_status", "PL_STATUS"),
+    ("tblci_status", "ci_status", "CI_STATUS"),
+    ("partnumbers", "partnumber", "PARTNUMBER"),
+]
+
+
 def _conn():
     return connections[DEVICE_ALIAS]
 
 
-def clear_all_tables():
+def clear_all_tables(include_staging=True):
     """
     Leert alle fachlichen Tabellen + Staging, löscht aber nichts.
     (1:1 Model–Partnumber, keine Zwischentabelle mehr.)
+
+    include_staging=False lässt staging_devices stehen (Fallback im
+    Delta-Import, wenn die Staging-Daten schon geladen sind).
     """
-    sql = """
-    SET FOREIGN_KEY_CHECKS = 0;
-    TRUNCATE TABLE devices;
-    TRUNCATE TABLE partnumbers;
-    TRUNCATE TABLE models;
-    TRUNCATE TABLE tbltier3;
-    TRUNCATE TABLE tbltier2;
-    TRUNCATE TABLE tbltier1;
-    TRUNCATE TABLE manufacturers;
-    TRUNCATE TABLE rooms;
-    TRUNCATE TABLE sites;
-    TRUNCATE TABLE regions;
-    TRUNCATE TABLE cost_centers;
-    TRUNCATE TABLE suppliers;
-    TRUNCATE TABLE departments;
-    TRUNCATE TABLE pl_names;
-    TRUNCATE TABLE owned_bys;
-    TRUNCATE TABLE used_bys;
-    TRUNCATE TABLE supported_bys;
-    TRUNCATE TABLE relations;
-    TRUNCATE TABLE types;
-    TRUNCATE TABLE depots;
-    TRUNCATE TABLE tblpl_status;
-    TRUNCATE TABLE tblci_status;
-    TRUNCATE TABLE staging_devices;
-    SET FOREIGN_KEY_CHECKS = 1;
-    """
+    tables = list(DOMAIN_TABLES)
+    if include_staging:
+        tables.append("staging_devices")
+
     with _conn().cursor() as cur:
-        for stmt in sql.strip().split(";"):
-            stmt = stmt.strip()
-            if stmt:
-                cur.execute(stmt + ";")
+        cur.execute("SET FOREIGN_KEY_CHECKS = 0;")
+        try:
+            for table in tables:
+                cur.execute(f"TRUNCATE TABLE {table};")
+        finally:
+            cur.execute("SET FOREIGN_KEY_CHECKS = 1;")
 
 
-def import_csv_to_staging(csv_file):
+def _open_text_stream(csv_file):
     """
-    CSV (mit ';') in die Staging-Tabelle staging_devices laden.
+    Upload (Django UploadedFile oder beliebiges Binär-File) als Text-Stream
+    öffnen. Dekodiert wird inkrementell, die Datei wird nie komplett gelesen.
+    """
+    raw = getattr(csv_file, "file", csv_file)
+    if hasattr(raw, "seek"):
+        raw.seek(0)
+    return io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
 
-    Voraussetzung:
-    - staging_devices hat GENAU die Spalten aus CSV_COLUMNS.
+
+def _iter_staging_rows(reader):
     """
-    data = csv_file.read().decode("utf-8-sig")
-    f = io.StringIO(data)
+    Liefert die CSV-Zeilen lazy als Tupel in der Reihenfolge von CSV_COLUMNS.
+    Komplett leere Zeilen werden übersprungen, Werte getrimmt.
+    """
+    for row in reader:
+        # komplett leere Zeilen ignorieren
+        if not any(row.values()):
+            continue
+
+        yield tuple(
+            (row.get(col, "") or "").strip()
+            for col in CSV_COLUMNS
+        )
+
 
-    reader = csv.DictReader(f, delimiter=";")
+def _batched(iterable, size):
+    """Teilt ein Iterable in Listen mit maximal ``size`` Elementen."""
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
 
-    insert_sql = """
+
+def _staging_insert_sql():
+    return """
         INSERT INTO staging_devices (
             {cols}
         ) VALUES (
@@ -126,352 +216,545 @@ def import_csv_to_staging(csv_file):
         placeholders=", ".join(["%s"] * len(CSV_COLUMNS)),
     )
 
-    rows = []
-    for row in reader:
-        # komplett leere Zeilen ignorieren
-        if not any(row.values()):
-            continue
 
-        values = [
-            (row.get(col, "") or "").strip()
-            for col in CSV_COLUMNS
-        ]
-        rows.append(values)
+def _insert_staging_batches(cur, rows, batch_size, progress=None):
+    """
+    Engine "executemany": Zeilen blockweise per INSERT ... VALUES laden.
+    """
+    insert_sql = _staging_insert_sql()
+    imported = 0
+    for batch in _batched(rows, batch_size):
+        cur.executemany(insert_sql, batch)
+        imported += len(batch)
+        if progress:
+            progress(imported)
+    return imported
 
-    with _conn().cursor() as cur:
+
+def _load_staging_via_infile(cur, rows, batch_size, progress=None):
+    """
+    Engine "load_data": Zeilen normalisiert in eine temporäre Datei schreiben
+    und per LOAD DATA LOCAL INFILE laden.
+
+    Lehnt der Server (oder der Client ohne ``local_infile``) das ab, wird
+    die temporäre Datei per executemany geladen.
+
+    Rückgabe: (Anzahl Zeilen, tatsächlich benutzte Engine)
+    """
+    # delete=False: unter Windows kann eine offene NamedTemporaryFile
+    # nicht ein zweites Mal (vom MariaDB-Client) geöffnet werden
+    tmp = tempfile.NamedTemporaryFile(
+        mode="w", encoding="utf-8", newline="", suffix=".csv", delete=False
+    )
+    try:
+        with tmp:
+            writer = csv.writer(
+                tmp,
+                delimiter=";",
+                quotechar='"',
+                quoting=csv.QUOTE_ALL,
+                lineterminator="\n",
+            )
+            imported = 0
+            for row in rows:
+                writer.writerow(row)
+                imported += 1
+                if progress and imported % batch_size == 0:
+                    progress(imported)
+
+        load_sql = """
+            LOAD DATA LOCAL INFILE %s
+            INTO TABLE staging_devices
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY ';' ENCLOSED BY '"' ESCAPED BY ''
+            LINES TERMINATED BY '\\n'
+            ({cols})
+        """.format(cols=", ".join(CSV_COLUMNS))
+
+        try:
+            cur.execute(load_sql, [tmp.name])
+            return imported, "load_data"
+        except DatabaseError as exc:
+            code = exc.args[0] if exc.args else None
+            if code not in LOCAL_INFILE_REJECTED_CODES:
+                raise
+            logger.warning(
+                "LOAD DATA LOCAL INFILE nicht erlaubt (%s), Fallback auf executemany",
+                exc,
+            )
+
+        # Fallback: normalisierte Datei erneut lesen
         cur.execute("TRUNCATE TABLE staging_devices;")
-        if rows:
-            cur.executemany(insert_sql, rows)
+        with open(tmp.name, encoding="utf-8", newline="") as f:
+            reader = csv.reader(f, delimiter=";", quotechar='"')
+            fallback_rows = (tuple(row) for row in reader)
+            imported = _insert_staging_batches(
+                cur, fallback_rows, batch_size, progress
+            )
+        return imported, "executemany"
+    finally:
+        os.unlink(tmp.name)
 
 
-def populate_normalized_from_staging():
+def import_csv_to_staging(
+    csv_file, batch_size=STAGING_BATCH_SIZE, engine=None, progress=None
+):
     """
-    Füllt die normalisierte Struktur aus staging_devices.
-    Variante mit 1:1 Model–Partnumber (models.partnumber_id als FK).
+    CSV (mit ';') in die Staging-Tabelle staging_devices laden.
+
+    Die Datei wird gestreamt: inkrementell dekodiert, Zeile für Zeile
+    geparst und normalisiert (getrimmt, leere Zeilen raus, auf CSV_COLUMNS
+    projiziert). Der Speicherverbrauch hängt nicht von der Dateigröße ab.
+
+    Engines (Default aus settings.DEVICE_IMPORT_ENGINE):
+    - "executemany": INSERT in Blöcken à ``batch_size`` Zeilen
+    - "load_data":   LOAD DATA LOCAL INFILE über eine temporäre Datei,
+                     Fallback auf executemany, wenn der Server das ablehnt
+
+    ``progress`` (optional) wird mit der Anzahl bisher verarbeiteter Zeilen
+    aufgerufen, etwa einmal pro Batch.
+
+    Voraussetzung:
+    - staging_devices hat GENAU die Spalten aus CSV_COLUMNS.
+
+    Rückgabe: Dict mit engine, rows, seconds, rows_per_second.
     """
-    conn = _conn()
+    engine = engine or STAGING_ENGINE
+    if engine not in STAGING_ENGINES:
+        raise ValueError(f"Unbekannte Import-Engine: {engine!r}")
+    if batch_size < 1:
+        raise ValueError("batch_size muss >= 1 sein")
 
-    with transaction.atomic(using=DEVICE_ALIAS):
-        with conn.cursor() as cur:
-            # Regions
-            cur.execute("""
-                INSERT INTO regions (region)
-                SELECT DISTINCT REGION
-                FROM staging_devices
-                WHERE REGION IS NOT NULL AND REGION <> '';
-            """)
+    started = time.monotonic()
+    text = _open_text_stream(csv_file)
+    try:
+        reader = csv.DictReader(text, delimiter=";")
+        rows = _iter_staging_rows(reader)
 
-            # Sites
-            cur.execute("""
-                INSERT INTO sites (company, sitegroup, site, region_id)
-                SELECT DISTINCT
-                    t.COMPANY,
-                    t.SITEGROUP,
-                    t.SITE,
-                    r.region_id
-                FROM staging_devices t
-                JOIN regions r ON r.region = t.REGION
-                WHERE t.SITE IS NOT NULL AND t.SITE <> '';
-            """)
+        with _conn().cursor() as cur:
+            cur.execute("TRUNCATE TABLE staging_devices;")
+            if engine == "load_data":
+                imported, engine = _load_staging_via_infile(
+                    cur, rows, batch_size, progress
+                )
+            else:
+                imported = _insert_staging_batches(cur, rows, batch_size, progress)
+    finally:
+        # Wrapper lösen, damit das Upload-File nicht mit geschlossen wird
+        text.detach()
 
-            # Rooms
-            cur.execute("""
-                INSERT INTO rooms (room, physicalposition, ci_room, floor, site_id)
-                SELECT DISTINCT
-                    t.ROOM,
-                    t.PHYSICALPOSITION,
-                    t.CI_ROOM,
-                    t.FLOOR,
-                    s.site_id
-                FROM staging_devices t
-                JOIN sites s ON s.site = t.SITE
-                WHERE
-                    (t.ROOM IS NOT NULL AND t.ROOM <> '')
-                    OR (t.CI_ROOM IS NOT NULL AND t.CI_ROOM <> '');
-            """)
+    seconds = time.monotonic() - started
+    rows_per_second = imported / seconds if seconds > 0 else float(imported)
+    logger.info(
+        "staging_devices: %d Zeilen in %.2fs geladen (%s, %.0f Zeilen/s)",
+        imported, seconds, engine, rows_per_second,
+    )
+    return {
+        "engine": engine,
+        "rows": imported,
+        "seconds": seconds,
+        "rows_per_second": rows_per_second,
+    }
 
-            # einfache Lookup-Tabellen
-            cur.execute("""
-                INSERT INTO pl_names (pl_name)
-                SELECT DISTINCT PL_NAME
-                FROM staging_devices
-                WHERE PL_NAME IS NOT NULL AND PL_NAME <> '';
-            """)
 
-            cur.execute("""
-                INSERT INTO owned_bys (owned_by)
-                SELECT DISTINCT OWNED_BY
-                FROM staging_devices
-                WHERE OWNED_BY IS NOT NULL AND OWNED_BY <> '';
-            """)
+def _insert_lookups(cur):
+    """
+    Lookup-Tabellen aus staging_devices befüllen.
 
-            cur.execute("""
-                INSERT INTO used_bys (used_by)
-                SELECT DISTINCT USED_BY
-                FROM staging_devices
-                WHERE USED_BY IS NOT NULL AND USED_BY <> '';
-            """)
+    Es werden nur Werte angehängt, die noch nicht vorhanden sind. Nach
+    clear_all_tables() ergibt das denselben Inhalt wie ein reines
+    INSERT ... SELECT DISTINCT, beim Delta-Import bleiben bestehende IDs
+    stabil.
+    """
+    # einfache Lookup-Tabellen (inkl. Regions und Partnumbers)
+    for table, column, source in SIMPLE_LOOKUPS:
+        cur.execute(f"""
+            INSERT INTO {table} ({column})
+            SELECT DISTINCT t.{source}
+            FROM staging_devices t
+            WHERE t.{source} IS NOT NULL AND t.{source} <> ''
+              AND NOT EXISTS (
+                  SELECT 1 FROM {table} x WHERE x.{column} = t.{source}
+              );
+        """)
 
-            cur.execute("""
-                INSERT INTO supported_bys (supported_by)
-                SELECT DISTINCT SUPPORTED_BY
-                FROM staging_devices
-                WHERE SUPPORTED_BY IS NOT NULL AND SUPPORTED_BY <> '';
-            """)
+    # Sites
+    cur.execute("""
+        INSERT INTO sites (company, sitegroup, site, region_id)
+        SELECT DISTINCT
+            t.COMPANY,
+            t.SITEGROUP,
+            t.SITE,
+            r.region_id
+        FROM staging_devices t
+        JOIN regions r ON r.region = t.REGION
+        WHERE t.SITE IS NOT NULL AND t.SITE <> ''
+          AND NOT EXISTS (
+              SELECT 1 FROM sites x
+              WHERE x.site = t.SITE
+                AND x.company   <=> t.COMPANY
+                AND x.sitegroup <=> t.SITEGROUP
+                AND x.region_id <=> r.region_id
+          );
+    """)
 
-            cur.execute("""
-                INSERT INTO suppliers (suppliername)
-                SELECT DISTINCT SUPPLIERNAME
-                FROM staging_devices
-                WHERE SUPPLIERNAME IS NOT NULL AND SUPPLIERNAME <> '';
-            """)
+    # Rooms
+    cur.execute("""
+        INSERT INTO rooms (room, physicalposition, ci_room, floor, site_id)
+        SELECT DISTINCT
+            t.ROOM,
+            t.PHYSICALPOSITION,
+            t.CI_ROOM,
+            t.FLOOR,
+            s.site_id
+        FROM staging_devices t
+        JOIN sites s ON s.site = t.SITE
+        WHERE
+            ((t.ROOM IS NOT NULL AND t.ROOM <> '')
+             OR (t.CI_ROOM IS NOT NULL AND t.CI_ROOM <> ''))
+          AND NOT EXISTS (
+              SELECT 1 FROM rooms x
+              WHERE x.site_id = s.site_id
+                AND x.room             <=> t.ROOM
+                AND x.physicalposition <=> t.PHYSICALPOSITION
+                AND x.ci_room          <=> t.CI_ROOM
+                AND x.floor            <=> t.FLOOR
+          );
+    """)
 
-            cur.execute("""
-                INSERT INTO departments (department)
-                SELECT DISTINCT DEPARTMENT
-                FROM staging_devices
-                WHERE DEPARTMENT IS NOT NULL AND DEPARTMENT <> '';
-            """)
+    # Models direkt mit partnumber_id
+    cur.execute("""
+        INSERT INTO models (manu_id, tier1_id, tier2_id, tier3_id, model, partnumber_id)
+        SELECT DISTINCT
+            man.manu_id,
+            t1.tier1_id,
+            t2.tier2_id,
+            t3.tier3_id,
+            t.MODEL,
+            p.partnumber_id
+        FROM staging_devices t
+        LEFT JOIN manufacturers man ON man.manufacturername = t.MANUFACTURERNAME
+        LEFT JOIN tbltier1       t1  ON t1.tier1 = t.TIER1
+        LEFT JOIN tbltier2       t2  ON t2.tier2 = t.TIER2
+        LEFT JOIN tbltier3       t3  ON t3.tier3 = t.TIER3
+        LEFT JOIN partnumbers    p   ON p.partnumber = t.PARTNUMBER
+        WHERE t.MODEL IS NOT NULL AND t.MODEL <> ''
+          AND NOT EXISTS (
+              SELECT 1 FROM models x
+              WHERE x.model = t.MODEL
+                AND x.manu_id       <=> man.manu_id
+                AND x.tier1_id      <=> t1.tier1_id
+                AND x.tier2_id      <=> t2.tier2_id
+                AND x.tier3_id      <=> t3.tier3_id
+                AND x.partnumber_id <=> p.partnumber_id
+          );
+    """)
 
-            cur.execute("""
-                INSERT INTO cost_centers (pl_cost_center)
-                SELECT DISTINCT PL_COST_CENTER
-                FROM staging_devices
-                WHERE PL_COST_CENTER IS NOT NULL AND PL_COST_CENTER <> '';
-            """)
 
-            cur.execute("""
-                INSERT INTO manufacturers (manufacturername)
-                SELECT DISTINCT MANUFACTURERNAME
-                FROM staging_devices
-                WHERE MANUFACTURERNAME IS NOT NULL AND MANUFACTURERNAME <> '';
-            """)
+# Schlüssel für den Delta-Import: CI_ID, ersatzweise SERIALNUMBER
+DEVICE_KEY_SQL = """
+    CASE
+        WHEN t.CI_ID IS NOT NULL AND t.CI_ID <> ''
+            THEN CONCAT('CI:', t.CI_ID)
+        WHEN t.SERIALNUMBER IS NOT NULL AND t.SERIALNUMBER <> ''
+            THEN CONCAT('SN:', t.SERIALNUMBER)
+    END
+"""
 
-            cur.execute("""
-                INSERT INTO tbltier1 (tier1)
-                SELECT DISTINCT TIER1
-                FROM staging_devices
-                WHERE TIER1 IS NOT NULL AND TIER1 <> '';
-            """)
+# Spalten von devices und ihr Ausdruck im SELECT aus _device_select_sql()
+DEVICE_COLUMN_SQL = [
+    ("serialnumber", "t.SERIALNUMBER"),
+    ("shortdescription", "t.SHORTDESCRIPTION"),
+    ("destination_classid", "t.DESTINATION_CLASSID"),
+    ("purchase_date", "t.PURCHASE_DATE"),
+    ("received_date", "t.RECEIVED_DATE"),
+    ("installation_date", "t.INSTALLATION_DATE"),
+    ("available_date", "t.AVAILABLE_DATE"),
+    ("return_date", "t.RETURN_DATE"),
+    ("disposal_date", "t.DISPOSAL_DATE"),
+    ("mark_as_deleted", "t.MARK_AS_DELETED"),
+    ("create_date", "t.CREATE_DATE"),
+    ("modified_date", "t.MODIFIED_DATE"),
+    ("role", "t.ROLE"),
+    ("childname", "t.CHILDNAME"),
+    ("confbuildnumber", "t.CONFBASICNUMBER"),
+    ("buildnumber", "t.BUILDNUMBER"),
+    ("additional_information", "t.ADDITIONAL_INFORMATION"),
+    ("supported", "t.SUPPORTED"),
+    ("pl_name_id", "pn.pl_name_id"),
+    ("owner_id", "ob.owner_id"),
+    ("supporter_id", "sb.supporter_id"),
+    ("user_id", "ub.user_id"),
+    ("model_id", "mk.model_id"),
+    ("costcenter_id", "cc.cc_id"),
+    ("supplier_id", "sup.supplier_id"),
+    ("room_id", "rk.room_id"),
+    ("relation_id", "rel.relation_id"),
+    ("department_id", "dept.department_id"),
+    ("type_id", "ty.type_id"),
+    ("depot_id", "dp.depot_id"),
+    ("pl_status_id", "pls.pl_status_id"),
+    ("ci_status_id", "cis.ci_status_id"),
 
-            cur.execute("""
-                INSERT INTO tbltier2 (tier2)
-                SELECT DISTINCT TIER2
-                FROM staging_devices
-                WHERE TIER2 IS NOT NULL AND TIER2 <> '';
-            """)
+    # Delta-Import
+    ("device_key", DEVICE_KEY_SQL),
+    ("row_hash", "MD5(CONCAT_WS(CHAR(31 USING utf8mb4), {cols}))".format(
+        cols=", ".join(f"t.{col}" for col in CSV_COLUMNS),
+    )),
+]
 
-            cur.execute("""
-                INSERT INTO tbltier3 (tier3)
-                SELECT DISTINCT TIER3
-                FROM staging_devices
-                WHERE TIER3 IS NOT NULL AND TIER3 <> '';
-            """)
+DEVICE_COLUMNS = [column for column, _ in DEVICE_COLUMN_SQL]
 
-            cur.execute("""
-                INSERT INTO relations (relation)
-                SELECT DISTINCT RELATION
-                FROM staging_devices
-                WHERE RELATION IS NOT NULL AND RELATION <> '';
-            """)
+# FK-Auflösung als Joins auf die natürlichen Schlüssel der Lookup-Tabellen
+# (statt einer korrelierten Subquery pro FK und Staging-Zeile).
+#
+# Die einfachen Lookups sind eindeutig, weil _insert_lookups nur fehlende
+# Werte anhängt. models und rooms können pro Schlüssel mehrere Zeilen haben
+# (z. B. gleiches Modell mit anderer Partnumber) -> vorher auf MIN(id)
+# gruppieren, damit jede Staging-Zeile genau eine devices-Zeile ergibt.
+#
+# Die Staging-Spalten sind nie NULL (beide Import-Engines schreiben ''),
+# deshalb reicht beim Modell der einfache Vergleich statt
+# "t.X IS NULL OR ..." und der Join bleibt indexfähig.
+DEVICE_FK_JOINS_SQL = """
+    LEFT JOIN pl_names      pn   ON pn.pl_name        = t.PL_NAME
+    LEFT JOIN owned_bys     ob   ON ob.owned_by       = t.OWNED_BY
+    LEFT JOIN supported_bys sb   ON sb.supported_by   = t.SUPPORTED_BY
+    LEFT JOIN used_bys      ub   ON ub.used_by        = t.USED_BY
+    LEFT JOIN cost_centers  cc   ON cc.pl_cost_center = t.PL_COST_CENTER
+    LEFT JOIN suppliers     sup  ON sup.suppliername  = t.SUPPLIERNAME
+    LEFT JOIN relations     rel  ON rel.relation      = t.RELATION
+    LEFT JOIN departments   dept ON dept.department   = t.DEPARTMENT
+    LEFT JOIN types         ty   ON ty.type           = t.TYPE
+    LEFT JOIN depots        dp   ON dp.depot          = t.DEPOT
+    LEFT JOIN tblpl_status  pls  ON pls.pl_status     = t.PL_STATUS
+    LEFT JOIN tblci_status  cis  ON cis.ci_status     = t.CI_STATUS
 
-            cur.execute("""
-                INSERT INTO types (type)
-                SELECT DISTINCT TYPE
-                FROM staging_devices
-                WHERE TYPE IS NOT NULL AND TYPE <> '';
-            """)
+    -- FK: models (inkl. Hersteller + Tiers)
+    LEFT JOIN (
+        SELECT
+            m.model,
+            man.manufacturername,
+            t1.tier1,
+            t2.tier2,
+            t3.tier3,
+            MIN(m.model_id) AS model_id
+        FROM models m
+        LEFT JOIN manufacturers man ON man.manu_id  = m.manu_id
+        LEFT JOIN tbltier1       t1  ON t1.tier1_id = m.tier1_id
+        LEFT JOIN tbltier2       t2  ON t2.tier2_id = m.tier2_id
+        LEFT JOIN tbltier3       t3  ON t3.tier3_id = m.tier3_id
+        GROUP BY m.model, man.manufacturername, t1.tier1, t2.tier2, t3.tier3
+    ) mk
+        ON  mk.model            = t.MODEL
+        AND mk.manufacturername = t.MANUFACTURERNAME
+        AND mk.tier1            = t.TIER1
+        AND mk.tier2            = t.TIER2
+        AND mk.tier3            = t.TIER3
 
-            cur.execute("""
-                INSERT INTO depots (depot)
-                SELECT DISTINCT DEPOT
-                FROM staging_devices
-                WHERE DEPOT IS NOT NULL AND DEPOT <> '';
-            """)
+    -- FK: rooms (über SITE + ROOM/CI_ROOM)
+    LEFT JOIN (
+        SELECT
+            s.site,
+            IFNULL(r.room, '')    AS room_key,
+            IFNULL(r.ci_room, '') AS ci_room_key,
+            MIN(r.room_id)        AS room_id
+        FROM rooms r
+        JOIN sites s ON s.site_id = r.site_id
+        GROUP BY s.site, IFNULL(r.room, ''), IFNULL(r.ci_room, '')
+    ) rk
+        ON  rk.site        = t.SITE
+        AND rk.room_key    = IFNULL(t.ROOM, '')
+        AND rk.ci_room_key = IFNULL(t.CI_ROOM, '')
+"""
 
-            cur.execute("""
-                INSERT INTO tblpl_status (pl_status)
-                SELECT DISTINCT PL_STATUS
-                FROM staging_devices
-                WHERE PL_STATUS IS NOT NULL AND PL_STATUS <> '';
-            """)
 
+def _device_select_sql():
+    """
+    SELECT, der pro Zeile in staging_devices genau eine devices-Zeile
+    (mit aufgelösten FKs) liefert. Spaltennamen = devices-Spalten.
+    """
+    select_list = ",\n".join(
+        f"{expr} AS {column}" for column, expr in DEVICE_COLUMN_SQL
+    )
+    return f"SELECT\n{select_list}\nFROM staging_devices t\n{DEVICE_FK_JOINS_SQL}"
+
+
+def populate_normalized_from_staging():
+    """
+    Füllt die normalisierte Struktur aus staging_devices.
+    Variante mit 1:1 Model–Partnumber (models.partnumber_id als FK).
+
+    Spalten und Indizes dafür legt migrate_device_db an (db_schema).
+    """
+    conn = _conn()
+
+    with transaction.atomic(using=DEVICE_ALIAS):
+        with conn.cursor() as cur:
+            _insert_lookups(cur)
+
+            # Devices: genau 1 Device pro Zeile in staging_devices
             cur.execute("""
-                INSERT INTO tblci_status (ci_status)
-                SELECT DISTINCT CI_STATUS
-                FROM staging_devices
-                WHERE CI_STATUS IS NOT NULL AND CI_STATUS <> '';
+                INSERT INTO devices ({cols})
+                {select};
+            """.format(
+                cols=", ".join(DEVICE_COLUMNS),
+                select=_device_select_sql(),
+            ))
+
+
+def apply_delta_from_staging():
+    """
+    Delta-Import: staging_devices gegen den Bestand in devices abgleichen,
+    statt alles zu leeren und neu aufzubauen.
+
+    - Schlüssel ist device_key (CI_ID, ersatzweise SERIALNUMBER)
+    - neue Geräte werden eingefügt, geänderte (row_hash) aktualisiert
+    - Geräte, die im Import fehlen, bekommen deleted_at gesetzt
+    - Lookup-Tabellen werden nur ergänzt, nie geleert
+    - Zeilen ganz ohne Schlüssel werden bei jedem Import ersetzt
+
+    Ist der Schlüssel in staging_devices nicht eindeutig, wird nichts
+    geändert und None zurückgegeben (-> Aufrufer macht einen Vollimport).
+    Sonst: Dict mit inserted, updated, deleted.
+    """
+    conn = _conn()
+
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT COUNT(*)
+            FROM (
+                SELECT {DEVICE_KEY_SQL} AS device_key
+                FROM staging_devices t
+                GROUP BY device_key
+                HAVING device_key IS NOT NULL AND COUNT(*) > 1
+            ) dup;
+        """)
+        duplicates = cur.fetchone()[0]
+
+    if duplicates:
+        logger.warning(
+            "Delta-Import: %d doppelte Schlüssel in staging_devices, "
+            "Fallback auf Vollimport", duplicates,
+        )
+        return None
+
+    update_cols = [col for col in DEVICE_COLUMNS if col != "device_key"]
+
+    with transaction.atomic(using=DEVICE_ALIAS):
+        with conn.cursor() as cur:
+            _insert_lookups(cur)
+
+            # aufgelöste Importzeilen einmal materialisieren
+            cur.execute("DROP TEMPORARY TABLE IF EXISTS tmp_delta_devices;")
+            cur.execute(f"""
+                CREATE TEMPORARY TABLE tmp_delta_devices (
+                    INDEX ix_tmp_delta_key (device_key)
+                )
+                {_device_select_sql()};
             """)
 
-            # Partnumbers vor Models
+            # geänderte (oder wieder aufgetauchte) Geräte
             cur.execute("""
-                INSERT INTO partnumbers (partnumber)
-                SELECT DISTINCT PARTNUMBER
-                FROM staging_devices
-                WHERE PARTNUMBER IS NOT NULL AND PARTNUMBER <> '';
-            """)
+                UPDATE devices d
+                JOIN tmp_delta_devices n ON n.device_key = d.device_key
+                SET {assignments},
+                    d.deleted_at = NULL
+                WHERE NOT (d.row_hash <=> n.row_hash)
+                   OR d.deleted_at IS NOT NULL;
+            """.format(
+                assignments=",\n".join(f"d.{col} = n.{col}" for col in update_cols),
+            ))
+            updated = cur.rowcount
+
+            # Zeilen ohne Schlüssel lassen sich nicht zuordnen -> ersetzen
+            cur.execute("DELETE FROM devices WHERE device_key IS NULL;")
 
-            # Models direkt mit partnumber_id
+            # neue Geräte
             cur.execute("""
-                INSERT INTO models (manu_id, tier1_id, tier2_id, tier3_id, model, partnumber_id)
-                SELECT DISTINCT
-                    man.manu_id,
-                    t1.tier1_id,
-                    t2.tier2_id,
-                    t3.tier3_id,
-                    t.MODEL,
-                    p.partnumber_id
-                FROM staging_devices t
-                LEFT JOIN manufacturers man ON man.manufacturername = t.MANUFACTURERNAME
-                LEFT JOIN tbltier1       t1  ON t1.tier1 = t.TIER1
-                LEFT JOIN tbltier2       t2  ON t2.tier2 = t.TIER2
-                LEFT JOIN tbltier3       t3  ON t3.tier3 = t.TIER3
-                LEFT JOIN partnumbers    p   ON p.partnumber = t.PARTNUMBER
-                WHERE t.MODEL IS NOT NULL AND t.MODEL <> '';
-            """)
+                INSERT INTO devices ({cols})
+                SELECT {cols}
+                FROM tmp_delta_devices n
+                WHERE n.device_key IS NULL
+                   OR NOT EXISTS (
+                       SELECT 1 FROM devices d WHERE d.device_key = n.device_key
+                   );
+            """.format(cols=", ".join(DEVICE_COLUMNS)))
+            inserted = cur.rowcount
 
-                       # Devices: genau 1 Device pro Zeile in staging_devices
+            # fehlende Geräte als gelöscht markieren
             cur.execute("""
-                INSERT INTO devices (
-                  serialnumber, shortdescription, destination_classid,
-                  purchase_date, received_date, installation_date,
-                  available_date, return_date, disposal_date,
-                  mark_as_deleted, create_date, modified_date,
-                  role, childname, confbuildnumber, buildnumber,
-                  additional_information, supported,
-                  pl_name_id, owner_id, supporter_id, user_id,
-                  model_id, costcenter_id, supplier_id,
-                  room_id, relation_id, department_id,
-                  type_id, depot_id, pl_status_id, ci_status_id
-                )
-                SELECT
-                  t.SERIALNUMBER,
-                  t.SHORTDESCRIPTION,
-                  t.DESTINATION_CLASSID,
-                  t.PURCHASE_DATE,
-                  t.RECEIVED_DATE,
-                  t.INSTALLATION_DATE,
-                  t.AVAILABLE_DATE,
-                  t.RETURN_DATE,
-                  t.DISPOSAL_DATE,
-                  t.MARK_AS_DELETED,
-                  t.CREATE_DATE,
-                  t.MODIFIED_DATE,
-                  t.ROLE,
-                  t.CHILDNAME,
-                  t.CONFBASICNUMBER,
-                  t.BUILDNUMBER,
-                  t.ADDITIONAL_INFORMATION,
-                  t.SUPPORTED,
-
-                  -- FK: pl_names
-                  (SELECT pn.pl_name_id
-                     FROM pl_names pn
-                    WHERE pn.pl_name = t.PL_NAME
-                    LIMIT 1),
-
-                  -- FK: owned_bys
-                  (SELECT ob.owner_id
-                     FROM owned_bys ob
-                    WHERE ob.owned_by = t.OWNED_BY
-                    LIMIT 1),
-
-                  -- FK: supported_bys
-                  (SELECT sb.supporter_id
-                     FROM supported_bys sb
-                    WHERE sb.supported_by = t.SUPPORTED_BY
-                    LIMIT 1),
-
-                  -- FK: used_bys
-                  (SELECT ub.user_id
-                     FROM used_bys ub
-                    WHERE ub.used_by = t.USED_BY
-                    LIMIT 1),
-
-                  -- FK: models (inkl. Hersteller + Tiers)
-                  (SELECT m.model_id
-                     FROM models m
-                     LEFT JOIN manufacturers man ON man.manu_id  = m.manu_id
-                     LEFT JOIN tbltier1       t1  ON t1.tier1_id = m.tier1_id
-                     LEFT JOIN tbltier2       t2  ON t2.tier2_id = m.tier2_id
-                     LEFT JOIN tbltier3       t3  ON t3.tier3_id = m.tier3_id
-                    WHERE m.model = t.MODEL
-                      AND (t.MANUFACTURERNAME IS NULL OR man.manufacturername = t.MANUFACTURERNAME)
-                      AND (t.TIER1 IS NULL OR t1.tier1 = t.TIER1)
-                      AND (t.TIER2 IS NULL OR t2.tier2 = t.TIER2)
-                      AND (t.TIER3 IS NULL OR t3.tier3 = t.TIER3)
-                    LIMIT 1),
-
-                  -- FK: cost_centers
-                  (SELECT cc.cc_id
-                     FROM cost_centers cc
-                    WHERE cc.pl_cost_center = t.PL_COST_CENTER
-                    LIMIT 1),
-
-                  -- FK: suppliers
-                  (SELECT sup.supplier_id
-                     FROM suppliers sup
-                    WHERE sup.suppliername = t.SUPPLIERNAME
-                    LIMIT 1),
-
-                  -- FK: rooms (über SITE + ROOM/CI_ROOM)
-                  (SELECT r.room_id
-                     FROM rooms r
-                     JOIN sites s ON s.site_id = r.site_id
-                    WHERE s.site = t.SITE
-                      AND IFNULL(r.room, '')    = IFNULL(t.ROOM, '')
-                      AND IFNULL(r.ci_room, '') = IFNULL(t.CI_ROOM, '')
-                    LIMIT 1),
-
-                  -- FK: relations
-                  (SELECT rel.relation_id
-                     FROM relations rel
-                    WHERE rel.relation = t.RELATION
-                    LIMIT 1),
-
-                  -- FK: departments
-                  (SELECT dept.department_id
-                     FROM departments dept
-                    WHERE dept.department = t.DEPARTMENT
-                    LIMIT 1),
-
-                  -- FK: types
-                  (SELECT ty.type_id
-                     FROM types ty
-                    WHERE ty.type = t.TYPE
-                    LIMIT 1),
-
-                  -- FK: depots
-                  (SELECT dp.depot_id
-                     FROM depots dp
-                    WHERE dp.depot = t.DEPOT
-                    LIMIT 1),
-
-                  -- FK: PL-Status
-                  (SELECT pls.pl_status_id
-                     FROM tblpl_status pls
-                    WHERE pls.pl_status = t.PL_STATUS
-                    LIMIT 1),
-
-                  -- FK: CI-Status
-                  (SELECT cis.ci_status_id
-                     FROM tblci_status cis
-                    WHERE cis.ci_status = t.CI_STATUS
-                    LIMIT 1)
-
-                FROM staging_devices t;
+                UPDATE devices d
+                SET d.deleted_at = NOW()
+                WHERE d.deleted_at IS NULL
+                  AND d.device_key IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM tmp_delta_devices n
+                      WHERE n.device_key = d.device_key
+                  );
             """)
+            deleted = cur.rowcount
 
+            cur.execute("DROP TEMPORARY TABLE IF EXISTS tmp_delta_devices;")
 
+    logger.info(
+        "Delta-Import: %d neu, %d geändert, %d gelöscht",
+        inserted, updated, deleted,
+    )
+    return {"inserted": inserted, "updated": updated, "deleted": deleted}
 
 
-def recreate_device_flat_view():
-    """
-    View device_flat neu anlegen (1:1 Model–Partnumber, kein zwPartnumbersModels mehr).
-    """
-    sql = """
-    DROP VIEW IF EXISTS device_flat;
-    CREATE VIEW device_flat AS
+# Fachliche Spalten von device_flat in Anzeigereihenfolge
+# (DEVICE_ID ist nur technischer Schlüssel für Pagination/Suche)
+DEVICE_FLAT_COLUMNS = [
+    "PL_NAME",
+    "REGION",
+    "COMPANY",
+    "SITEGROUP",
+    "SITE",
+    "ROOM",
+    "PHYSICALPOSITION",
+    "SHORTDESCRIPTION",
+    "DEPARTMENT",
+    "OWNED_BY",
+    "USED_BY",
+    "SUPPORTED_BY",
+    "PL_COST_CENTER",
+    "PL_STATUS",
+    "RELATION",
+    "DESTINATION_CLASSID",
+    "TIER1",
+    "TIER2",
+    "TIER3",
+    "MODEL",
+    "MANUFACTURERNAME",
+    "SERIALNUMBER",
+    "CI_ROOM",
+    "FLOOR",
+    "PARTNUMBER",
+    "SUPPLIERNAME",
+    "CI_STATUS",
+    "PURCHASE_DATE",
+    "RECEIVED_DATE",
+    "INSTALLATION_DATE",
+    "AVAILABLE_DATE",
+    "RETURN_DATE",
+    "DISPOSAL_DATE",
+    "MARK_AS_DELETED",
+    "CREATE_DATE",
+    "MODIFIED_DATE",
+    "ROLE",
+    "CHILDNAME",
+    "CONFBASICNUMBER",
+    "BUILDNUMBER",
+    "TYPE",
+    "ADDITIONAL_INFORMATION",
+    "DEPOT",
+    "SUPPORTED",
+]
+
+# Flache Sicht auf ein Gerät (Basis für View bzw. Tabelle device_flat)
+DEVICE_FLAT_SELECT_SQL = """
     SELECT
       pn.pl_name                         AS PL_NAME,
       rg.region                          AS REGION,
@@ -516,7 +799,9 @@ def recreate_device_flat_view():
       tp.type                            AS `TYPE`,
       d.additional_information           AS ADDITIONAL_INFORMATION,
       dp.depot                           AS DEPOT,
-      d.supported                        AS SUPPORTED
+      d.supported                        AS SUPPORTED,
+      d.device_id                        AS DEVICE_ID,
+      s.site_id                          AS SITE_ID
     FROM devices d
     LEFT JOIN pl_names          pn   ON pn.pl_name_id      = d.pl_name_id
     LEFT JOIN owned_bys         ob   ON ob.owner_id        = d.owner_id
@@ -538,10 +823,217 @@ def recreate_device_flat_view():
     LEFT JOIN tbltier1          t1   ON t1.tier1_id        = m.tier1_id
     LEFT JOIN tbltier2          t2   ON t2.tier2_id        = m.tier2_id
     LEFT JOIN tbltier3          t3   ON t3.tier3_id        = m.tier3_id
-    LEFT JOIN suppliers         sup  ON sup.supplier_id    = d.supplier_id;
+    LEFT JOIN suppliers         sup  ON sup.supplier_id    = d.supplier_id
+    WHERE d.deleted_at IS NULL
+"""
+
+# device_flat als View (False) oder als materialisierte Tabelle (True)
+DEVICE_FLAT_MATERIALIZED = getattr(settings, "DEVICE_FLAT_MATERIALIZED", False)
+
+# Join-View, aus der die materialisierte device_flat-Tabelle gebaut wird
+DEVICE_FLAT_SOURCE_VIEW = "device_flat_source"
+
+# Indizes der materialisierten device_flat-Tabelle (gängige Filter + Sortierung)
+DEVICE_FLAT_INDEXES = [
+    ("ix_device_flat_site", ("SITE",)),
+    ("ix_device_flat_ci_status", ("CI_STATUS",)),
+    ("ix_device_flat_tier3", ("TIER3",)),
+    ("ix_device_flat_device_id", ("DEVICE_ID",)),
+    ("ix_device_flat_site_id", ("SITE_ID",)),
+    ("ix_device_flat_order", ("SITE", "PL_NAME", "SERIALNUMBER", "DEVICE_ID")),
+]
+
+
+def _table_type(cur, name):
+    """'BASE TABLE', 'VIEW' oder None für ein Objekt im aktuellen Schema."""
+    cur.execute(
+        """
+        SELECT TABLE_TYPE
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s;
+        """,
+        [name],
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _drop_table_or_view(cur, name):
+    table_type = _table_type(cur, name)
+    if table_type == "VIEW":
+        cur.execute(f"DROP VIEW {name};")
+    elif table_type is not None:
+        cur.execute(f"DROP TABLE {name};")
+
+
+def _swap_in_table(cur, name, new_name):
+    """
+    ``new_name`` per RENAME TABLE atomar unter ``name`` veröffentlichen und
+    das alte Objekt (Tabelle oder View) danach löschen.
+    """
+    old_name = f"{name}__old"
+    _drop_table_or_view(cur, old_name)
+    if _table_type(cur, name) is None:
+        cur.execute(f"RENAME TABLE {new_name} TO {name};")
+        return
+    cur.execute(f"RENAME TABLE {name} TO {old_name}, {new_name} TO {name};")
+    _drop_table_or_view(cur, old_name)
+
+
+def recreate_device_flat_view():
     """
+    View device_flat neu anlegen (1:1 Model–Partnumber, kein zwPartnumbersModels mehr).
+
+    Mit settings.DEVICE_FLAT_MATERIALIZED wird stattdessen die Join-View
+    device_flat_source angelegt und device_flat als indizierte Tabelle
+    daraus gebaut (refresh_device_flat_table).
+    """
+    if DEVICE_FLAT_MATERIALIZED:
+        view_name = DEVICE_FLAT_SOURCE_VIEW
+    else:
+        view_name = "device_flat"
+
+    with _conn().cursor() as cur:
+        if _table_type(cur, view_name) == "BASE TABLE":
+            # Wechsel von materialisiert zurück auf View
+            cur.execute(f"DROP TABLE {view_name};")
+        cur.execute(f"CREATE OR REPLACE VIEW {view_name} AS {DEVICE_FLAT_SELECT_SQL};")
+
+    if DEVICE_FLAT_MATERIALIZED:
+        refresh_device_flat_table()
+
+
+def refresh_device_flat_table():
+    """
+    device_flat als echte Tabelle aus device_flat_source neu aufbauen:
+    erst device_flat_new inkl. Indizes befüllen, dann atomar tauschen.
+    Leser sehen bis zum Tausch den alten Stand.
+
+    Die Spaltentypen kommen aus device_flat_source; lange Texte werden wie
+    in db_schema nur mit Präfix indiziert.
+    """
+    from .db_schema import INDEX_PREFIX_LENGTH, _column_info, _index_column_sql
+
     with _conn().cursor() as cur:
-        for stmt in sql.strip().split(";"):
-            stmt = stmt.strip()
-            if stmt:
-                cur.execute(stmt + ";")
+        index_sql = []
+        for index_name, columns in DEVICE_FLAT_INDEXES:
+            max_chars = INDEX_PREFIX_LENGTH if len(columns) > 1 else INDEX_PREFIX_LENGTH * 4
+            parts = []
+            for column in columns:
+                data_type, max_length = _column_info(cur, DEVICE_FLAT_SOURCE_VIEW, column)
+                parts.append(_index_column_sql(data_type, max_length, column, max_chars))
+            index_sql.append(f"INDEX {index_name} ({', '.join(parts)})")
+        indexes = ",\n".join(index_sql)
+
+        cur.execute("DROP TABLE IF EXISTS device_flat_new;")
+        cur.execute(f"""
+            CREATE TABLE device_flat_new (
+                {indexes}
+            )
+            SELECT * FROM {DEVICE_FLAT_SOURCE_VIEW};
+        """)
+        _swap_in_table(cur, "device_flat", "device_flat_new")
+
+
+def _live_schema():
+    return _conn().settings_dict["NAME"]
+
+
+def _shadow_tables():
+    return list(DOMAIN_TABLES) + ["staging_devices"]
+
+
+def _toggle_fk_name(name):
+    """fk -> fk__s -> fk: FK-Namen wechseln bei jedem Shadow-Aufbau."""
+    if name.endswith(SHADOW_FK_SUFFIX):
+        return name[:-len(SHADOW_FK_SUFFIX)]
+    return name + SHADOW_FK_SUFFIX
+
+
+def _shadow_table_ddl(ddl, table, shadow):
+    """
+    SHOW-CREATE-TABLE-DDL einer Live-Tabelle für das Shadow-Schema:
+
+    - Tabelle und FK-Referenzen auf ``shadow`` qualifiziert (kein USE nötig)
+    - FK-Namen umgeschaltet (_toggle_fk_name): InnoDB führt FKs als
+      "schema/name"; beim Tausch wandern die Live-Tabellen ins
+      Shadow-Schema, während die neuen Tabellen dort noch liegen. Mit
+      gleichen Namen kollidierten die FK-IDs (errno 121).
+    """
+    ddl = ddl.replace(f"CREATE TABLE `{table}`", f"CREATE TABLE `{shadow}`.`{table}`", 1)
+    ddl = re.sub(
+        r"CONSTRAINT `([^`]+)` FOREIGN KEY",
+        lambda m: f"CONSTRAINT `{_toggle_fk_name(m.group(1))}` FOREIGN KEY",
+        ddl,
+    )
+    return re.sub(r"REFERENCES `([^`.]+)` ", rf"REFERENCES `{shadow}`.`\1` ", ddl)
+
+
+def prepare_shadow_schema():
+    """
+    Shadow-Schema anlegen und alle fachlichen Tabellen + Staging darin leer
+    und strukturgleich zur Live-DB neu erstellen (inkl. Indizes und FKs,
+    über SHOW CREATE TABLE; FK-Namen siehe _shadow_table_ddl).
+    """
+    live = _live_schema()
+    shadow = SHADOW_SCHEMA
+
+    with _conn().cursor() as cur:
+        cur.execute(f"CREATE DATABASE IF NOT EXISTS `{shadow}`;")
+        cur.execute("SET FOREIGN_KEY_CHECKS = 0;")
+        try:
+            for table in _shadow_tables():
+                cur.execute(f"DROP TABLE IF EXISTS `{shadow}`.`{table}`;")
+            for table in _shadow_tables():
+                cur.execute(f"SHOW CREATE TABLE `{live}`.`{table}`;")
+                cur.execute(_shadow_table_ddl(cur.fetchone()[1], table, shadow))
+        finally:
+            cur.execute("SET FOREIGN_KEY_CHECKS = 1;")
+
+
+def swap_shadow_tables():
+    """
+    Shadow-Tabellen per einzelnem RENAME TABLE atomar live schalten.
+
+    Die bisherigen Live-Tabellen landen dabei im Shadow-Schema und bleiben
+    bis zum nächsten Shadow-Import erhalten.
+    """
+    live = _live_schema()
+    shadow = SHADOW_SCHEMA
+
+    renames = []
+    for table in _shadow_tables():
+        renames += [
+            f"`{live}`.`{table}` TO `{shadow}`.`{table}__old`",
+            f"`{shadow}`.`{table}` TO `{live}`.`{table}`",
+            f"`{shadow}`.`{table}__old` TO `{shadow}`.`{table}`",
+        ]
+
+    with _conn().cursor() as cur:
+        cur.execute("RENAME TABLE " + ",\n".join(renames) + ";")
+
+
+@contextmanager
+def shadow_build():
+    """
+    Blue/Green-Import: innerhalb des with-Blocks arbeitet die Verbindung im
+    Shadow-Schema (clear/import/populate treffen die Shadow-Tabellen), Leser
+    sehen weiter die Live-Tabellen.
+
+    Nur wenn der Block ohne Fehler durchläuft, werden die Tabellen getauscht.
+    Bei einem Fehler bleibt die Live-DB unverändert. device_flat danach
+    mit recreate_device_flat_view() neu anlegen.
+    """
+    live = _live_schema()
+    prepare_shadow_schema()
+
+    conn = _conn()
+    with conn.cursor() as cur:
+        cur.execute(f"USE `{SHADOW_SCHEMA}`;")
+    try:
+        yield
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"USE `{live}`;")
+
+    swap_shadow_tables()
@@ -1,93 +1,42 @@
 from django.db import connections
 
-DEVICE_ALIAS = "device_db"
+from .concurrent_db import run_concurrently
+from .db_sql import DEVICE_FLAT_COLUMNS
+from .pagination import (
+    DEFAULT_PAGE_SIZE,
+    cached_count,
+    cached_rows,
+    cursor_at_offset,
+    fetch_keyset_page,
+)
+from .generation import generation_cached
+from .rollup import count_source
+from .search import search_condition
+from .site_groups import DACH, site_group_condition
+from .snapshot import snapshot_chunk, snapshot_counts_by_site
 
-# Harte Liste der DACH-Sitecodes (kannst du später in eine Tabelle auslagern)
-DACH_SITES = [
-    "ARW", "ALS", "ARB", "BYR", "BRL", "BR2", "BEH", "BER", "BLF", "BRB", "BRM",
-    "BRN", "DMM", "DAM", "DED", "DLN", "DPH", "DRT", "DRS", "DUS", "EDM", "ETR",
-    "ETF", "ESC", "ES2", "ESP", "ERB", "FR2", "FR4", "FRK", "FRD", "FRT", "GEL",
-    "GCH", "GC2", "GTH", "GRN", "GDN", "HNV", "HN2", "HN3", "HN4", "HLD", "HCO",
-    "IGS", "KRL", "KSM", "KVL", "KOB", "ELS", "KSC", "KRS", "KRZ", "LNG", "LN2",
-    "LN3", "LSN", "LBR", "LMF", "LVK", "LAT", "LHR", "MGD", "MNN", "MNH", "MH2",
-    "MND", "MGG", "MNC", "MN2", "NKR", "NEU", "NDR", "NRN", "NR2", "NRB", "OBR",
-    "PAS", "PEN", "PEI", "PFL", "PFN", "RAD", "RIZ", "RVS", "RGN", "RG2", "SBR",
-    "SCB", "SCM", "SCN", "SCF", "SCW", "SC2", "SEL", "SNN", "SMM", "SND", "STY",
-    "STT", "THY", "THN", "TRS", "UEB", "UNT", "VNN", "VN2", "VLK", "WGN", "WRD",
-    "WTZ", "WTT", "WTN", "WLF", "WUE", "ZEU", "ZUG",
-]
+DEVICE_ALIAS = "device_db"
 
 
 def _get_connection():
     return connections[DEVICE_ALIAS]
 
 
-def fetch_device_rows(filters):
+def _compile_filters(filters):
     """
-    Holt die Zeilen aus device_flat inkl. Filter:
+    Übersetzt die Analyse-Filter in WHERE-Teile + Parameter für device_flat:
     - dach_only (bool)
     - ci_status (str | None)
     - tier3 (str | None)
     - search (str | None)
     """
-
-    base_sql = """
-        SELECT
-            PL_NAME,
-            REGION,
-            COMPANY,
-            SITEGROUP,
-            SITE,
-            ROOM,
-            PHYSICALPOSITION,
-            SHORTDESCRIPTION,
-            DEPARTMENT,
-            OWNED_BY,
-            USED_BY,
-            SUPPORTED_BY,
-            PL_COST_CENTER,
-            PL_STATUS,
-            RELATION,
-            DESTINATION_CLASSID,
-            TIER1,
-            TIER2,
-            TIER3,
-            MODEL,
-            MANUFACTURERNAME,
-            SERIALNUMBER,
-            CI_ROOM,
-            FLOOR,
-            PARTNUMBER,
-            SUPPLIERNAME,
-            CI_STATUS,
-            PURCHASE_DATE,
-            RECEIVED_DATE,
-            INSTALLATION_DATE,
-            AVAILABLE_DATE,
-            RETURN_DATE,
-            DISPOSAL_DATE,
-            MARK_AS_DELETED,
-            CREATE_DATE,
-            MODIFIED_DATE,
-            ROLE,
-            CHILDNAME,
-            CONFBASICNUMBER,
-            BUILDNUMBER,
-            TYPE,
-            ADDITIONAL_INFORMATION,
-            DEPOT,
-            SUPPORTED
-        FROM device_flat
-        WHERE 1=1
-    """
-
     params = []
     conditions = []
 
     if filters.get("dach_only"):
-        placeholders = ", ".join(["%s"] * len(DACH_SITES))
-        conditions.append(f"SITE IN ({placeholders})")
-        params.extend(DACH_SITES)
+        condition, group_params = site_group_condition(DACH)
+        conditions.append(condition)
+        params.extend(group_params)
 
     if filters.get("ci_status"):
         conditions.append("CI_STATUS = %s")
@@ -98,76 +47,195 @@ def fetch_device_rows(filters):
         params.append(filters["tier3"])
 
     if filters.get("search"):
-        search = f"%{filters['search']}%"
-        conditions.append(
-            """
-            (
-                PL_NAME LIKE %s OR
-                SHORTDESCRIPTION LIKE %s OR
-                MODEL LIKE %s OR
-                SERIALNUMBER LIKE %s
-            )
-            """
-        )
-        params.extend([search] * 4)
+        condition, search_params = search_condition(filters["search"])
+        conditions.append(condition)
+        params.extend(search_params)
+
+    return conditions, params
+
+
+def build_device_rows_query(filters):
+    """
+    SQL + Parameter für alle device_flat-Zeilen zu den Filtern
+    (für den Export).
+    """
+    conditions, params = _compile_filters(filters)
+
+    base_sql = f"""
+        SELECT {", ".join(DEVICE_FLAT_COLUMNS)}
+        FROM device_flat
+        WHERE 1=1
+    """
 
     if conditions:
         base_sql += " AND " + " AND ".join(conditions)
 
     base_sql += " ORDER BY SITE, PL_NAME, SERIALNUMBER"
+    return base_sql, params
+
+
+def fetch_device_page(filters, after=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Eine Seite aus device_flat (Keyset-Pagination, siehe pagination.py).
+
+    Rückgabe: Dict mit columns, rows, next_cursor, total.
+    """
+    conditions, params = _compile_filters(filters)
+
+    conn = _get_connection()
+    with conn.cursor() as cur:
+        rows, next_cursor = fetch_keyset_page(
+            cur, "device_flat", DEVICE_FLAT_COLUMNS, conditions, params,
+            after=after, page_size=page_size,
+        )
+        source, count_expr = count_source(bool(filters.get("search")))
+        total = cached_count(cur, source, conditions, params, count_expr)
+
+    return {
+        "columns": list(DEVICE_FLAT_COLUMNS),
+        "rows": rows,
+        "next_cursor": next_cursor,
+        "total": total,
+    }
+
+
+def fetch_device_columns_page(filters, columns, after=None,
+                              page_size=DEFAULT_PAGE_SIZE, with_total=False):
+    """
+    Wie fetch_device_page, aber nur mit den Spalten ``columns`` (Teilmenge
+    von DEVICE_FLAT_COLUMNS, vom Aufrufer geprüft).
+
+    device_flat ist eine View aus LEFT JOINs auf eindeutige Schlüssel; für
+    nicht ausgewählte Spalten entfernt MariaDB die Joins (Table Elimination),
+    bei der materialisierten Tabelle werden nur die Spalten gelesen.
+    Die Zeilen kommen aus dem Spalten-Schnappschuss, wenn er aktiv ist.
+    """
+    conditions, params = _compile_filters(filters)
+    hit = snapshot_chunk(filters, after, limit=page_size, columns=columns)
 
     conn = _get_connection()
     with conn.cursor() as cur:
-        cur.execute(base_sql, params)
-        rows = cur.fetchall()
-        columns = [col[0] for col in cur.description]
+        if hit is not None:
+            rows, next_cursor = hit
+        else:
+            rows, next_cursor = fetch_keyset_page(
+                cur, "device_flat", columns, conditions, params,
+                after=after, page_size=page_size,
+            )
+        total = None
+        if with_total:
+            source, count_expr = count_source(bool(filters.get("search")))
+            total = cached_count(cur, source, conditions, params, count_expr)
 
-    return columns, rows
+    return {
+        "columns": list(columns),
+        "rows": rows,
+        "next_cursor": next_cursor,
+        "total": total,
+    }
 
 
-def fetch_filter_options():
+def fetch_device_chunk(filters, after=None, start=None, limit=DEFAULT_PAGE_SIZE):
     """
-    Liest die Werte für die Dropdowns aus device_flat:
-    - CI_STATUS
-    - TIER3
-    - DACH-Sites, die in den Daten wirklich vorkommen
+    Zeilenblock für die virtuell scrollende Analyse-Tabelle.
+
+    Normalfall ist ``after`` (Cursor des vorigen Blocks); ohne Cursor wird
+    ab Position ``start`` geladen (Sprung im Scrollbalken). Ohne
+    Freitextsuche aus dem Spalten-Schnappschuss, wenn er aktiv ist
+    (siehe snapshot.py); die Cursor sind dieselben.
+    Rückgabe: Dict mit columns, rows, next_cursor.
     """
+    hit = snapshot_chunk(filters, after, start or 0, limit)
+    if hit is not None:
+        rows, next_cursor = hit
+        return {
+            "columns": list(DEVICE_FLAT_COLUMNS),
+            "rows": rows,
+            "next_cursor": next_cursor,
+        }
+
+    conditions, params = _compile_filters(filters)
+
     conn = _get_connection()
     with conn.cursor() as cur:
-        # CI-Status
-        cur.execute(
-            """
-            SELECT DISTINCT CI_STATUS
-            FROM device_flat
-            WHERE CI_STATUS IS NOT NULL AND CI_STATUS <> ''
-            ORDER BY CI_STATUS
-        """
+        if after is None and start:
+            # Site-Counts (gecacht, dieselben wie für Trefferzahl/Diagramm)
+            # begrenzen den Sprung auf eine Site statt OFFSET start
+            sql = _counts_by_site_query(conditions, bool(filters.get("search")))
+            site_counts = cached_rows(cur, sql, params)
+            after = cursor_at_offset(
+                cur, "device_flat", conditions, params, start, site_counts=site_counts,
+            )
+            if after is None:
+                return {"columns": list(DEVICE_FLAT_COLUMNS), "rows": [], "next_cursor": None}
+
+        rows, next_cursor = fetch_keyset_page(
+            cur, "device_flat", DEVICE_FLAT_COLUMNS, conditions, params,
+            after=after, page_size=limit,
         )
-        ci_statuses = [row[0] for row in cur.fetchall()]
 
-        # Tier3
+    return {
+        "columns": list(DEVICE_FLAT_COLUMNS),
+        "rows": rows,
+        "next_cursor": next_cursor,
+    }
+
+
+def fetch_filter_options():
+    """
+    Werte für die Dropdowns; ändern sich nur per Import und werden deshalb
+    pro Daten-Generation gecacht (siehe generation.py).
+    """
+    return generation_cached("filter_options", _query_filter_options)
+
+
+def _query_distinct(column):
+    """Vorkommende Werte von ``column`` (ohne NULL/leer), sortiert."""
+    conn = _get_connection()
+    with conn.cursor() as cur:
         cur.execute(
-            """
-            SELECT DISTINCT TIER3
+            f"""
+            SELECT DISTINCT {column}
             FROM device_flat
-            WHERE TIER3 IS NOT NULL AND TIER3 <> ''
-            ORDER BY TIER3
+            WHERE {column} IS NOT NULL AND {column} <> ''
+            ORDER BY {column}
         """
         )
-        tier3_values = [row[0] for row in cur.fetchall()]
+        return [row[0] for row in cur.fetchall()]
 
-        # DACH-Sites, die es in den Daten wirklich gibt
-        placeholders = ", ".join(["%s"] * len(DACH_SITES))
+
+def _query_dach_sites():
+    """DACH-Sites, die es in den Daten wirklich gibt."""
+    condition, group_params = site_group_condition(DACH)
+    conn = _get_connection()
+    with conn.cursor() as cur:
         cur.execute(
             f"""
             SELECT DISTINCT SITE
             FROM device_flat
-            WHERE SITE IN ({placeholders})
+            WHERE {condition}
             ORDER BY SITE
         """,
-            DACH_SITES,
+            group_params,
         )
-        dach_sites_in_db = [row[0] for row in cur.fetchall()]
+        return [row[0] for row in cur.fetchall()]
+
+
+def _query_filter_options():
+    """
+    Liest die Werte für die Dropdowns aus device_flat:
+    - CI_STATUS
+    - TIER3
+    - DACH-Sites, die in den Daten wirklich vorkommen
+
+    Die drei Abfragen sind unabhängig und laufen parallel
+    (siehe concurrent_db.py).
+    """
+    ci_statuses, tier3_values, dach_sites_in_db = run_concurrently(
+        (_query_distinct, "CI_STATUS"),
+        (_query_distinct, "TIER3"),
+        (_query_dach_sites,),
+    )
 
     return {
         "ci_statuses": ci_statuses,
@@ -176,55 +244,41 @@ def fetch_filter_options():
     }
 
 
-def fetch_counts_by_site(filters):
+def _counts_by_site_query(conditions, uses_search):
     """
-    Aggregation: Anzahl Geräte pro Site (mit denselben Filtern).
+    Anzahl pro Site; ohne Freitextsuche aus der Rollup-Tabelle
+    (siehe rollup.py), sonst direkt aus device_flat.
     """
-    base_sql = """
-        SELECT SITE, COUNT(*) AS device_count
-        FROM device_flat
+    source, count_expr = count_source(uses_search)
+    sql = f"""
+        SELECT SITE, {count_expr} AS device_count
+        FROM {source}
         WHERE 1=1
     """
 
-    params = []
-    conditions = []
-
-    if filters.get("dach_only"):
-        placeholders = ", ".join(["%s"] * len(DACH_SITES))
-        conditions.append(f"SITE IN ({placeholders})")
-        params.extend(DACH_SITES)
-
-    if filters.get("ci_status"):
-        conditions.append("CI_STATUS = %s")
-        params.append(filters["ci_status"])
-
-    if filters.get("tier3"):
-        conditions.append("TIER3 = %s")
-        params.append(filters["tier3"])
+    if conditions:
+        sql += " AND " + " AND ".join(conditions)
 
-    if filters.get("search"):
-        search = f"%{filters['search']}%"
-        conditions.append(
-            """
-            (
-                PL_NAME LIKE %s OR
-                SHORTDESCRIPTION LIKE %s OR
-                MODEL LIKE %s OR
-                SERIALNUMBER LIKE %s
-            )
-            """
-        )
-        params.extend([search] * 4)
+    sql += " GROUP BY SITE ORDER BY SITE"
+    return sql
 
-    if conditions:
-        base_sql += " AND " + " AND ".join(conditions)
 
-    base_sql += " GROUP BY SITE ORDER BY SITE"
+def fetch_counts_and_total(filters):
+    """
+    Anzahl pro Site (pro Daten-Generation gecacht) + Gesamtanzahl als
+    Summe, für Diagramm und Trefferzahl der Analyse; aus dem
+    Spalten-Schnappschuss, wenn er aktiv ist.
+    """
+    count_rows = snapshot_counts_by_site(filters)
+    if count_rows is None:
+        conditions, params = _compile_filters(filters)
 
-    conn = _get_connection()
-    with conn.cursor() as cur:
-        cur.execute(base_sql, params)
-        rows = cur.fetchall()
+        conn = _get_connection()
+        with conn.cursor() as cur:
+            sql = _counts_by_site_query(conditions, bool(filters.get("search")))
+            count_rows = cached_rows(cur, sql, params)
 
-    # Fürs Frontend einfaches Dict
-    return [{"site": r[0], "count": r[1]} for r in rows]
+    return {
+        "counts_by_site": [{"site": r[0], "count": r[1]} for r in count_rows],
+        "total": sum(r[1] for r in count_rows),
+    }
@@ -2,22 +2,12 @@
 
 from django.db import connections
 
-DEVICE_ALIAS = "device_db"
+from .db_sql import DEVICE_FLAT_COLUMNS
+from .pagination import DEFAULT_PAGE_SIZE, cached_count, fetch_keyset_page
+from .rollup import count_source
+from .site_groups import DACH, site_group_condition
 
-# Feste DACH-Sitecodes aus deiner Liste
-DACH_SITES = [
-    "ARW", "ALS", "ARB", "BYR", "BRL", "BR2", "BEH", "BER", "BLF", "BRB", "BRM",
-    "BRN", "DMM", "DAM", "DED", "DLN", "DPH", "DRT", "DRS", "DUS", "EDM", "ETR",
-    "ETF", "ESC", "ES2", "ESP", "ERB", "FR2", "FR4", "FRK", "FRD", "FRT", "GEL",
-    "GCH", "GC2", "GTH", "GRN", "GDN", "HNV", "HN2", "HN3", "HN4", "HLD", "HCO",
-    "IGS", "KRL", "KSM", "KVL", "KOB", "ELS", "KSC", "KRS", "KRZ", "LNG", "LN2",
-    "LN3", "LSN", "LBR", "LMF", "LVK", "LAT", "LHR", "MGD", "MNN", "MNH", "MH2",
-    "MND", "MGG", "MNC", "MN2", "NKR", "NEU", "NDR", "NRN", "NR2", "NRB", "OBR",
-    "PAS", "PEN", "PEI", "PFL", "PFN", "RAD", "RIZ", "RVS", "RGN", "RG2", "SBR",
-    "SCB", "SCM", "SCN", "SCF", "SCW", "SC2", "SEL", "SNN", "SMM", "SND", "STY",
-    "STT", "THY", "THN", "TRS", "UEB", "UNT", "VNN", "VN2", "VLK", "WGN", "WRD",
-    "WTZ", "WTT", "WTN", "WLF", "WUE", "ZEU", "ZUG",
-]
+DEVICE_ALIAS = "device_db"
 
 # Tier3, die du im Report haben willst
 TIER3_FILTER = [
@@ -34,35 +24,70 @@ def _conn():
     return connections[DEVICE_ALIAS]
 
 
-def fetch_dach_deployed_t3_devices():
+def _report_filters():
     """
-    Report 1:
-    - Nur DACH-Sites
-    - CI_STATUS = 'Deployed'
-    - TIER3 in definierter Liste
-    -> komplette device_flat-Zeilen (Fake CSV)
+    Feste Report-Filter als WHERE-Teile + Parameter:
+    DACH-Sites (Site-Gruppe), CI_STATUS = 'Deployed', TIER3 in TIER3_FILTER.
     """
-    conn = _conn()
-    with conn.cursor() as cur:
-        site_placeholders = ", ".join(["%s"] * len(DACH_SITES))
-        tier_placeholders = ", ".join(["%s"] * len(TIER3_FILTER))
-
-        sql = f"""
-            SELECT *
-            FROM device_flat
-            WHERE
-                SITE IN ({site_placeholders})
-                AND CI_STATUS = %s
-                AND TIER3 IN ({tier_placeholders})
-            ORDER BY SITE, PL_NAME, SERIALNUMBER
-        """
-
-        params = list(DACH_SITES) + ["Deployed"] + list(TIER3_FILTER)
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-        columns = [col[0] for col in cur.description]
+    site_condition, site_params = site_group_condition(DACH)
+    tier_placeholders = ", ".join(["%s"] * len(TIER3_FILTER))
+
+    conditions = [
+        site_condition,
+        "CI_STATUS = %s",
+        f"TIER3 IN ({tier_placeholders})",
+    ]
+    params = site_params + ["Deployed"] + list(TIER3_FILTER)
+    return conditions, params
+
+
+def build_dach_deployed_t3_devices_query():
+    """SQL + Parameter für Report 1 (für den Export)."""
+    conditions, params = _report_filters()
+    sql = f"""
+        SELECT {", ".join(DEVICE_FLAT_COLUMNS)}
+        FROM device_flat
+        WHERE {" AND ".join(conditions)}
+        ORDER BY SITE, PL_NAME, SERIALNUMBER
+    """
+    return sql, params
 
-    return columns, rows
+
+def build_dach_deployed_t3_counts_query():
+    """
+    SQL + Parameter für Report 2 (für fetch_... und den Export);
+    aus der Rollup-Tabelle, sobald es sie gibt.
+    """
+    conditions, params = _report_filters()
+    source, count_expr = count_source()
+    sql = f"""
+        SELECT
+            SITE,
+            {count_expr} AS device_count
+        FROM {source}
+        WHERE {" AND ".join(conditions)}
+        GROUP BY SITE
+        ORDER BY SITE
+    """
+    return sql, params
+
+
+def fetch_dach_deployed_t3_devices_rows(after=None, page_size=DEFAULT_PAGE_SIZE):
+    """Report 1: eine Seite (Keyset-Pagination); Rückgabe: (rows, next_cursor)."""
+    conditions, params = _report_filters()
+    with _conn().cursor() as cur:
+        return fetch_keyset_page(
+            cur, "device_flat", DEVICE_FLAT_COLUMNS, conditions, params,
+            after=after, page_size=page_size,
+        )
+
+
+def fetch_dach_deployed_t3_devices_total():
+    """Report 1: Gesamtanzahl (gecacht, siehe pagination.cached_count)."""
+    conditions, params = _report_filters()
+    source, count_expr = count_source()
+    with _conn().cursor() as cur:
+        return cached_count(cur, source, conditions, params, count_expr)
 
 
 def fetch_dach_deployed_t3_counts_by_site():
@@ -71,25 +96,10 @@ def fetch_dach_deployed_t3_counts_by_site():
     Gleiche Filter wie oben, aber
     -> Aggregation nach SITE.
     """
+    sql, params = build_dach_deployed_t3_counts_query()
+
     conn = _conn()
     with conn.cursor() as cur:
-        site_placeholders = ", ".join(["%s"] * len(DACH_SITES))
-        tier_placeholders = ", ".join(["%s"] * len(TIER3_FILTER))
-
-        sql = f"""
-            SELECT
-                SITE,
-                COUNT(*) AS device_count
-            FROM device_flat
-            WHERE
-                SITE IN ({site_placeholders})
-                AND CI_STATUS = %s
-                AND TIER3 IN ({tier_placeholders})
-            GROUP BY SITE
-            ORDER BY SITE
-        """
-
-        params = list(DACH_SITES) + ["Deployed"] + list(TIER3_FILTER)
         cur.execute(sql, params)
         rows = cur.fetchall()
         columns = [col[0] for col in cur.description]
@@ -0,0 +1,96 @@
+# device_overview/generation.py
+
+"""
+Daten-Generation: ein Zähler in der device_db, den jeder erfolgreiche
+Import (und Clear Database) hochzählt.
+
+Alles, was nur aus den Importdaten abgeleitet ist (Dropdown-Werte,
+COUNTs, ...), kann mit der Generation als Schlüssel gecacht werden und
+wird nach einem Import automatisch ungültig – auch in anderen
+Worker-Prozessen, weil die Generation in der DB steht.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from .db_schema import ensure_schema, live_table
+
+DEVICE_ALIAS = "device_db"
+
+# optionaler Django-Cache (Alias aus settings.CACHES) zusätzlich zum
+# prozesslokalen Cache, z.B. für mehrere Worker mit gemeinsamem Redis
+CACHE_ALIAS = getattr(settings, "DEVICE_CACHE_ALIAS", None)
+CACHE_KEY_PREFIX = "device_overview"
+
+_local_cache = {}
+_local_cache_lock = threading.Lock()
+
+
+def _conn():
+    return connections[DEVICE_ALIAS]
+
+
+def _generation_table():
+    return live_table("data_generation")
+
+
+def current_generation():
+    """Aktuelle Generation (0, solange noch nie importiert wurde)."""
+    ensure_schema()
+    with _conn().cursor() as cur:
+        cur.execute(f"SELECT generation FROM {_generation_table()} WHERE id = 1;")
+        row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def bump_generation():
+    """Generation nach einem Import/Clear erhöhen; Rückgabe: neue Generation."""
+    ensure_schema()
+    with _conn().cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {_generation_table()} (id, generation, updated_at)
+            VALUES (1, 1, NOW(3))
+            ON DUPLICATE KEY UPDATE
+                generation = generation + 1,
+                updated_at = NOW(3);
+        """)
+        cur.execute(f"SELECT generation FROM {_generation_table()} WHERE id = 1;")
+        generation = cur.fetchone()[0]
+
+    # Einträge älterer Generationen werden nie wieder gelesen
+    with _local_cache_lock:
+        _local_cache.clear()
+    return generation
+
+
+def generation_cached(name, builder, generation=None):
+    """
+    Wert ``name`` für die aktuelle Generation; beim ersten Zugriff (pro
+    Generation) wird er mit ``builder()`` berechnet.
+
+    Reihenfolge: prozesslokal -> optional Django-Cache -> builder().
+    """
+    if generation is None:
+        generation = current_generation()
+
+    with _local_cache_lock:
+        hit = _local_cache.get(name)
+        if hit is not None and hit[0] == generation:
+            return hit[1]
+
+    shared = caches[CACHE_ALIAS] if CACHE_ALIAS else None
+    key = f"{CACHE_KEY_PREFIX}:{name}:{generation}"
+    value = shared.get(key) if shared is not None else None
+
+    if value is None:
+        value = builder()
+        if shared is not None:
+            # kein Timeout nötig: neue Generation = neuer Schlüssel
+            shared.set(key, value, timeout=None)
+
+    with _local_cache_lock:
+        _local_cache[name] = (generation, value)
+    return value
@@ -0,0 +1,420 @@
+# device_overview/import_jobs.py
+
+"""
+CSV-Import als Hintergrund-Job.
+
+Der Upload wird nur zwischengespeichert und als Job in import_jobs
+eingetragen; ein lokaler Worker-Thread arbeitet die Jobs nacheinander ab.
+Mehrere Worker-Prozesse werden über GET_LOCK serialisiert, Uploads landen
+also in einer Warteschlange statt sich gegenseitig zu überschreiben.
+
+Nach einem Neustart räumt recover_jobs() liegengebliebene Jobs auf
+(einmal pro Prozess, beim ersten Zugriff auf die Jobs).
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from . import db_sql, rollup, search, snapshot
+from .db_schema import ensure_schema, live_table
+from .generation import bump_generation
+from .pagination import clear_count_cache
+from .report_cache import report_cache
+
+logger = logging.getLogger(__name__)
+
+# Ablage der hochgeladenen Dateien, bis der Worker sie verarbeitet hat
+SPOOL_DIR = getattr(
+    settings,
+    "DEVICE_IMPORT_SPOOL_DIR",
+    os.path.join(tempfile.gettempdir(), "device_overview_imports"),
+)
+
+# MariaDB-Lock, der Importe prozessübergreifend serialisiert
+IMPORT_LOCK_NAME = "device_overview_import"
+IMPORT_LOCK_POLL_SECONDS = 30
+# so lange wartet Clear Database auf einen laufenden Import
+CLEAR_LOCK_TIMEOUT_SECONDS = 5
+
+# Fortschritt höchstens so oft in die DB schreiben
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+_executor = None
+_executor_lock = threading.Lock()
+_recovered = False
+
+
+class ImportLockError(RuntimeError):
+    """Der Import-Lock konnte nicht geholt werden."""
+
+
+def _conn():
+    return connections[db_sql.DEVICE_ALIAS]
+
+
+def _jobs_table():
+    # immer im Live-Schema, auch wenn die Verbindung gerade per
+    # shadow_build() im Shadow-Schema arbeitet
+    return live_table("import_jobs")
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # genau ein Worker -> Jobs laufen nacheinander
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="device-import"
+            )
+        return _executor
+
+
+def _spool_upload(csv_file):
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".csv", dir=SPOOL_DIR)
+    with os.fdopen(fd, "wb") as out:
+        for chunk in csv_file.chunks():
+            out.write(chunk)
+    return path
+
+
+def recover_jobs():
+    """
+    Jobs aufräumen, deren Prozess nicht mehr lebt:
+
+    - 'running' ohne gehaltenen Import-Lock (der Lock endet mit der
+      Verbindung des Workers) -> 'failed'
+    - 'queued' mit vorhandener Spool-Datei -> wieder in die Warteschlange;
+      welcher Prozess den Job dann ausführt, entscheidet _claim_job()
+
+    Queued-Jobs ohne Spool-Datei auf diesem Host bleiben unberührt, sie
+    gehören ggf. zu einem Prozess auf einem anderen Host.
+    Rückgabe: Anzahl wieder eingereihter Jobs.
+    """
+    if _get_import_lock(0):
+        try:
+            with _conn().cursor() as cur:
+                cur.execute(
+                    f"""
+                    UPDATE {_jobs_table()}
+                    SET status = 'failed',
+                        error = 'Abgebrochen (Prozess beendet)',
+                        finished_at = NOW(3)
+                    WHERE status = 'running';
+                    """
+                )
+                if cur.rowcount:
+                    logger.warning(
+                        "%s abgebrochene Import-Jobs als failed markiert", cur.rowcount
+                    )
+        finally:
+            _release_import_lock()
+
+    with _conn().cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT job_id, file_path
+            FROM {_jobs_table()}
+            WHERE status = 'queued'
+            ORDER BY job_id;
+            """
+        )
+        queued = cur.fetchall()
+
+    requeued = 0
+    for job_id, path in queued:
+        if os.path.exists(path):
+            _get_executor().submit(_run_job, job_id, path)
+            requeued += 1
+    if requeued:
+        logger.info("%s Import-Jobs wieder eingereiht", requeued)
+    return requeued
+
+
+def _ensure_jobs():
+    """ensure_schema() und einmal pro Prozess recover_jobs()."""
+    global _recovered
+    ensure_schema()
+    with _executor_lock:
+        if _recovered:
+            return
+        _recovered = True
+    try:
+        recover_jobs()
+    except Exception:
+        logger.exception("Import-Jobs konnten nicht aufgeräumt werden")
+
+
+def submit_import(csv_file):
+    """
+    Upload zwischenspeichern, Job anlegen und in die Warteschlange stellen.
+    Rückgabe: job_id
+    """
+    _ensure_jobs()
+    path = _spool_upload(csv_file)
+
+    with _conn().cursor() as cur:
+        cur.execute(
+            f"""
+            INSERT INTO {_jobs_table()}
+                (file_name, file_path, status, phase, created_at)
+            VALUES (%s, %s, 'queued', 'queued', NOW(3));
+            """,
+            [csv_file.name[:255], path],
+        )
+        job_id = cur.lastrowid
+
+    _get_executor().submit(_run_job, job_id, path)
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Status eines Jobs als Dict (für den JSON-Endpunkt), None wenn unbekannt.
+    """
+    _ensure_jobs()
+    with _conn().cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT
+                job_id, file_name, status, phase, rows_processed, error,
+                created_at, started_at, finished_at,
+                TIMESTAMPDIFF(
+                    MICROSECOND, started_at, COALESCE(finished_at, NOW(3))
+                ) / 1000000
+            FROM {_jobs_table()}
+            WHERE job_id = %s;
+            """,
+            [job_id],
+        )
+        row = cur.fetchone()
+
+    if row is None:
+        return None
+
+    return {
+        "job_id": row[0],
+        "file_name": row[1],
+        "status": row[2],
+        "phase": row[3],
+        "rows_processed": row[4],
+        "error": row[5],
+        "created_at": row[6],
+        "started_at": row[7],
+        "finished_at": row[8],
+        "elapsed_seconds": float(row[9]) if row[9] is not None else None,
+    }
+
+
+def _update_job(job_id, **fields):
+    assignments = ", ".join(f"{name} = %s" for name in fields)
+    with _conn().cursor() as cur:
+        cur.execute(
+            f"UPDATE {_jobs_table()} SET {assignments} WHERE job_id = %s;",
+            list(fields.values()) + [job_id],
+        )
+
+
+def _set_timestamp(job_id, column):
+    with _conn().cursor() as cur:
+        cur.execute(
+            f"UPDATE {_jobs_table()} SET {column} = NOW(3) WHERE job_id = %s;",
+            [job_id],
+        )
+
+
+class _JobProgress:
+    """
+    Callback für run_import(): schreibt Phase und Zeilenzahl in import_jobs,
+    die Zeilenzahl aber höchstens alle PROGRESS_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._last_write = 0.0
+
+    def phase(self, phase):
+        _update_job(self.job_id, phase=phase)
+
+    def rows(self, rows_processed):
+        now = time.monotonic()
+        if now - self._last_write >= PROGRESS_INTERVAL_SECONDS:
+            self._last_write = now
+            _update_job(self.job_id, rows_processed=rows_processed)
+
+
+def run_import(csv_file, progress=None):
+    """
+    Kompletter Import einer CSV je nach settings.DEVICE_IMPORT_MODE:
+    clear -> staging -> normalisieren -> device_flat.
+
+    ``progress`` (optional) hat die Methoden phase(name) und rows(n).
+    Rückgabe: Anzahl Zeilen in staging_devices.
+    """
+    def phase(name):
+        if progress:
+            progress.phase(name)
+
+    rows_callback = progress.rows if progress else None
+
+    # nur prüfen: Spalten/Indizes (natürliche Schlüssel, Staging) legt
+    # migrate_device_db an, sonst SchemaNotMigrated
+    phase("check")
+    ensure_schema()
+
+    if db_sql.IMPORT_MODE == "delta":
+        # 1. CSV -> Staging
+        phase("staging")
+        stats = db_sql.import_csv_to_staging(csv_file, progress=rows_callback)
+        # 2. Staging gegen Bestand abgleichen
+        phase("delta")
+        if db_sql.apply_delta_from_staging() is None:
+            # Schlüssel nicht eindeutig -> Vollimport aus Staging
+            phase("normalize")
+            db_sql.clear_all_tables(include_staging=False)
+            db_sql.populate_normalized_from_staging()
+    elif db_sql.IMPORT_MODE == "shadow":
+        # Neuaufbau im Shadow-Schema, danach atomarer Tausch;
+        # Leser sehen bis dahin den alten Stand
+        with db_sql.shadow_build():
+            phase("staging")
+            stats = db_sql.import_csv_to_staging(csv_file, progress=rows_callback)
+            phase("normalize")
+            db_sql.populate_normalized_from_staging()
+            phase("swap")
+    else:
+        # 1. Tabellen leeren
+        phase("clear")
+        db_sql.clear_all_tables()
+        # 2. CSV -> Staging
+        phase("staging")
+        stats = db_sql.import_csv_to_staging(csv_file, progress=rows_callback)
+        # 3. Staging -> normalisierte DB
+        phase("normalize")
+        db_sql.populate_normalized_from_staging()
+
+    _rebuild_derived(phase)
+
+    return stats["rows"]
+
+
+def _rebuild_derived(phase):
+    """device_flat und alles, was daraus abgeleitet ist, neu aufbauen."""
+    # device_flat-View sicherstellen
+    phase("device_flat")
+    db_sql.recreate_device_flat_view()
+    # Suchindex aus dem neuen device_flat aufbauen
+    phase("search_index")
+    search.rebuild_search_index()
+    # vorberechnete Zahlen für Diagramme/Trefferzahlen
+    phase("rollup")
+    rollup.rebuild_device_rollup()
+    # neue Generation -> abgeleitete Caches (Dropdowns, COUNTs) ungültig
+    bump_generation()
+    clear_count_cache()
+    report_cache.clear()
+    # Spalten-Schnappschuss (falls aktiv) im Hintergrund neu laden
+    snapshot.schedule_reload()
+
+
+def clear_database():
+    """
+    Clear Database: alle Tabellen leeren, device_flat & Co. neu aufbauen.
+
+    Hält dabei den Import-Lock wie ein Import-Job (sonst liefen z.B. beide
+    Rollup-Neuaufbauten gleichzeitig). Läuft gerade ein Import, wird
+    höchstens CLEAR_LOCK_TIMEOUT_SECONDS gewartet -> ImportLockError.
+    """
+    if not _get_import_lock(CLEAR_LOCK_TIMEOUT_SECONDS):
+        raise ImportLockError("Es läuft gerade ein Import")
+    try:
+        db_sql.clear_all_tables()
+        # materialisiertes device_flat ebenfalls leeren
+        _rebuild_derived(lambda name: None)
+    finally:
+        _release_import_lock()
+
+
+def _get_import_lock(timeout):
+    """
+    GET_LOCK auf IMPORT_LOCK_NAME: True = erhalten, False = Timeout.
+    NULL (Fehler, z.B. Verbindung per KILL beendet) -> ImportLockError.
+    """
+    with _conn().cursor() as cur:
+        cur.execute("SELECT GET_LOCK(%s, %s);", [IMPORT_LOCK_NAME, timeout])
+        result = cur.fetchone()[0]
+    if result is None:
+        raise ImportLockError(f"GET_LOCK({IMPORT_LOCK_NAME!r}) fehlgeschlagen")
+    return result == 1
+
+
+def _acquire_import_lock(job_id):
+    while not _get_import_lock(IMPORT_LOCK_POLL_SECONDS):
+        logger.info("Import-Job %s wartet auf laufenden Import", job_id)
+
+
+def _release_import_lock():
+    with _conn().cursor() as cur:
+        cur.execute("SELECT RELEASE_LOCK(%s);", [IMPORT_LOCK_NAME])
+
+
+def _claim_job(job_id, status="running"):
+    """
+    queued -> ``status``; False, wenn ein anderer Prozess den Job schon
+    übernommen hat (z.B. nach recover_jobs() in mehreren Prozessen).
+    """
+    with _conn().cursor() as cur:
+        cur.execute(
+            f"""
+            UPDATE {_jobs_table()}
+            SET status = %s, phase = 'start', started_at = NOW(3)
+            WHERE job_id = %s AND status = 'queued';
+            """,
+            [status, job_id],
+        )
+        return cur.rowcount == 1
+
+
+def _run_job(job_id, path):
+    progress = _JobProgress(job_id)
+    claimed = False
+    try:
+        _acquire_import_lock(job_id)
+        try:
+            claimed = _claim_job(job_id)
+            if not claimed:
+                return
+
+            with open(path, "rb") as csv_file:
+                rows = run_import(csv_file, progress)
+
+            _update_job(job_id, status="done", phase="done", rows_processed=rows)
+            _set_timestamp(job_id, "finished_at")
+        finally:
+            _release_import_lock()
+    except Exception as exc:
+        logger.exception("Import-Job %s fehlgeschlagen", job_id)
+        try:
+            # vor der Übernahme nur, solange kein anderer Prozess ihn hat
+            claimed = claimed or _claim_job(job_id, status="failed")
+            if claimed:
+                _update_job(job_id, status="failed", error=str(exc))
+                _set_timestamp(job_id, "finished_at")
+        except Exception:
+            logger.exception("Status für Import-Job %s nicht gespeichert", job_id)
+    finally:
+        # die Datei gehört dem Prozess, der den Job übernommen hat
+        if claimed:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        # Verbindungen dieses Worker-Threads schließen
+        connections.close_all()
@@ -0,0 +1,72 @@
+# device_overview/management/commands/benchmark_import.py
+
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from device_overview.benchmark import run_benchmark, write_cmdb_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Misst Import-Phasen und Lesepfade mit synthetischen CMDB-Daten und "
+        "schreibt die Ergebnisse als JSON. ACHTUNG: leert die device_db."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", default="10000",
+            help="Zeilenzahlen, kommagetrennt (z.B. 10000,100000,1000000)",
+        )
+        parser.add_argument("--csv", help="vorhandene CSV statt generierter Daten")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--repeat", type=int, default=3,
+                            help="Wiederholungen je Lesepfad (Median)")
+        parser.add_argument("--output", default="benchmark-results.json")
+        parser.add_argument("--noinput", "--no-input", action="store_false",
+                            dest="interactive")
+
+    def handle(self, *args, **options):
+        if options["interactive"]:
+            answer = input("Der Benchmark leert die device_db. Fortfahren? [y/N] ")
+            if answer.strip().lower() not in ("y", "yes", "j", "ja"):
+                raise CommandError("Abgebrochen")
+
+        results = []
+        if options["csv"]:
+            results.append(self._run(options["csv"], options["repeat"]))
+        else:
+            try:
+                sizes = [int(size) for size in options["sizes"].split(",")]
+            except ValueError:
+                raise CommandError("--sizes erwartet Zahlen, z.B. 10000,100000")
+
+            for size in sizes:
+                fd, path = tempfile.mkstemp(suffix=".csv")
+                os.close(fd)
+                try:
+                    self.stdout.write(f"Erzeuge {size} Zeilen …")
+                    write_cmdb_csv(path, size, options["seed"])
+                    results.append(self._run(path, options["repeat"]))
+                finally:
+                    os.unlink(path)
+
+        with open(options["output"], "w", encoding="utf-8") as out:
+            json.dump({"results": results}, out, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f"Ergebnisse in {options['output']} geschrieben"
+        ))
+
+    def _run(self, path, repeat):
+        result = run_benchmark(path, repeat=repeat)
+        self.stdout.write(
+            f"{result['rows']} Zeilen: Import {result['import_seconds']:.1f}s "
+            f"({result['rows_per_second']:.0f} Zeilen/s)"
+        )
+        for phase, seconds in result["phases"].items():
+            self.stdout.write(f"  {phase:<36} {seconds:8.2f}s")
+        for name, read in result["reads"].items():
+            self.stdout.write(f"  {name:<36} {read['median'] * 1000:8.1f}ms")
+        return result
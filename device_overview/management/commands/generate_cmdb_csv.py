@@ -0,0 +1,20 @@
+# device_overview/management/commands/generate_cmdb_csv.py
+
+from django.core.management.base import BaseCommand
+
+from device_overview.benchmark import write_cmdb_csv
+
+
+class Command(BaseCommand):
+    help = "Schreibt eine synthetische CMDB-CSV (alle CSV_COLUMNS) für Benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Zieldatei (.csv)")
+        parser.add_argument("--rows", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        write_cmdb_csv(options["output"], options["rows"], options["seed"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['rows']} Zeilen nach {options['output']} geschrieben"
+        ))
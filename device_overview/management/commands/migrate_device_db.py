@@ -0,0 +1,30 @@
+# device_overview/management/commands/migrate_device_db.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from device_overview.db_schema import migrate, pending_migrations
+
+
+class Command(BaseCommand):
+    help = "Wendet fehlende device_db-Migrationen an (Deployment-Schritt)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Nur prüfen; Exit-Code 1, wenn Migrationen fehlen",
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            pending = pending_migrations()
+            if pending:
+                raise CommandError("device_db-Migrationen fehlen: " + ", ".join(pending))
+            self.stdout.write(self.style.SUCCESS("device_db ist aktuell"))
+            return
+
+        applied = migrate()
+        for name in applied:
+            self.stdout.write(f"angewendet: {name}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(applied)} device_db-Migrationen angewendet"
+        ))
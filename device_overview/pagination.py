@@ -0,0 +1,258 @@
+# device_overview/pagination.py
+
+"""
+Keyset-Pagination (Seek-Methode) für device_flat.
+
+Statt OFFSET merkt sich der Cursor die Sortierwerte der letzten Zeile einer
+Seite; die nächste Seite beginnt mit "alles, was danach sortiert". Damit
+kostet jede Seite nur einen Index-Seek + LIMIT, egal wie weit hinten sie
+liegt.
+"""
+
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from .generation import current_generation
+
+# stabile Sortierung: fachlich SITE/PL_NAME/SERIALNUMBER, DEVICE_ID macht
+# den Schlüssel eindeutig
+DEVICE_ORDER_KEY = ["SITE", "PL_NAME", "SERIALNUMBER", "DEVICE_ID"]
+
+PAGE_SIZES = (50, 100, 250, 500, 1000)
+DEFAULT_PAGE_SIZE = 100
+
+# Gesamtanzahl je Filter cachen; der Schlüssel enthält die Daten-Generation,
+# nach einem Import wird also ohnehin neu gezählt
+COUNT_CACHE_SECONDS = 300
+# höchstens so viele Einträge (Freitextsuchen erzeugen beliebig viele Schlüssel)
+COUNT_CACHE_MAX_ENTRIES = 2000
+
+# Einfügereihenfolge = Ablaufreihenfolge (gleiche Lebensdauer für alle)
+_count_cache = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+# erlaubte Werte in einem Cursor (Sortierwerte, keine Listen/Objekte)
+_CURSOR_SCALARS = (str, int, float, bool, type(None))
+
+
+class InvalidCursor(ValueError):
+    """Cursor passt nicht zum Sortierschlüssel."""
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(token):
+    """
+    Cursor aus der URL lesen: Liste von Skalaren. Nicht lesbare Cursor
+    -> None (= erste Seite); ob die Länge zum Sortierschlüssel passt, prüft
+    keyset_condition (InvalidCursor).
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list):
+        return None
+    if not all(isinstance(value, _CURSOR_SCALARS) for value in values):
+        return None
+    return values
+
+
+def page_size_from(query):
+    """Seitengröße aus GET-Parametern, nur Werte aus PAGE_SIZES."""
+    try:
+        page_size = int(query.get("page_size", DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return page_size if page_size in PAGE_SIZES else DEFAULT_PAGE_SIZE
+
+
+def keyset_condition(keys, values):
+    """
+    WHERE-Bedingung "Zeile sortiert nach ``values``" für ORDER BY ``keys`` ASC.
+
+    NULL sortiert in MariaDB bei ASC zuerst, deshalb:
+    - "größer als NULL"  -> col IS NOT NULL
+    - "größer als v"     -> col > v
+    - "gleich v"         -> col <=> v
+    Alle Teilbedingungen sind sargable und können den Sortierindex nutzen.
+    """
+    if len(keys) != len(values):
+        raise InvalidCursor("Cursor passt nicht zum Sortierschlüssel")
+
+    alternatives = []
+    params = []
+    for i, key in enumerate(keys):
+        parts = []
+        for prev_key, prev_value in zip(keys[:i], values[:i]):
+            parts.append(f"{prev_key} <=> %s")
+            params.append(prev_value)
+
+        value = values[i]
+        if value is None:
+            parts.append(f"{key} IS NOT NULL")
+        else:
+            parts.append(f"{key} > %s")
+            params.append(value)
+
+        alternatives.append("(" + " AND ".join(parts) + ")")
+
+    return "(" + " OR ".join(alternatives) + ")", params
+
+
+def fetch_keyset_page(cur, source, columns, where, params, after=None,
+                      page_size=DEFAULT_PAGE_SIZE, order_key=DEVICE_ORDER_KEY):
+    """
+    Eine Seite aus ``source`` (Tabelle/View) holen.
+
+    - ``where``/``params``: fertige Filterbedingungen (Liste von SQL-Teilen)
+    - ``after``: dekodierter Cursor oder None für die erste Seite
+
+    Rückgabe: (rows, next_cursor); next_cursor ist None auf der letzten Seite.
+    """
+    conditions = list(where)
+    all_params = list(params)
+    if after:
+        condition, cursor_params = keyset_condition(order_key, after)
+        conditions.append(condition)
+        all_params.extend(cursor_params)
+
+    select_cols = list(columns) + list(order_key)
+    sql = f"SELECT {', '.join(select_cols)} FROM {source}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {', '.join(order_key)} LIMIT %s"
+    all_params.append(page_size + 1)
+
+    cur.execute(sql, all_params)
+    fetched = cur.fetchall()
+
+    n = len(columns)
+    has_more = len(fetched) > page_size
+    fetched = fetched[:page_size]
+    rows = [row[:n] for row in fetched]
+
+    next_cursor = None
+    if has_more and fetched:
+        next_cursor = encode_cursor(fetched[-1][n:])
+    return rows, next_cursor
+
+
+def cursor_at_offset(cur, source, where, params, offset, site_counts=None,
+                     order_key=DEVICE_ORDER_KEY):
+    """
+    Dekodierter Cursor, hinter dem Zeile Nr. ``offset`` (0-basiert) folgt;
+    None für offset 0 bzw. wenn es so viele Zeilen nicht gibt.
+
+    Nur für Sprünge (z.B. Scrollbalken ganz nach unten ziehen). Ohne
+    ``site_counts`` wird per OFFSET bis zu ``offset`` Indexeinträge weit
+    gelesen. Mit ``site_counts`` (Zeilen je SITE in Sortierreihenfolge, zu
+    denselben Filtern; ``order_key`` beginnt mit SITE) wird zuerst die Site
+    der gesuchten Zeile bestimmt und nur innerhalb dieser Site gezählt, von
+    vorne oder von hinten, je nachdem, was näher liegt - höchstens eine
+    halbe Site statt ``offset`` Einträge.
+    """
+    if offset <= 0:
+        return None
+
+    conditions = list(where)
+    all_params = list(params)
+    position = offset - 1
+    direction = ""
+    if site_counts is not None:
+        for site, count in site_counts:
+            if position < count:
+                break
+            position -= count
+        else:
+            return None
+        conditions.append(f"{order_key[0]} <=> %s")
+        all_params.append(site)
+        if position > count // 2:
+            position = count - 1 - position
+            direction = " DESC"
+
+    sql = f"SELECT {', '.join(order_key)} FROM {source}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY " + ", ".join(key + direction for key in order_key)
+    sql += " LIMIT 1 OFFSET %s"
+
+    cur.execute(sql, all_params + [position])
+    row = cur.fetchone()
+    return list(row) if row else None
+
+
+def cached_rows(cur, sql, params):
+    """
+    Ergebnis (fetchall) von ``sql``, pro Daten-Generation und höchstens
+    COUNT_CACHE_SECONDS lang gecacht. Gedacht für kleine Aggregate.
+    """
+    key = (current_generation(), sql, tuple(params))
+    now = time.monotonic()
+    with _count_cache_lock:
+        hit = _count_cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+
+    cur.execute(sql, list(params))
+    rows = cur.fetchall()
+
+    with _count_cache_lock:
+        _count_cache.pop(key, None)
+        _count_cache[key] = (now + COUNT_CACHE_SECONDS, rows)
+        # abgelaufene Einträge vorne abräumen, dann auf die Obergrenze kürzen
+        while _count_cache:
+            expires, _ = next(iter(_count_cache.values()))
+            if expires > now and len(_count_cache) <= COUNT_CACHE_MAX_ENTRIES:
+                break
+            _count_cache.popitem(last=False)
+    return rows
+
+
+def cached_count(cur, source, where, params, count_expr="COUNT(*)"):
+    """
+    Anzahl für ``source`` + Filter (gecacht wie cached_rows);
+    ``count_expr`` z.B. SUM(device_count) für die Rollup-Tabelle.
+    """
+    sql = f"SELECT {count_expr} FROM {source}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return cached_rows(cur, sql, params)[0][0] or 0
+
+
+def clear_count_cache():
+    with _count_cache_lock:
+        _count_cache.clear()
+
+
+def page_links(request, next_cursor):
+    """
+    URLs für "Erste Seite" / "Nächste Seite"; andere GET-Parameter
+    (Filter, page_size) bleiben erhalten.
+    """
+    query = request.GET.copy()
+    try:
+        page = max(int(query.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+
+    query.pop("after", None)
+    query.pop("page", None)
+    first_url = f"?{query.urlencode()}" if query else "?"
+
+    next_url = None
+    if next_cursor:
+        query["after"] = next_cursor
+        query["page"] = page + 1
+        next_url = f"?{query.urlencode()}"
+
+    return {"page": page, "first_url": first_url, "next_url": next_url}
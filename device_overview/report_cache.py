@@ -0,0 +1,105 @@
+# device_overview/report_cache.py
+
+"""
+Ergebnis-Cache für die vordefinierten Reports.
+
+Die Report-Filter sind fest, das Ergebnis ändert sich also nur per Import.
+Einträge werden über (Report-ID, Daten-Generation, Parameter) gefunden,
+nach Speicherbedarf begrenzt und nach LRU verdrängt. Nach einem Import
+passt die Generation nicht mehr, alte Einträge werden zusätzlich mit
+clear() sofort freigegeben.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .generation import current_generation
+
+# Speicherbudget für alle Report-Ergebnisse zusammen
+REPORT_CACHE_MAX_BYTES = getattr(
+    settings, "DEVICE_REPORT_CACHE_MAX_BYTES", 64 * 1024 * 1024
+)
+
+
+def _estimate_size(value):
+    """Grobe Größe eines Ergebnisses (Listen/Tupel/Dicts von Skalaren)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += _estimate_size(key) + _estimate_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += _estimate_size(item)
+    return size
+
+
+class ReportCache:
+    """
+    LRU-Cache mit Byte-Budget. Ergebnisse, die allein größer als das
+    Budget sind, werden nicht gecacht.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, report_id, builder, *args):
+        """
+        Ergebnis von ``builder()`` für Report ``report_id`` und die
+        aktuelle Generation; ``args`` unterscheidet z.B. Seiten.
+        """
+        key = (report_id, current_generation()) + args
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = builder()
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._entries[key] = (size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else None,
+            }
+
+
+report_cache = ReportCache(REPORT_CACHE_MAX_BYTES)
@@ -0,0 +1,94 @@
+# device_overview/rollup.py
+
+"""
+Vorberechnete Gerätezahlen für Diagramme und Trefferzahlen.
+
+Am Ende des Imports wird device_counts_rollup aus device_flat gebaut:
+eine Zeile pro Kombination SITE_ID × CI_STATUS × TIER3 (plus SITE und
+REGION) mit device_count. Die Spalten heißen wie in device_flat, die
+WHERE-Teile aus _compile_filters/_report_filters passen also unverändert;
+Site-Gruppen laufen wie dort über den Semi-Join auf SITE_ID.
+
+Zählabfragen ohne Freitextsuche summieren dann ein paar tausend Zeilen
+statt den Bestand zu scannen.
+"""
+
+import threading
+import time
+
+from django.db import connections
+
+DEVICE_ALIAS = "device_db"
+
+ROLLUP_TABLE = "device_counts_rollup"
+
+_AVAILABLE_RECHECK_SECONDS = 60
+_available = {"value": False, "checked": 0.0}
+_available_lock = threading.Lock()
+
+
+def _conn():
+    return connections[DEVICE_ALIAS]
+
+
+def rebuild_device_rollup():
+    """device_counts_rollup aus device_flat neu bauen und atomar tauschen."""
+    from .db_sql import _swap_in_table
+
+    with _conn().cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {ROLLUP_TABLE}_new;")
+        cur.execute(f"""
+            CREATE TABLE {ROLLUP_TABLE}_new (
+                INDEX ix_device_counts_rollup_site_id (SITE_ID)
+            )
+            SELECT
+                SITE_ID,
+                SITE,
+                REGION,
+                CI_STATUS,
+                TIER3,
+                COUNT(*) AS device_count
+            FROM device_flat
+            GROUP BY SITE_ID, SITE, REGION, CI_STATUS, TIER3;
+        """)
+        _swap_in_table(cur, ROLLUP_TABLE, f"{ROLLUP_TABLE}_new")
+
+    with _available_lock:
+        _available.update(value=True, checked=time.monotonic())
+
+
+def rollup_available():
+    """
+    Gibt es die Rollup-Tabelle? Auch ein True wird nach
+    _AVAILABLE_RECHECK_SECONDS neu geprüft.
+    """
+    now = time.monotonic()
+    with _available_lock:
+        if now - _available["checked"] < _AVAILABLE_RECHECK_SECONDS:
+            return _available["value"]
+
+    with _conn().cursor() as cur:
+        cur.execute(
+            """
+            SELECT COUNT(*)
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s;
+            """,
+            [ROLLUP_TABLE],
+        )
+        value = cur.fetchone()[0] == 1
+
+    with _available_lock:
+        _available.update(value=value, checked=now)
+    return value
+
+
+def count_source(uses_search=False):
+    """
+    (Quelle, Zählausdruck) für Zählabfragen: die Rollup-Tabelle, wenn sie
+    existiert und nicht per Freitext gesucht wird, sonst device_flat.
+    """
+    if not uses_search and rollup_available():
+        # SIGNED statt DECIMAL, damit JSON eine Zahl bekommt
+        return ROLLUP_TABLE, "CAST(SUM(device_count) AS SIGNED)"
+    return "device_flat", "COUNT(*)"
@@ -0,0 +1,206 @@
+# device_overview/search.py
+
+"""
+Indizierte Freitextsuche für die Analyse (PL_NAME, SHORTDESCRIPTION, MODEL,
+SERIALNUMBER).
+
+Beim Import werden zwei Hilfstabellen gebaut:
+- device_search:          pro Gerät ein denormalisierter Suchtext mit
+                          FULLTEXT-Index (Wort-Präfixsuche)
+- device_serial_suffixes: alle Suffixe jeder Seriennummer; eine
+                          Teilstring-Suche wird damit zu einem Index-Range-
+                          Scan "suffix LIKE 'x%'"
+
+Semantik mit Index (siehe search_condition): Seriennummern weiter als
+Teilstring, PL_NAME/SHORTDESCRIPTION/MODEL als Wortanfang. Fehlen die
+Tabellen, wird wie bisher per LIKE über device_flat gesucht.
+"""
+
+import re
+import threading
+import time
+
+from django.db import connections
+
+DEVICE_ALIAS = "device_db"
+
+# Seriennummern-Suffixe werden auf diese Länge gekürzt
+SERIAL_SUFFIX_LENGTH = 64
+
+# innodb_ft_min_token_size (Default 3): kürzere Wörter kennt der Index nicht
+FULLTEXT_MIN_TOKEN = 3
+
+# Zeichen mit Sonderbedeutung im FULLTEXT-Boolean-Mode
+_TOKEN_SPLIT = re.compile(r"[^\w]+", re.UNICODE)
+
+# "Index vorhanden" merken; "nicht vorhanden" nur kurz
+_AVAILABLE_RECHECK_SECONDS = 60
+_available = {"value": False, "checked": 0.0}
+_available_lock = threading.Lock()
+
+
+def _conn():
+    return connections[DEVICE_ALIAS]
+
+
+def rebuild_search_index():
+    """
+    device_search und device_serial_suffixes aus device_flat neu aufbauen
+    (jeweils als *_new bauen und atomar tauschen).
+    """
+    from .db_sql import _swap_in_table
+
+    with _conn().cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS device_search_new;")
+        cur.execute("""
+            CREATE TABLE device_search_new (
+                device_id   BIGINT NOT NULL PRIMARY KEY,
+                search_text TEXT NOT NULL,
+                FULLTEXT INDEX ft_device_search (search_text)
+            ) ENGINE=InnoDB;
+        """)
+        cur.execute("""
+            INSERT INTO device_search_new (device_id, search_text)
+            SELECT
+                DEVICE_ID,
+                CONCAT_WS(' ', PL_NAME, SHORTDESCRIPTION, MODEL, SERIALNUMBER)
+            FROM device_flat;
+        """)
+
+        # Positionen 1..SERIAL_SUFFIX_LENGTH als Hilfstabelle
+        cur.execute("DROP TEMPORARY TABLE IF EXISTS tmp_suffix_positions;")
+        cur.execute("""
+            CREATE TEMPORARY TABLE tmp_suffix_positions (
+                n SMALLINT NOT NULL PRIMARY KEY
+            );
+        """)
+        cur.executemany(
+            "INSERT INTO tmp_suffix_positions (n) VALUES (%s);",
+            [(n,) for n in range(1, SERIAL_SUFFIX_LENGTH + 1)],
+        )
+
+        cur.execute("DROP TABLE IF EXISTS device_serial_suffixes_new;")
+        cur.execute(f"""
+            CREATE TABLE device_serial_suffixes_new (
+                suffix    VARCHAR({SERIAL_SUFFIX_LENGTH}) NOT NULL,
+                device_id BIGINT NOT NULL,
+                PRIMARY KEY (suffix, device_id)
+            ) ENGINE=InnoDB;
+        """)
+        cur.execute(f"""
+            INSERT IGNORE INTO device_serial_suffixes_new (suffix, device_id)
+            SELECT
+                LEFT(SUBSTRING(f.SERIALNUMBER, p.n), {SERIAL_SUFFIX_LENGTH}),
+                f.DEVICE_ID
+            FROM device_flat f
+            JOIN tmp_suffix_positions p
+              ON p.n <= CHAR_LENGTH(f.SERIALNUMBER)
+            WHERE f.SERIALNUMBER IS NOT NULL AND f.SERIALNUMBER <> '';
+        """)
+        cur.execute("DROP TEMPORARY TABLE IF EXISTS tmp_suffix_positions;")
+
+        _swap_in_table(cur, "device_search", "device_search_new")
+        _swap_in_table(cur, "device_serial_suffixes", "device_serial_suffixes_new")
+
+    with _available_lock:
+        _available.update(value=True, checked=time.monotonic())
+
+
+def search_index_available():
+    """
+    Gibt es die Suchtabellen? Auch ein True wird nach
+    _AVAILABLE_RECHECK_SECONDS neu geprüft (Tabellen können z.B. per Hand
+    oder in einem anderen Prozess entfernt worden sein).
+    """
+    now = time.monotonic()
+    with _available_lock:
+        if now - _available["checked"] < _AVAILABLE_RECHECK_SECONDS:
+            return _available["value"]
+
+    with _conn().cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*)
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE()
+              AND TABLE_NAME IN ('device_search', 'device_serial_suffixes');
+        """)
+        value = cur.fetchone()[0] == 2
+
+    with _available_lock:
+        _available.update(value=value, checked=now)
+    return value
+
+
+def _fulltext_query(term):
+    """
+    Suchbegriff -> FULLTEXT-Boolean-Query (alle Wörter als Präfix).
+    None, wenn ein Wort zu kurz für den Index ist.
+    """
+    tokens = [t for t in _TOKEN_SPLIT.split(term) if t]
+    if not tokens or any(len(t) < FULLTEXT_MIN_TOKEN for t in tokens):
+        return None
+    return " ".join(f"+{t}*" for t in tokens)
+
+
+def _like_escape(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def like_search_condition(term):
+    """Bisherige Suche: Teilstring per LIKE über die vier Spalten."""
+    search = f"%{term}%"
+    condition = """
+        (
+            PL_NAME LIKE %s OR
+            SHORTDESCRIPTION LIKE %s OR
+            MODEL LIKE %s OR
+            SERIALNUMBER LIKE %s
+        )
+    """
+    return condition, [search] * 4
+
+
+def search_condition(term):
+    """
+    WHERE-Teil + Parameter für die Freitextsuche über device_flat.
+
+    Mit Index:
+    - PL_NAME, SHORTDESCRIPTION, MODEL: Wort-Präfixsuche (FULLTEXT), also
+      "Note" findet "Notebook", "book" aber nicht. Wörter unter
+      FULLTEXT_MIN_TOKEN Zeichen kennt der Index nicht; dann Teilstring per
+      LIKE auf diesen drei Spalten.
+    - SERIALNUMBER: Teilstring über die Suffix-Tabelle, auch für ein oder
+      zwei Zeichen; nur Begriffe länger als SERIAL_SUFFIX_LENGTH per LIKE.
+    Ohne Index: LIKE wie bisher über alle vier Spalten.
+    """
+    term = term.strip()
+    if not search_index_available():
+        return like_search_condition(term)
+
+    like = f"%{term}%"
+    fulltext = _fulltext_query(term)
+    if fulltext is not None:
+        parts = ["""
+            DEVICE_ID IN (
+                SELECT device_id FROM device_search
+                WHERE MATCH(search_text) AGAINST (%s IN BOOLEAN MODE)
+            )
+        """]
+        params = [fulltext]
+    else:
+        parts = ["(PL_NAME LIKE %s OR SHORTDESCRIPTION LIKE %s OR MODEL LIKE %s)"]
+        params = [like] * 3
+
+    if len(term) <= SERIAL_SUFFIX_LENGTH:
+        parts.append("""
+            DEVICE_ID IN (
+                SELECT device_id FROM device_serial_suffixes
+                WHERE suffix LIKE %s
+            )
+        """)
+        params.append(_like_escape(term) + "%")
+    else:
+        parts.append("SERIALNUMBER LIKE %s")
+        params.append(like)
+
+    return "(" + " OR ".join(parts) + ")", params
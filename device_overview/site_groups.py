@@ -0,0 +1,84 @@
+# device_overview/site_groups.py
+
+"""
+Site-Gruppen (z.B. DACH) als Tabelle in der device_db.
+
+Statt die Sitecodes als IN-Liste mit über 100 Parametern in jede Abfrage
+zu schreiben, wird gegen site_groups gejoint:
+
+    SITE_ID IN (SELECT s.site_id FROM site_groups g
+                JOIN sites s ON s.site = g.site
+                WHERE g.group_name = 'DACH')
+
+Der Optimierer macht daraus einen Semi-Join über den indizierten site_id.
+"""
+
+from django.conf import settings
+from django.db import transaction
+
+from .db_schema import live_table
+
+DEVICE_ALIAS = "device_db"
+
+DACH = "DACH"
+
+# Gruppen und ihre Sitecodes; werden per migrate_device_db in site_groups
+# übernommen (weitere Gruppen über settings.DEVICE_SITE_GROUPS)
+DEFAULT_SITE_GROUPS = {
+    DACH: [
+        "ARW", "ALS", "ARB", "BYR", "BRL", "BR2", "BEH", "BER", "BLF", "BRB", "BRM",
+        "BRN", "DMM", "DAM", "DED", "DLN", "DPH", "DRT", "DRS", "DUS", "EDM", "ETR",
+        "ETF", "ESC", "ES2", "ESP", "ERB", "FR2", "FR4", "FRK", "FRD", "FRT", "GEL",
+        "GCH", "GC2", "GTH", "GRN", "GDN", "HNV", "HN2", "HN3", "HN4", "HLD", "HCO",
+        "IGS", "KRL", "KSM", "KVL", "KOB", "ELS", "KSC", "KRS", "KRZ", "LNG", "LN2",
+        "LN3", "LSN", "LBR", "LMF", "LVK", "LAT", "LHR", "MGD", "MNN", "MNH", "MH2",
+        "MND", "MGG", "MNC", "MN2", "NKR", "NEU", "NDR", "NRN", "NR2", "NRB", "OBR",
+        "PAS", "PEN", "PEI", "PFL", "PFN", "RAD", "RIZ", "RVS", "RGN", "RG2", "SBR",
+        "SCB", "SCM", "SCN", "SCF", "SCW", "SC2", "SEL", "SNN", "SMM", "SND", "STY",
+        "STT", "THY", "THN", "TRS", "UEB", "UNT", "VNN", "VN2", "VLK", "WGN", "WRD",
+        "WTZ", "WTT", "WTN", "WLF", "WUE", "ZEU", "ZUG",
+    ],
+}
+
+SITE_GROUPS = {
+    **DEFAULT_SITE_GROUPS,
+    **getattr(settings, "DEVICE_SITE_GROUPS", {}),
+}
+
+
+def sync_site_groups(cur):
+    """
+    site_groups (Tabelle aus db_schema) mit SITE_GROUPS abgleichen; läuft
+    in db_schema.migrate() (migrate_device_db), nie im Request-Pfad.
+    """
+    rows = [
+        (group_name, site)
+        for group_name, sites in SITE_GROUPS.items()
+        for site in sites
+    ]
+    placeholders = ", ".join(["%s"] * len(SITE_GROUPS))
+    with transaction.atomic(using=DEVICE_ALIAS):
+        cur.execute(
+            f"DELETE FROM {live_table('site_groups')} WHERE group_name IN ({placeholders});",
+            list(SITE_GROUPS),
+        )
+        cur.executemany(
+            f"INSERT INTO {live_table('site_groups')} (group_name, site) VALUES (%s, %s);",
+            rows,
+        )
+
+
+def site_group_condition(group_name, column="SITE_ID"):
+    """
+    WHERE-Teil + Parameter "``column`` gehört zu Site-Gruppe ``group_name``"
+    für device_flat.
+    """
+    condition = f"""
+        {column} IN (
+            SELECT s.site_id
+            FROM site_groups g
+            JOIN sites s ON s.site = g.site
+            WHERE g.group_name = %s
+        )
+    """
+    return condition, [group_name]
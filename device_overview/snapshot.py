@@ -0,0 +1,343 @@
+# device_overview/snapshot.py
+
+"""
+Optionaler spaltenorientierter Schnappschuss von device_flat im Prozess
+(settings.DEVICE_COLUMNAR_SNAPSHOT).
+
+- jede Spalte ist dictionary-codiert: Werteliste + array("I") mit einem
+  Code pro Zeile
+- für die Filterspalten (BITMAP_COLUMNS) gibt es pro Wert ein Bitmap als
+  Python-int (Bit i = Zeile i), dazu eins pro Site-Gruppe; AND/OR und
+  bit_count() laufen in C über ganze Maschinenworte
+- die Zeilen liegen in der Keyset-Reihenfolge (DEVICE_ORDER_KEY), Cursor
+  sind also mit denen der SQL-Abfragen austauschbar
+
+Die Zeilenblöcke (fetch_device_chunk, fetch_device_columns_page) und die
+Site-Counts (fetch_counts_and_total) in db_sql_analysis.py fragen ihn
+zuerst; passt er nicht zur aktuellen Daten-Generation, ist er noch nicht
+geladen oder wird per Freitext gesucht, läuft die SQL-Abfrage wie bisher.
+Nach einem Import und sobald ein Prozess eine neue Generation sieht, wird
+im Hintergrund neu geladen.
+
+Filterwerte und Site-Gruppierung vergleichen wie die _ci-Collation von
+MariaDB (PAD SPACE): ohne Leerzeichen am Ende, ohne Unterschiede bei
+Groß-/Kleinschreibung und Akzenten (siehe collation_key), damit Treffer
+und Counts nicht davon abhängen, ob der Schnappschuss schon geladen ist.
+"""
+
+import logging
+import threading
+import time
+import unicodedata
+from array import array
+
+from django.conf import settings
+from django.db import connections
+
+from .db_sql import DEVICE_FLAT_COLUMNS
+from .generation import current_generation
+from .pagination import DEVICE_ORDER_KEY, InvalidCursor, encode_cursor
+from .site_groups import DACH, SITE_GROUPS, site_group_condition
+from .streaming import stream_rows
+
+logger = logging.getLogger(__name__)
+
+DEVICE_ALIAS = "device_db"
+
+SNAPSHOT_ENABLED = getattr(settings, "DEVICE_COLUMNAR_SNAPSHOT", False)
+
+# Spalten mit Bitmap pro Wert (niedrige Kardinalität); SITE_ID und
+# DEVICE_ID (für Cursor) werden nur intern mitgeladen, ausgegeben werden
+# die DEVICE_FLAT_COLUMNS
+BITMAP_COLUMNS = ("SITE_ID", "SITE", "CI_STATUS", "TIER3")
+EXTRA_COLUMNS = ("SITE_ID", "DEVICE_ID")
+
+# nach einem fehlgeschlagenen Laden frühestens nach so vielen Sekunden erneut
+RETRY_SECONDS = 60
+
+def collation_key(value):
+    """
+    Vergleichsschlüssel wie eine _ci-Collation mit PAD SPACE: 'Deployed',
+    'deployed' und 'Deployed ' sind gleich, 'Ä' gleich 'a'.
+    """
+    if not isinstance(value, str):
+        return value
+    decomposed = unicodedata.normalize("NFKD", value.rstrip(" "))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def _first_positions(bitmap, count):
+    """Die ersten ``count`` gesetzten Bits von ``bitmap`` aufsteigend."""
+    positions = []
+    while bitmap and len(positions) < count:
+        lowest = bitmap & -bitmap
+        positions.append(lowest.bit_length() - 1)
+        bitmap ^= lowest
+    return positions
+
+
+def _nth_position(bitmap, n):
+    """Position des ``n``-ten gesetzten Bits (0-basiert) oder None."""
+    if bitmap.bit_count() <= n:
+        return None
+    low, high = 0, bitmap.bit_length()
+    while low < high:
+        middle = (low + high) // 2
+        if (bitmap & ((1 << (middle + 1)) - 1)).bit_count() > n:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+class ColumnarSnapshot:
+    """device_flat einer Daten-Generation, spaltenweise im Speicher."""
+
+    def __init__(self, generation, columns, extra_columns=()):
+        self.generation = generation
+        self.columns = list(columns)
+        self.size = 0
+        self.all_columns = self.columns + list(extra_columns)
+        self._values = [[] for _ in self.all_columns]     # Code -> Wert
+        self._codes_of = [{} for _ in self.all_columns]   # Wert -> Code
+        self._data = [array("I") for _ in self.all_columns]
+        self._bitmaps = {}        # Spalte -> {collation_key(Wert): Bitmap}
+        self._labels = {}         # Spalte -> {collation_key(Wert): Wert}
+        self._group_bitmaps = {}  # Site-Gruppe -> Bitmap
+
+    def append(self, row):
+        for values, codes_of, data, value in zip(
+            self._values, self._codes_of, self._data, row
+        ):
+            code = codes_of.get(value)
+            if code is None:
+                code = codes_of[value] = len(values)
+                values.append(value)
+            data.append(code)
+        self.size += 1
+
+    def build_bitmaps(self, group_site_ids):
+        """
+        Bitmaps für BITMAP_COLUMNS und die Site-Gruppen
+        (``group_site_ids``: Gruppe -> SITE_IDs) nach dem Laden aufbauen.
+        """
+        nbytes = (self.size + 7) // 8
+        for column in BITMAP_COLUMNS:
+            index = self.all_columns.index(column)
+            buffers = [bytearray(nbytes) for _ in self._values[index]]
+            for row, code in enumerate(self._data[index]):
+                buffers[code][row >> 3] |= 1 << (row & 7)
+            # Werte, die die Collation gleich behandelt, zusammenfassen;
+            # Reihenfolge und angezeigter Wert nach erstem Auftreten, bei
+            # SITE also wie GROUP BY SITE ORDER BY SITE
+            bitmaps, labels = {}, {}
+            for value, buffer in zip(self._values[index], buffers):
+                key = collation_key(value)
+                labels.setdefault(key, value)
+                bitmaps[key] = bitmaps.get(key, 0) | int.from_bytes(buffer, "little")
+            self._bitmaps[column] = bitmaps
+            self._labels[column] = labels
+
+        site_bitmaps = self._bitmaps["SITE_ID"]
+        for group, site_ids in group_site_ids.items():
+            bitmap = 0
+            for site_id in site_ids:
+                bitmap |= site_bitmaps.get(site_id, 0)
+            self._group_bitmaps[group] = bitmap
+
+    def mask(self, filters):
+        """
+        Bitmap der Zeilen zu den Analyse-Filtern (siehe _compile_filters);
+        None bei Freitextsuche, die nur die Datenbank beantworten kann.
+        """
+        if filters.get("search"):
+            return None
+
+        mask = (1 << self.size) - 1
+        if filters.get("dach_only"):
+            mask &= self._group_bitmaps.get(DACH, 0)
+        if filters.get("ci_status"):
+            mask &= self._bitmaps["CI_STATUS"].get(collation_key(filters["ci_status"]), 0)
+        if filters.get("tier3"):
+            mask &= self._bitmaps["TIER3"].get(collation_key(filters["tier3"]), 0)
+        return mask
+
+    def _decode(self, positions, columns):
+        """Zeilen ``positions`` als Tupel aus ``columns``, spaltenweise decodiert."""
+        decoded = []
+        for column in columns:
+            index = self.all_columns.index(column)
+            values, data = self._values[index], self._data[index]
+            decoded.append([values[data[row]] for row in positions])
+        return list(zip(*decoded))
+
+    def _row_of_device(self, device_id):
+        # DEVICE_ID ist eindeutig, sein Dictionary-Code ist also die Zeilennummer
+        return self._codes_of[self.all_columns.index("DEVICE_ID")].get(device_id)
+
+    def chunk(self, mask, after=None, start=0, limit=100, columns=None):
+        """
+        Block wie fetch_keyset_page: ``limit`` Zeilen zu ``mask`` nach dem
+        Cursor ``after`` (Sortierschlüssel der letzten Zeile, DEVICE_ID
+        zuletzt) oder ab Trefferposition ``start``.
+
+        Rückgabe: (rows, next_key) - next_key ist der Sortierschlüssel der
+        letzten Zeile, wenn weitere folgen; None, wenn der Cursor nicht im
+        Schnappschuss vorkommt.
+        """
+        if after:
+            row = self._row_of_device(after[-1])
+            if row is None:
+                return None
+            mask &= ~((1 << (row + 1)) - 1)
+        elif start:
+            first = _nth_position(mask, start)
+            if first is None:
+                return [], None
+            mask &= ~((1 << first) - 1)
+
+        positions = _first_positions(mask, limit + 1)
+        has_more = len(positions) > limit
+        positions = positions[:limit]
+        rows = self._decode(positions, columns or self.columns)
+
+        next_key = None
+        if has_more:
+            next_key = list(self._decode(positions[-1:], DEVICE_ORDER_KEY)[0])
+        return rows, next_key
+
+    def counts_by_site(self, mask):
+        """(SITE, Anzahl) für Sites mit Treffern, sortiert wie ORDER BY SITE."""
+        labels = self._labels["SITE"]
+        counts = []
+        for key, bitmap in self._bitmaps["SITE"].items():
+            count = (bitmap & mask).bit_count()
+            if count:
+                counts.append((labels[key], count))
+        return counts
+
+
+def load_snapshot(generation):
+    """device_flat per Server-Side-Cursor in einen neuen Schnappschuss laden."""
+    snapshot = ColumnarSnapshot(generation, DEVICE_FLAT_COLUMNS, EXTRA_COLUMNS)
+    # Keyset-Reihenfolge, wie fetch_keyset_page
+    sql = f"""
+        SELECT {", ".join(snapshot.all_columns)}
+        FROM device_flat
+        ORDER BY {", ".join(DEVICE_ORDER_KEY)}
+    """
+    rows = stream_rows(sql)
+    next(rows)  # Spaltennamen
+    for row in rows:
+        snapshot.append(row)
+
+    group_site_ids = {}
+    with connections[DEVICE_ALIAS].cursor() as cur:
+        for group in SITE_GROUPS:
+            condition, params = site_group_condition(group, column="site_id")
+            cur.execute(f"SELECT site_id FROM sites WHERE {condition}", params)
+            group_site_ids[group] = [row[0] for row in cur.fetchall()]
+
+    snapshot.build_bitmaps(group_site_ids)
+    return snapshot
+
+
+_snapshot = None
+_state = {"loading": False, "failed_at": None}
+_lock = threading.Lock()
+
+
+def reload_snapshot():
+    """Schnappschuss zur aktuellen Generation laden und aktivieren."""
+    global _snapshot
+
+    started = time.monotonic()
+    snapshot = load_snapshot(current_generation())
+    with _lock:
+        _snapshot = snapshot
+        _state["failed_at"] = None
+    logger.info(
+        "device_flat-Schnappschuss geladen: Generation %s, %d Zeilen, %.1f s",
+        snapshot.generation, snapshot.size, time.monotonic() - started,
+    )
+    return snapshot
+
+
+def _reload_in_background():
+    try:
+        reload_snapshot()
+    except Exception:
+        logger.exception("Laden des device_flat-Schnappschusses fehlgeschlagen")
+        with _lock:
+            _state["failed_at"] = time.monotonic()
+    finally:
+        with _lock:
+            _state["loading"] = False
+        connections[DEVICE_ALIAS].close()
+
+
+def schedule_reload():
+    """Neu laden im Hintergrund anstoßen (einmal gleichzeitig pro Prozess)."""
+    if not SNAPSHOT_ENABLED:
+        return
+    with _lock:
+        if _state["loading"]:
+            return
+        _state["loading"] = True
+    threading.Thread(
+        target=_reload_in_background, name="device-snapshot", daemon=True,
+    ).start()
+
+
+def get_snapshot():
+    """
+    Schnappschuss zur aktuellen Daten-Generation oder None (abgeschaltet,
+    veraltet oder noch nicht geladen; dann wird das Laden angestoßen).
+    """
+    if not SNAPSHOT_ENABLED:
+        return None
+
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.generation == current_generation():
+        return snapshot
+
+    with _lock:
+        failed_at = _state["failed_at"]
+        retry_pending = (
+            failed_at is not None and time.monotonic() - failed_at < RETRY_SECONDS
+        )
+    if not retry_pending:
+        schedule_reload()
+    return None
+
+
+def snapshot_chunk(filters, after=None, start=0, limit=100, columns=None):
+    """
+    (rows, next_cursor) zu den Analyse-Filtern aus dem Schnappschuss oder
+    None (siehe ColumnarSnapshot.chunk).
+    """
+    if after and len(after) != len(DEVICE_ORDER_KEY):
+        raise InvalidCursor("Cursor passt nicht zum Sortierschlüssel")
+
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    mask = snapshot.mask(filters)
+    if mask is None:
+        return None
+    result = snapshot.chunk(mask, after, start, limit, columns)
+    if result is None:
+        return None
+    rows, next_key = result
+    return rows, encode_cursor(next_key) if next_key else None
+
+
+def snapshot_counts_by_site(filters):
+    """[(SITE, Anzahl), ...] zu den Analyse-Filtern aus dem Schnappschuss oder None."""
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    mask = snapshot.mask(filters)
+    if mask is None:
+        return None
+    return snapshot.counts_by_site(mask)
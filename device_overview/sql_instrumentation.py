@@ -0,0 +1,205 @@
+# device_overview/sql_instrumentation.py
+
+"""
+Messung der SQL-Abfragen auf device_db pro Request (auch ohne DEBUG).
+
+Die Middleware hängt einen execute_wrapper an connections["device_db"] und
+zählt pro Request Anzahl, Gesamtzeit und gelieferte Zeilen. Statements
+über DEVICE_SLOW_QUERY_MS landen normalisiert im Log; Aggregate pro
+normalisiertem Statement und die letzten Requests hält der Prozess im
+Speicher (Staff-Endpunkt SqlStatsView). Abfragen, die der Request in
+Worker-Threads ausführt (concurrent_db.py), zählen über
+instrument_current_thread() mit. Gestreamte Abfragen (streaming.py) laufen
+am execute_wrapper vorbei und nach der Middleware; sie meldet
+record_statement() direkt in die Aggregate.
+"""
+
+import contextlib
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connections
+
+DEVICE_ALIAS = "device_db"
+
+logger = logging.getLogger("device_overview.sql")
+
+# Statements ab dieser Laufzeit werden geloggt
+SLOW_QUERY_MS = getattr(settings, "DEVICE_SLOW_QUERY_MS", 500)
+
+# so viele Requests bzw. unterschiedliche Statements im Speicher halten
+RECENT_REQUESTS = 100
+MAX_STATEMENTS = 500
+
+_NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_current_recorder = contextvars.ContextVar("device_db_query_recorder", default=None)
+_recent = deque(maxlen=RECENT_REQUESTS)
+_statements = {}
+
+
+def normalize_sql(sql):
+    """
+    SQL ohne Literale und mit einheitlichem Whitespace, damit gleiche
+    Abfragen mit anderen Parametern zusammengefasst werden.
+    """
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?)", sql)
+    sql = sql.replace("%s", "?")
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+class QueryRecorder:
+    """execute_wrapper für einen Request."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.rows = 0
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            cursor = context.get("cursor")
+            rowcount = getattr(cursor, "rowcount", -1)
+            rows = rowcount if rowcount and rowcount > 0 else 0
+
+            with self._lock:
+                self.count += 1
+                self.total_ms += elapsed_ms
+                self.rows += rows
+                self.statements.append((sql, elapsed_ms, rows))
+
+            _log_if_slow(sql, elapsed_ms, rows)
+
+
+def _log_if_slow(sql, elapsed_ms, rows):
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning(
+            "Langsames SQL auf %s (%.0f ms, %d Zeilen): %s",
+            DEVICE_ALIAS, elapsed_ms, rows, normalize_sql(sql),
+        )
+
+
+def instrument_current_thread():
+    """
+    Context-Manager: hängt den QueryRecorder des laufenden Requests an die
+    device_db-Verbindung des aktuellen Threads (für Worker-Threads).
+    """
+    recorder = _current_recorder.get()
+    if recorder is None:
+        return contextlib.nullcontext()
+    return connections[DEVICE_ALIAS].execute_wrapper(recorder)
+
+
+def _record(path, recorder):
+    with _lock:
+        _recent.append({
+            "path": path,
+            "queries": recorder.count,
+            "total_ms": round(recorder.total_ms, 1),
+            "rows": recorder.rows,
+            "at": time.time(),
+        })
+        for sql, elapsed_ms, rows in recorder.statements:
+            _add_statement(sql, elapsed_ms, rows)
+
+
+def _add_statement(sql, elapsed_ms, rows):
+    # nur unter _lock aufrufen
+    key = normalize_sql(sql)
+    stats = _statements.get(key)
+    if stats is None:
+        if len(_statements) >= MAX_STATEMENTS:
+            # am wenigsten teures Statement verdrängen
+            cheapest = min(_statements, key=lambda k: _statements[k]["total_ms"])
+            del _statements[cheapest]
+        stats = _statements[key] = {
+            "count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0,
+        }
+    stats["count"] += 1
+    stats["total_ms"] += elapsed_ms
+    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+    stats["rows"] += rows
+
+
+def record_statement(sql, elapsed_ms, rows):
+    """
+    Statement, das nicht über den execute_wrapper lief (Server-Side-Cursor
+    in streaming.py), in die Aggregate übernehmen; ``elapsed_ms`` reicht
+    dort bis zur letzten gelesenen Zeile.
+    """
+    _log_if_slow(sql, elapsed_ms, rows)
+    with _lock:
+        _add_statement(sql, elapsed_ms, rows)
+
+
+def sql_stats(limit=50):
+    """Letzte Requests + teuerste Statements (nach Gesamtzeit)."""
+    with _lock:
+        statements = sorted(
+            _statements.items(), key=lambda item: item[1]["total_ms"], reverse=True,
+        )[:limit]
+        return {
+            "slow_query_ms": SLOW_QUERY_MS,
+            "recent_requests": list(_recent),
+            "statements": [
+                {
+                    "sql": sql,
+                    "count": stats["count"],
+                    "total_ms": round(stats["total_ms"], 1),
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 1),
+                    "max_ms": round(stats["max_ms"], 1),
+                    "rows": stats["rows"],
+                }
+                for sql, stats in statements
+            ],
+        }
+
+
+def reset_sql_stats():
+    """Letzte Requests und Statement-Aggregate verwerfen (SqlStatsView, POST)."""
+    with _lock:
+        _recent.clear()
+        _statements.clear()
+
+
+class DeviceDbQueryMiddleware:
+    """
+    Misst alle device_db-Abfragen eines Requests; Zusammenfassung steht
+    zusätzlich im Header X-Device-DB-Queries.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        token = _current_recorder.set(recorder)
+        try:
+            with connections[DEVICE_ALIAS].execute_wrapper(recorder):
+                response = self.get_response(request)
+        finally:
+            _current_recorder.reset(token)
+
+        if recorder.count:
+            _record(request.path, recorder)
+            response["X-Device-DB-Queries"] = (
+                f"{recorder.count}; {recorder.total_ms:.1f}ms; rows={recorder.rows}"
+            )
+        return response
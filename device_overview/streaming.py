@@ -0,0 +1,205 @@
+# device_overview/streaming.py
+
+"""
+Große Ergebnisse streamen statt mit fetchall() zu materialisieren.
+
+Die Zeilen kommen über einen ungepufferten MariaDB-Cursor (SSCursor): der
+Server schickt sie, während wir sie lesen, und der Speicherbedarf bleibt
+unabhängig von der Ergebnisgröße konstant. Ausgabe als CSV (iter_csv)
+oder als fertig escapte HTML-Tabelle (iter_html_page).
+
+Responses immer über streaming_response() bauen: unter ASGI liest Django
+einen synchronen Iterator sonst erst komplett in eine Liste.
+"""
+
+import csv
+import html
+import time
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from django.http import StreamingHttpResponse
+from MySQLdb.cursors import SSCursor
+
+from .sql_instrumentation import record_statement
+
+DEVICE_ALIAS = "device_db"
+
+# Zeilen pro fetchmany() vom Server
+STREAM_FETCH_ROWS = 1000
+
+# CSV-Zeilen, die zu einem Chunk der Response zusammengefasst werden
+CSV_CHUNK_ROWS = 500
+
+# HTML-Tabellenzeilen pro Chunk der Response
+HTML_CHUNK_ROWS = 200
+
+# Platzhalter im Template, an dem iter_html_page die Tabelle einsetzt
+HTML_TABLE_MARKER = "<!-- device-table-rows -->"
+
+
+def stream_rows(sql, params=None, fetch_rows=STREAM_FETCH_ROWS):
+    """
+    Generator über das Ergebnis von ``sql`` mit einem Server-Side-Cursor.
+
+    Das erste Element sind die Spaltennamen, danach folgen die Zeilen.
+    Solange der Generator läuft, ist die device_db-Verbindung belegt;
+    er muss also vollständig gelesen oder geschlossen werden.
+
+    Der Cursor läuft am execute_wrapper vorbei; Laufzeit (bis zum Schließen)
+    und Zeilenzahl gehen deshalb per record_statement() in die SQL-Statistik.
+    """
+    conn = connections[DEVICE_ALIAS]
+    conn.ensure_connection()
+    cur = conn.connection.cursor(SSCursor)
+    started = time.perf_counter()
+    count = 0
+    try:
+        cur.execute(sql, params or None)
+        yield [col[0] for col in cur.description]
+        while True:
+            rows = cur.fetchmany(fetch_rows)
+            if not rows:
+                break
+            count += len(rows)
+            yield from rows
+    finally:
+        # liest ggf. den Rest vom Server, damit die Verbindung frei wird
+        cur.close()
+        record_statement(sql, (time.perf_counter() - started) * 1000, count)
+
+
+class _Echo:
+    """Pseudo-Datei für csv.writer: gibt die geschriebene Zeile zurück."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, delimiter=";", chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Zeilen (inkl. Kopfzeile als erstes Element) als CSV-Bytes in Chunks.
+
+    Die Kopfzeile geht sofort raus, damit der Download ohne Wartezeit
+    startet. BOM vorne dran, damit Excel UTF-8 erkennt.
+    """
+    writer = csv.writer(_Echo(), delimiter=delimiter)
+    rows = iter(rows)
+
+    header = next(rows, None)
+    if header is None:
+        return
+    yield ("\ufeff" + writer.writerow(header)).encode("utf-8")
+
+    buffer = []
+    for row in rows:
+        buffer.append(writer.writerow(row))
+        if len(buffer) >= chunk_rows:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def _html_cell(value):
+    # wie {{ cell }} im Template: str() + Escaping
+    return "<td>" + html.escape(str(value)) + "</td>"
+
+
+def iter_html_table(rows, empty_text="Keine Daten vorhanden.",
+                    chunk_rows=HTML_CHUNK_ROWS):
+    """
+    Zeilen (inkl. Kopfzeile als erstes Element) als <thead>/<tbody>-HTML
+    in Chunks, ohne Template-Engine. Die Kopfzeile geht sofort raus.
+    """
+    rows = iter(rows)
+
+    header = next(rows, None)
+    if header is None:
+        return
+    yield (
+        '<thead class="table-dark"><tr>'
+        + "".join(f'<th scope="col">{html.escape(col)}</th>' for col in header)
+        + "</tr></thead><tbody>"
+    )
+
+    buffer = []
+    empty = True
+    for row in rows:
+        buffer.append("<tr>" + "".join(map(_html_cell, row)) + "</tr>\n")
+        if len(buffer) >= chunk_rows:
+            yield "".join(buffer)
+            buffer = []
+            empty = False
+    if buffer:
+        yield "".join(buffer)
+        empty = False
+    if empty:
+        yield (
+            f'<tr><td colspan="{len(header)}">{html.escape(empty_text)}</td></tr>'
+        )
+    yield "</tbody>"
+
+
+def iter_html_page(page_html, rows, **table_options):
+    """
+    Gerenderte Seite mit HTML_TABLE_MARKER als Bytes-Chunks: erst alles vor
+    dem Marker (Browser beginnt zu zeichnen), dann die Tabellenzeilen aus
+    ``rows``, dann der Rest der Seite.
+    """
+    head, _, tail = page_html.partition(HTML_TABLE_MARKER)
+    yield head.encode("utf-8")
+    for chunk in iter_html_table(rows, **table_options):
+        yield chunk.encode("utf-8")
+    yield tail.encode("utf-8")
+
+
+def gzip_chunks(chunks, level=6):
+    """Byte-Chunks inkrementell gzip-komprimieren."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = gzip-Header
+    first = True
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if first:
+            # ersten Chunk sofort rausschieben (Time-to-first-byte)
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+_DONE = object()
+
+
+async def aiter_in_thread(chunks):
+    """
+    Synchronen Iterator als async Iterator: jeder Chunk wird per
+    sync_to_async im selben Thread geholt (der Server-Side-Cursor gehört
+    zur Verbindung dieses Threads).
+    """
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, _DONE)
+            if chunk is _DONE:
+                break
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            # Generator schließen -> Cursor schließen, Verbindung frei
+            await sync_to_async(close, thread_sensitive=True)()
+
+
+def streaming_response(request, chunks, **kwargs):
+    """
+    StreamingHttpResponse, die unter WSGI und ASGI Chunk für Chunk
+    ausliefert (unter ASGI über aiter_in_thread).
+    """
+    if isinstance(request, ASGIRequest):
+        chunks = aiter_in_thread(chunks)
+    return StreamingHttpResponse(chunks, **kwargs)
@@ -1,3 +1,1097 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase
+
+from . import db_schema, db_sql, import_jobs, pagination, rollup, search
+from .benchmark import generate_cmdb_rows
+from .concurrent_db import MAX_WORKERS, gather_queries, run_concurrently
+from .db_pool import ConnectionPool
+from .snapshot import (
+    EXTRA_COLUMNS,
+    ColumnarSnapshot,
+    _first_positions,
+    _nth_position,
+    collation_key,
+)
+from .db_sql import (
+    CSV_COLUMNS,
+    DEVICE_COLUMNS,
+    DEVICE_FLAT_COLUMNS,
+    SIMPLE_LOOKUPS,
+    _batched,
+    _iter_staging_rows,
+    _shadow_table_ddl,
+)
+from .db_schema import _index_column_sql
+from .db_sql_analysis import _compile_filters, _counts_by_site_query
+from .db_sql_reports import build_dach_deployed_t3_counts_query
+from .pagination import (
+    InvalidCursor,
+    cached_rows,
+    cursor_at_offset,
+    decode_cursor,
+    encode_cursor,
+    keyset_condition,
+)
+from .report_cache import ReportCache
+from .site_groups import DACH, SITE_GROUPS, site_group_condition
+from .sql_instrumentation import record_statement, reset_sql_stats, sql_stats
+from .streaming import aiter_in_thread, stream_rows
+
+
+def _thread_name():
+    return threading.current_thread().name
+
+
+def _outer():
+    # verschachtelter Aufruf aus einem Worker
+    return _thread_name(), run_concurrently((_thread_name,), (_thread_name,))
+
+
+class ConcurrentDbTests(SimpleTestCase):
+
+    def test_run_concurrently_keeps_order(self):
+        results = run_concurrently((pow, 2, 3), (pow, 3, 2), (abs, -4))
+        self.assertEqual(results, [8, 9, 4])
+
+    def test_nested_run_concurrently_runs_inline(self):
+        for outer_thread, inner_threads in run_concurrently((_outer,), (_outer,)):
+            self.assertTrue(outer_thread.startswith("device-query"))
+            self.assertEqual(inner_threads, [outer_thread, outer_thread])
+
+    def test_nested_call_in_gather_queries_runs_inline(self):
+        results = async_to_sync(gather_queries)((_outer,), (_outer,), (_outer,))
+        for outer_thread, inner_threads in results:
+            self.assertTrue(outer_thread.startswith("device-query"))
+            self.assertEqual(inner_threads, [outer_thread, outer_thread])
+
+    def test_fan_out_is_bounded_by_max_workers(self):
+        lock = threading.Lock()
+        state = {"active": 0, "peak": 0}
+
+        def busy():
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.02)
+            with lock:
+                state["active"] -= 1
+
+        def nested():
+            run_concurrently((busy,), (busy,), (busy,))
+
+        calls = [(nested,)] * (MAX_WORKERS * 2)
+        async_to_sync(gather_queries)(*calls)
+        run_concurrently(*calls)
+        self.assertLessEqual(state["peak"], MAX_WORKERS)
+
+
+# (PL_NAME, SITE, SERIALNUMBER, CI_STATUS, TIER3, SITE_ID, DEVICE_ID),
+# sortiert wie ORDER BY SITE, PL_NAME, SERIALNUMBER, DEVICE_ID
+SNAPSHOT_ROWS = [
+    ("PC-1", None, "S1", "Deployed", "Notebook", None, 10),
+    ("PC-2", "BER", "S2", "Deployed", "Notebook", 1, 11),
+    ("PC-3", "Ber ", "S3", "deployed", "Computer", 2, 12),
+    ("PC-4", "MUC", "S4", "Retired", "Notebook", 3, 13),
+    ("PC-5", "MUC", "S5", "Deployed", "Notebook", 3, 14),
+    ("PC-6", "NYC", "S6", "Deployed", "Notebook", 4, 15),
+]
+SNAPSHOT_COLUMNS = ["PL_NAME", "SITE", "SERIALNUMBER", "CI_STATUS", "TIER3"]
+
+
+class SnapshotTests(SimpleTestCase):
+
+    def setUp(self):
+        self.snapshot = ColumnarSnapshot(1, SNAPSHOT_COLUMNS, EXTRA_COLUMNS)
+        for row in SNAPSHOT_ROWS:
+            self.snapshot.append(row)
+        self.snapshot.build_bitmaps({"DACH": [1, 2, 3]})
+
+    def pl_names(self, rows):
+        return [row[0] for row in rows]
+
+    def test_bit_helpers(self):
+        bitmap = 0b1011001
+        self.assertEqual(_first_positions(bitmap, 10), [0, 3, 4, 6])
+        self.assertEqual(_first_positions(bitmap, 2), [0, 3])
+        self.assertEqual(_first_positions(0, 3), [])
+        self.assertEqual([_nth_position(bitmap, n) for n in range(4)], [0, 3, 4, 6])
+        self.assertIsNone(_nth_position(bitmap, 4))
+
+    def test_collation_key(self):
+        self.assertEqual(collation_key("Deployed "), collation_key("deployed"))
+        self.assertEqual(collation_key("Ärger"), collation_key("arger"))
+        self.assertNotEqual(collation_key(" BER"), collation_key("BER"))
+        self.assertEqual(collation_key(3), 3)
+        self.assertIsNone(collation_key(None))
+
+    def test_mask_matches_like_collation(self):
+        mask = self.snapshot.mask({"ci_status": "DEPLOYED", "dach_only": True})
+        rows, next_key = self.snapshot.chunk(mask, limit=10)
+        self.assertEqual(self.pl_names(rows), ["PC-2", "PC-3", "PC-5"])
+        self.assertIsNone(next_key)
+        self.assertIsNone(self.snapshot.mask({"search": "PC"}))
+
+    def test_unknown_filter_value_matches_nothing(self):
+        mask = self.snapshot.mask({"tier3": "Server"})
+        self.assertEqual(self.snapshot.chunk(mask, limit=10), ([], None))
+
+    def test_counts_by_site_groups_like_collation(self):
+        mask = self.snapshot.mask({})
+        self.assertEqual(
+            self.snapshot.counts_by_site(mask),
+            [(None, 1), ("BER", 2), ("MUC", 2), ("NYC", 1)],
+        )
+
+    def test_chunk_cursor_and_start(self):
+        mask = self.snapshot.mask({"tier3": "notebook"})
+        rows, next_key = self.snapshot.chunk(mask, limit=2)
+        self.assertEqual(self.pl_names(rows), ["PC-1", "PC-2"])
+        # Sortierschlüssel wie fetch_keyset_page: SITE, PL_NAME, SERIALNUMBER, DEVICE_ID
+        self.assertEqual(next_key, ["BER", "PC-2", "S2", 11])
+
+        rows, next_key = self.snapshot.chunk(mask, after=next_key, limit=2)
+        self.assertEqual(self.pl_names(rows), ["PC-4", "PC-5"])
+        rows, next_key = self.snapshot.chunk(mask, after=next_key, limit=2)
+        self.assertEqual(self.pl_names(rows), ["PC-6"])
+        self.assertIsNone(next_key)
+
+        rows, _ = self.snapshot.chunk(mask, start=3, limit=10)
+        self.assertEqual(self.pl_names(rows), ["PC-5", "PC-6"])
+        self.assertEqual(self.snapshot.chunk(mask, start=9, limit=10), ([], None))
+
+    def test_chunk_with_unknown_cursor_falls_back(self):
+        mask = self.snapshot.mask({})
+        self.assertIsNone(self.snapshot.chunk(mask, after=["X", "Y", "Z", 999]))
+
+    def test_chunk_column_projection(self):
+        mask = self.snapshot.mask({})
+        rows, _ = self.snapshot.chunk(mask, limit=1, columns=["SERIALNUMBER", "SITE"])
+        self.assertEqual(rows, [("S1", None)])
+
+
+class AiterInThreadTests(SimpleTestCase):
+
+    def test_yields_chunks_and_closes_generator(self):
+        state = {"closed": False}
+
+        def chunks():
+            try:
+                yield b"a"
+                yield b"b"
+                yield b"c"
+            finally:
+                state["closed"] = True
+
+        async def first_two():
+            received = []
+            stream = aiter_in_thread(chunks())
+            async for chunk in stream:
+                received.append(chunk)
+                if len(received) == 2:
+                    break
+            await stream.aclose()
+            return received
+
+        async def collect():
+            return [chunk async for chunk in aiter_in_thread(chunks())]
+
+        self.assertEqual(async_to_sync(collect)(), [b"a", b"b", b"c"])
+        self.assertTrue(state["closed"])
+
+        state["closed"] = False
+        self.assertEqual(async_to_sync(first_two)(), [b"a", b"b"])
+        self.assertTrue(state["closed"])
+
+
+class CursorTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        values = ["BER", None, "S1", 42]
+        self.assertEqual(decode_cursor(encode_cursor(values)), values)
+
+    def test_invalid_cursor_means_first_page(self):
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor(""))
+        self.assertIsNone(decode_cursor("kein base64!"))
+        self.assertIsNone(decode_cursor(base64.urlsafe_b64encode(b"{kein json").decode()))
+
+    def test_only_flat_scalar_lists(self):
+        self.assertIsNone(decode_cursor(encode_cursor([["BER"], 1])))
+        self.assertIsNone(decode_cursor(encode_cursor([{"a": 1}])))
+        self.assertIsNone(decode_cursor(base64.urlsafe_b64encode(b'{"a": 1}').decode()))
+
+    def test_keyset_condition(self):
+        sql, params = keyset_condition(["A", "B"], ["x", 5])
+        self.assertEqual(sql, "((A > %s) OR (A <=> %s AND B > %s))")
+        self.assertEqual(params, ["x", "x", 5])
+
+    def test_keyset_condition_null_sorts_first(self):
+        sql, params = keyset_condition(["A", "B"], [None, None])
+        self.assertEqual(sql, "((A IS NOT NULL) OR (A <=> %s AND B IS NOT NULL))")
+        self.assertEqual(params, [None])
+
+    def test_keyset_condition_rejects_wrong_length(self):
+        with self.assertRaises(InvalidCursor):
+            keyset_condition(["A", "B"], ["x"])
+
+
+class _FakeCursor:
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return [(len(self.executed),)]
+
+
+class CursorAtOffsetTests(SimpleTestCase):
+
+    SITE_COUNTS = [(None, 2), ("BER", 10), ("HAM", 4)]
+
+    def _jump(self, offset):
+        cur = mock.Mock()
+        cur.fetchone.return_value = ("X", "P", "S", 1)
+        cursor = cursor_at_offset(cur, "device_flat", [], [], offset, site_counts=self.SITE_COUNTS)
+        return cursor, cur
+
+    def test_seeks_within_site_from_the_front(self):
+        cursor, cur = self._jump(5)  # Zeile 4 = BER, Position 2
+        sql, params = cur.execute.call_args[0]
+        self.assertIn("SITE <=> %s", sql)
+        self.assertNotIn("DESC", sql)
+        self.assertEqual(params, ["BER", 2])
+        self.assertEqual(cursor, ["X", "P", "S", 1])
+
+    def test_seeks_within_site_from_the_back(self):
+        _, cur = self._jump(16)  # letzte Zeile: HAM, Position 3 von 4
+        sql, params = cur.execute.call_args[0]
+        self.assertIn("DEVICE_ID DESC", sql)
+        self.assertEqual(params, ["HAM", 0])
+
+    def test_null_site_and_out_of_range(self):
+        _, cur = self._jump(1)
+        self.assertEqual(cur.execute.call_args[0][1], [None, 0])
+        cursor, cur = self._jump(17)
+        self.assertIsNone(cursor)
+        cur.execute.assert_not_called()
+
+
+@mock.patch("device_overview.pagination.current_generation", return_value=1)
+class CountCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        pagination.clear_count_cache()
+        self.addCleanup(pagination.clear_count_cache)
+
+    def test_hit_per_sql_and_params(self, _generation):
+        cur = _FakeCursor()
+        self.assertEqual(cached_rows(cur, "SELECT 1", [1]), [(1,)])
+        self.assertEqual(cached_rows(cur, "SELECT 1", [1]), [(1,)])
+        self.assertEqual(cached_rows(cur, "SELECT 1", [2]), [(2,)])
+        self.assertEqual(len(cur.executed), 2)
+
+    def test_size_is_bounded(self, _generation):
+        cur = _FakeCursor()
+        with mock.patch.object(pagination, "COUNT_CACHE_MAX_ENTRIES", 3):
+            for term in range(10):
+                cached_rows(cur, "SELECT COUNT(*)", [f"suche {term}"])
+        self.assertEqual(len(pagination._count_cache), 3)
+
+    def test_expired_entries_are_pruned(self, _generation):
+        cur = _FakeCursor()
+        with mock.patch.object(pagination, "COUNT_CACHE_SECONDS", -1):
+            cached_rows(cur, "SELECT 1", [1])
+            cached_rows(cur, "SELECT 1", [2])
+        cached_rows(cur, "SELECT 1", [3])
+        self.assertEqual(len(pagination._count_cache), 1)
+
+
+@mock.patch("device_overview.report_cache.current_generation", return_value=1)
+class ReportCacheTests(SimpleTestCase):
+
+    def test_hit_and_miss(self, _generation):
+        cache = ReportCache(max_bytes=10_000)
+        builder = mock.Mock(return_value=[1, 2, 3])
+        self.assertEqual(cache.get_or_compute("r", builder, 1), [1, 2, 3])
+        self.assertEqual(cache.get_or_compute("r", builder, 1), [1, 2, 3])
+        cache.get_or_compute("r", builder, 2)
+        self.assertEqual(builder.call_count, 2)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_lru_eviction_by_bytes(self, _generation):
+        value = list(range(50))
+        probe = ReportCache(max_bytes=10**9)
+        probe.get_or_compute("probe", lambda: value)
+        entry_bytes = probe.stats()["bytes"]
+
+        cache = ReportCache(max_bytes=entry_bytes * 2)
+        cache.get_or_compute("a", lambda: list(value))
+        cache.get_or_compute("b", lambda: list(value))
+        cache.get_or_compute("a", lambda: list(value))  # a zuletzt benutzt
+        cache.get_or_compute("c", lambda: list(value))  # verdrängt b
+
+        builder = mock.Mock(return_value=value)
+        cache.get_or_compute("a", builder)
+        cache.get_or_compute("b", builder)
+        self.assertEqual(builder.call_count, 1)
+        self.assertEqual(cache.stats()["evictions"], 2)
+        self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+
+    def test_too_large_results_are_not_cached(self, _generation):
+        cache = ReportCache(max_bytes=10)
+        builder = mock.Mock(return_value=list(range(100)))
+        cache.get_or_compute("r", builder)
+        cache.get_or_compute("r", builder)
+        self.assertEqual(builder.call_count, 2)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class StagingRowsTests(SimpleTestCase):
+
+    def test_batched(self):
+        self.assertEqual(list(_batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(_batched([], 2)), [])
+
+    def test_iter_staging_rows(self):
+        data = io.StringIO(
+            "PL_NAME;SITE;UNBEKANNT\n"
+            " PC-1 ;BER;x\n"
+            ";;\n"
+            "PC-2;;\n"
+        )
+        rows = list(_iter_staging_rows(csv.DictReader(data, delimiter=";")))
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(len(rows[0]), len(CSV_COLUMNS))
+        first = dict(zip(CSV_COLUMNS, rows[0]))
+        self.assertEqual((first["PL_NAME"], first["SITE"], first["REGION"]), ("PC-1", "BER", ""))
+        self.assertEqual(dict(zip(CSV_COLUMNS, rows[1]))["PL_NAME"], "PC-2")
+
+
+class CmdbGeneratorTests(SimpleTestCase):
+
+    def test_rows_have_csv_columns(self):
+        rows = list(generate_cmdb_rows(200))
+        self.assertEqual(len(rows), 200)
+        for row in rows:
+            self.assertEqual(list(row), list(CSV_COLUMNS))
+
+    def test_deterministic_per_seed(self):
+        self.assertEqual(list(generate_cmdb_rows(50, seed=7)), list(generate_cmdb_rows(50, seed=7)))
+        self.assertNotEqual(list(generate_cmdb_rows(50, seed=7)), list(generate_cmdb_rows(50, seed=8)))
+
+    def test_serialnumbers_are_unique(self):
+        serials = [row["SERIALNUMBER"] for row in generate_cmdb_rows(1000)]
+        self.assertEqual(len(set(serials)), len(serials))
+
+
+# ---------------------------------------------------------------------------
+# Tests gegen die device_db
+# ---------------------------------------------------------------------------
+
+# Die fachlichen Tabellen werden außerhalb dieses Repos gepflegt; für die
+# Tests reicht eine Minimalform mit den Spalten, die db_sql benutzt, und
+# benannten FKs (wie in der Live-DB).
+TEST_SHADOW_SCHEMA = "test_device_overview_shadow"
+
+LOOKUP_ID_COLUMNS = {
+    "regions": "region_id",
+    "pl_names": "pl_name_id",
+    "owned_bys": "owner_id",
+    "used_bys": "user_id",
+    "supported_bys": "supporter_id",
+    "suppliers": "supplier_id",
+    "departments": "department_id",
+    "cost_centers": "cc_id",
+    "manufacturers": "manu_id",
+    "tbltier1": "tier1_id",
+    "tbltier2": "tier2_id",
+    "tbltier3": "tier3_id",
+    "relations": "relation_id",
+    "types": "type_id",
+    "depots": "depot_id",
+    "tblpl_status": "pl_status_id",
+    "tblci_status": "ci_status_id",
+    "partnumbers": "partnumber_id",
+}
+
+
+def _test_domain_schema():
+    """CREATE TABLE-Anweisungen für die fachlichen Tabellen + Staging."""
+    statements = [
+        f"""
+        CREATE TABLE {table} (
+            {LOOKUP_ID_COLUMNS[table]} INT AUTO_INCREMENT PRIMARY KEY,
+            {column} VARCHAR(255) NULL
+        ) ENGINE=InnoDB;
+        """
+        for table, column, _ in SIMPLE_LOOKUPS
+    ]
+    statements += [
+        """
+        CREATE TABLE sites (
+            site_id INT AUTO_INCREMENT PRIMARY KEY,
+            company VARCHAR(255) NULL,
+            sitegroup VARCHAR(255) NULL,
+            site VARCHAR(64) NULL,
+            region_id INT NULL,
+            CONSTRAINT fk_sites_region FOREIGN KEY (region_id) REFERENCES regions (region_id)
+        ) ENGINE=InnoDB;
+        """,
+        """
+        CREATE TABLE rooms (
+            room_id INT AUTO_INCREMENT PRIMARY KEY,
+            room VARCHAR(255) NULL,
+            physicalposition VARCHAR(255) NULL,
+            ci_room VARCHAR(255) NULL,
+            floor VARCHAR(255) NULL,
+            site_id INT NULL,
+            CONSTRAINT fk_rooms_site FOREIGN KEY (site_id) REFERENCES sites (site_id)
+        ) ENGINE=InnoDB;
+        """,
+        """
+        CREATE TABLE models (
+            model_id INT AUTO_INCREMENT PRIMARY KEY,
+            manu_id INT NULL,
+            tier1_id INT NULL,
+            tier2_id INT NULL,
+            tier3_id INT NULL,
+            model VARCHAR(255) NULL,
+            partnumber_id INT NULL,
+            CONSTRAINT fk_models_manu FOREIGN KEY (manu_id) REFERENCES manufacturers (manu_id),
+            CONSTRAINT fk_models_partnumber FOREIGN KEY (partnumber_id)
+                REFERENCES partnumbers (partnumber_id)
+        ) ENGINE=InnoDB;
+        """,
+    ]
+    device_columns = ",\n".join(
+        f"{column} INT NULL" if column.endswith("_id")
+        else f"{column} TEXT NULL" if column == "additional_information"
+        else f"{column} VARCHAR(255) NULL"
+        for column in DEVICE_COLUMNS
+        if column not in ("device_key", "row_hash")
+    )
+    statements.append(f"""
+        CREATE TABLE devices (
+            device_id INT AUTO_INCREMENT PRIMARY KEY,
+            {device_columns},
+            CONSTRAINT fk_devices_model FOREIGN KEY (model_id) REFERENCES models (model_id),
+            CONSTRAINT fk_devices_room FOREIGN KEY (room_id) REFERENCES rooms (room_id),
+            CONSTRAINT fk_devices_ci_status FOREIGN KEY (ci_status_id)
+                REFERENCES tblci_status (ci_status_id)
+        ) ENGINE=InnoDB;
+    """)
+    staging_columns = ",\n".join(
+        f"{column} TEXT NOT NULL" if column == "ADDITIONAL_INFORMATION"
+        else f"{column} VARCHAR(255) NOT NULL DEFAULT ''"
+        for column in CSV_COLUMNS
+    )
+    statements.append(f"CREATE TABLE staging_devices ({staging_columns}) ENGINE=InnoDB;")
+    return statements
+
+
+def cmdb_csv(rows, seed=42, edit=None):
+    """Synthetische CMDB-CSV als Upload-artiges Binär-File; ``edit(row)`` ändert Zeilen."""
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=CSV_COLUMNS, delimiter=";")
+    writer.writeheader()
+    for row in generate_cmdb_rows(rows, seed):
+        if edit is not None:
+            row = edit(row)
+        if row is not None:
+            writer.writerow(row)
+    return io.BytesIO(text.getvalue().encode("utf-8"))
+
+
+class DeviceDbTestCase(TransactionTestCase):
+    """
+    Tests gegen die Test-Datenbank der device_db: fachliche Tabellen frisch
+    anlegen und die device_db-Migrationen anwenden. DDL schreibt in MariaDB
+    implizit fest, deshalb TransactionTestCase statt TestCase.
+    """
+
+    databases = {"device_db"}
+
+    def setUp(self):
+        tables = list(db_sql.DOMAIN_TABLES) + ["staging_devices", "schema_migrations"]
+        with connections["device_db"].cursor() as cur:
+            cur.execute("SET FOREIGN_KEY_CHECKS = 0;")
+            try:
+                for table in tables:
+                    cur.execute(f"DROP TABLE IF EXISTS {table};")
+                for ddl in _test_domain_schema():
+                    cur.execute(ddl)
+            finally:
+                cur.execute("SET FOREIGN_KEY_CHECKS = 1;")
+        db_schema.migrate()
+
+    def query(self, sql, params=()):
+        with connections["device_db"].cursor() as cur:
+            cur.execute(sql, list(params))
+            return cur.fetchall()
+
+    def scalar(self, sql, params=()):
+        return self.query(sql, params)[0][0]
+
+    def import_full(self, csv_file):
+        db_sql.clear_all_tables()
+        db_sql.import_csv_to_staging(csv_file)
+        db_sql.populate_normalized_from_staging()
+
+    def flat_rows(self):
+        """device_flat ohne technische IDs, sortiert (zum Vergleich zweier Importwege)."""
+        db_sql.recreate_device_flat_view()
+        columns = ", ".join(DEVICE_FLAT_COLUMNS)
+        return self.query(f"SELECT {columns} FROM device_flat ORDER BY {columns};")
+
+
+class ShadowDdlTests(SimpleTestCase):
+
+    DDL = (
+        "CREATE TABLE `devices` (\n"
+        "  `model_id` int(11) DEFAULT NULL,\n"
+        "  CONSTRAINT `fk_devices_model` FOREIGN KEY (`model_id`) "
+        "REFERENCES `models` (`model_id`)\n"
+        ") ENGINE=InnoDB"
+    )
+
+    def test_qualifies_tables_and_toggles_fk_names(self):
+        ddl = _shadow_table_ddl(self.DDL, "devices", "shadow")
+        self.assertIn("CREATE TABLE `shadow`.`devices`", ddl)
+        self.assertIn("CONSTRAINT `fk_devices_model__s`", ddl)
+        self.assertIn("REFERENCES `shadow`.`models`", ddl)
+
+        again = _shadow_table_ddl(ddl.replace("`shadow`.", ""), "devices", "shadow")
+        self.assertIn("CONSTRAINT `fk_devices_model` FOREIGN KEY", again)
+
+
+class ShadowImportTests(DeviceDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(db_sql, "SHADOW_SCHEMA", TEST_SHADOW_SCHEMA)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.query, f"DROP DATABASE IF EXISTS `{TEST_SHADOW_SCHEMA}`;")
+
+    def shadow_import(self, csv_file):
+        with db_sql.shadow_build():
+            db_sql.import_csv_to_staging(csv_file)
+            db_sql.populate_normalized_from_staging()
+
+    def live_fk_names(self):
+        return {
+            row[0] for row in self.query(
+                """
+                SELECT CONSTRAINT_NAME
+                FROM information_schema.REFERENTIAL_CONSTRAINTS
+                WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = 'devices';
+                """
+            )
+        }
+
+    def test_swap_twice_in_a_row(self):
+        for seed, expected_fks in ((1, "fk_devices_model__s"), (2, "fk_devices_model")):
+            self.shadow_import(cmdb_csv(30, seed=seed))
+
+            self.assertEqual(self.scalar("SELECT COUNT(*) FROM devices;"), 30)
+            serial = next(generate_cmdb_rows(1, seed))["SERIALNUMBER"]
+            self.assertEqual(
+                self.scalar("SELECT COUNT(*) FROM devices WHERE serialnumber = %s;", [serial]), 1
+            )
+            self.assertIn(expected_fks, self.live_fk_names())
+            # FKs der Live-Tabellen zeigen auf Live-Tabellen
+            self.assertEqual(
+                self.scalar(
+                    """
+                    SELECT COUNT(*)
+                    FROM information_schema.REFERENTIAL_CONSTRAINTS
+                    WHERE CONSTRAINT_SCHEMA = DATABASE()
+                      AND UNIQUE_CONSTRAINT_SCHEMA <> DATABASE();
+                    """
+                ),
+                0,
+            )
+            self.assertEqual(self.scalar("SELECT DATABASE();"), connections["device_db"].settings_dict["NAME"])
+
+    def test_failed_build_keeps_live_data(self):
+        self.shadow_import(cmdb_csv(20, seed=1))
+
+        with self.assertRaises(RuntimeError):
+            with db_sql.shadow_build():
+                db_sql.import_csv_to_staging(cmdb_csv(5, seed=2))
+                raise RuntimeError("Import abgebrochen")
+
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM devices;"), 20)
+        self.assertEqual(self.scalar("SELECT DATABASE();"), connections["device_db"].settings_dict["NAME"])
+
+
+class SearchTests(DeviceDbTestCase):
+
+    SERIAL = "QZ7Q12345"
+
+    def setUp(self):
+        super().setUp()
+        first = iter([True])
+
+        def edit(row):
+            if next(first, False):
+                row = dict(row, SERIALNUMBER=self.SERIAL, SHORTDESCRIPTION="Notebook G4 Spezial")
+            return row
+
+        self.import_full(cmdb_csv(30, edit=edit))
+        db_sql.recreate_device_flat_view()
+        search.rebuild_search_index()
+
+    def serials(self, term):
+        condition, params = search.search_condition(term)
+        return {row[0] for row in self.query(f"SELECT SERIALNUMBER FROM device_flat WHERE {condition};", params)}
+
+    def test_index_path(self):
+        self.assertTrue(search.search_index_available())
+        # Seriennummer als Teilstring, auch unter FULLTEXT_MIN_TOKEN Zeichen
+        for fragment in ("7Q", "Q1234", self.SERIAL):
+            self.assertIn(self.SERIAL, self.serials(fragment))
+        # Textspalten als Wortanfang, kurze Wörter als Teilstring
+        self.assertIn(self.SERIAL, self.serials("Noteb"))
+        self.assertIn(self.SERIAL, self.serials("G4"))
+        self.assertNotIn(self.SERIAL, self.serials("book"))
+
+    def test_like_path_without_index(self):
+        with mock.patch.object(search, "search_index_available", return_value=False):
+            self.assertIn(self.SERIAL, self.serials("book"))
+            self.assertIn(self.SERIAL, self.serials("7Q"))
+
+
+class SiteGroupTests(DeviceDbTestCase):
+
+    def test_migrate_syncs_site_groups(self):
+        db_schema.migrate()  # zweiter Lauf: gleicher Stand, keine Dubletten
+        self.assertEqual(
+            self.scalar("SELECT COUNT(*) FROM site_groups WHERE group_name = %s;", [DACH]),
+            len(SITE_GROUPS[DACH]),
+        )
+
+        self.import_full(cmdb_csv(30))
+        db_sql.recreate_device_flat_view()
+        condition, params = site_group_condition(DACH)
+        self.assertEqual(
+            self.scalar(f"SELECT COUNT(*) FROM device_flat WHERE {condition};", params),
+            self.scalar(
+                "SELECT COUNT(*) FROM device_flat WHERE SITE IN %s;", [tuple(SITE_GROUPS[DACH])]
+            ),
+        )
+
+
+class _FakeDbConnection:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class PoolResetTests(SimpleTestCase):
+
+    def test_checkin_resets_session(self):
+        reset = mock.Mock()
+        pool = ConnectionPool(_FakeDbConnection, reset=reset)
+        conn = pool.checkout()
+        pool.checkin(conn)
+
+        reset.assert_called_once_with(conn)
+        self.assertIs(pool.checkout(), conn)
+
+    def test_failed_reset_discards_connection(self):
+        pool = ConnectionPool(_FakeDbConnection, reset=mock.Mock(side_effect=OSError))
+        conn = pool.checkout()
+        pool.checkin(conn)
+
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()["size"], 0)
+        self.assertEqual(pool.stats()["reset_failures"], 1)
+        self.assertIsNot(pool.checkout(), conn)
+
+
+class PooledSessionTests(TransactionTestCase):
+
+    databases = {"device_db"}
+
+    def test_session_state_does_not_leak(self):
+        conn = connections["device_db"]
+        if not hasattr(conn, "pool_stats"):
+            self.skipTest("device_db nutzt nicht das Pool-Backend")
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT GET_LOCK('test_device_overview_leak', 0);")
+            cur.execute("USE information_schema;")
+        conn.close()
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT DATABASE(), IS_USED_LOCK('test_device_overview_leak');")
+            self.assertEqual(cur.fetchone(), (conn.settings_dict["NAME"], None))
+
+
+class IndexColumnSqlTests(SimpleTestCase):
+
+    def test_prefix_for_text_and_long_varchar(self):
+        self.assertEqual(_index_column_sql("varchar", 255, "SITE"), "`SITE`")
+        self.assertEqual(_index_column_sql("TEXT", None, "SITE"), "`SITE`(191)")
+        self.assertEqual(_index_column_sql("bigint", None, "DEVICE_ID", 191), "`DEVICE_ID`")
+        # zusammengesetzte Indizes: schon ab 192 Zeichen
+        self.assertEqual(_index_column_sql("varchar", 255, "PL_NAME", 191), "`PL_NAME`(191)")
+
+
+class MaterializedDeviceFlatTests(DeviceDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(db_sql, "DEVICE_FLAT_MATERIALIZED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(db_sql.recreate_device_flat_view)
+
+    def test_refresh_with_long_columns(self):
+        # lange Texte im Sortierindex (PL_NAME als TEXT) dürfen den Aufbau nicht brechen
+        self.query("DROP INDEX ix_pl_names_pl_name ON pl_names;")
+        self.query("ALTER TABLE pl_names MODIFY pl_name TEXT NULL, ADD INDEX ix_pl_names_pl_name (pl_name(191));")
+        self.import_full(cmdb_csv(20))
+        db_sql.recreate_device_flat_view()
+
+        self.assertEqual(
+            self.query("SELECT TABLE_TYPE FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'device_flat';"),
+            (("BASE TABLE",),),
+        )
+        self.assertEqual(
+            self.scalar("SELECT COUNT(*) FROM device_flat;"),
+            self.scalar("SELECT COUNT(*) FROM device_flat_source;"),
+        )
+        self.assertEqual(
+            self.scalar(
+                """
+                SELECT COUNT(*)
+                FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'device_flat'
+                  AND INDEX_NAME = 'ix_device_flat_order';
+                """
+            ),
+            4,
+        )
+
+
+def _delta_edit(row):
+    """Zweiter Stand: Gerät 0 fehlt, Gerät 1 geändert."""
+    if row["CI_NAME"] == "CI000000000":
+        return None
+    if row["CI_NAME"] == "CI000000001":
+        row["SHORTDESCRIPTION"] = "geändert"
+    return row
+
+
+class DeltaImportTests(DeviceDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.import_full(cmdb_csv(30, seed=1))
+
+    def delta(self, csv_file):
+        db_sql.import_csv_to_staging(csv_file)
+        return db_sql.apply_delta_from_staging()
+
+    def active_devices(self):
+        return self.scalar("SELECT COUNT(*) FROM devices WHERE deleted_at IS NULL;")
+
+    def test_upsert_and_soft_delete_match_full_import(self):
+        # 31 Zeilen = dieselben 30 + ein neues Gerät
+        result = self.delta(cmdb_csv(31, seed=1, edit=_delta_edit))
+
+        self.assertEqual(result, {"inserted": 1, "updated": 1, "deleted": 1})
+        self.assertEqual(self.active_devices(), 30)
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM devices;"), 31)
+        delta_rows = self.flat_rows()
+
+        self.import_full(cmdb_csv(31, seed=1, edit=_delta_edit))
+        self.assertEqual(delta_rows, self.flat_rows())
+
+    def test_deleted_device_comes_back(self):
+        self.delta(cmdb_csv(31, seed=1, edit=_delta_edit))
+        result = self.delta(cmdb_csv(30, seed=1))
+
+        # Gerät 0 wieder da, Gerät 1 zurückgeändert, Gerät 30 fehlt
+        self.assertEqual(result, {"inserted": 0, "updated": 2, "deleted": 1})
+        self.assertEqual(self.active_devices(), 30)
+        delta_rows = self.flat_rows()
+
+        self.import_full(cmdb_csv(30, seed=1))
+        self.assertEqual(delta_rows, self.flat_rows())
+
+    def test_duplicate_keys_fall_back_to_full_import(self):
+        def duplicate_ci(row):
+            if row["CI_NAME"] in ("CI000000000", "CI000000001"):
+                row["CI_ID"] = "OI-DUP"
+            return row
+
+        self.assertIsNone(self.delta(cmdb_csv(30, seed=2, edit=duplicate_ci)))
+        # nichts geändert
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM devices WHERE serialnumber LIKE %s;", ["__02%"]), 0)
+
+        with mock.patch.object(db_sql, "IMPORT_MODE", "delta"):
+            rows = import_jobs.run_import(cmdb_csv(30, seed=2, edit=duplicate_ci))
+        self.assertEqual(rows, 30)
+        self.assertEqual(self.active_devices(), 30)
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM devices WHERE device_key = 'CI:OI-DUP';"), 2)
+        full_rows = self.flat_rows()
+
+        self.import_full(cmdb_csv(30, seed=2, edit=duplicate_ci))
+        self.assertEqual(full_rows, self.flat_rows())
+
+
+# FK-Auflösung vor user-004: eine korrelierte Subquery pro FK und Zeile
+# (Referenz für den Join-Weg in DEVICE_FK_JOINS_SQL)
+SUBQUERY_FKS = {
+    "pl_name_id": "SELECT pn.pl_name_id FROM pl_names pn WHERE pn.pl_name = t.PL_NAME LIMIT 1",
+    "owner_id": "SELECT ob.owner_id FROM owned_bys ob WHERE ob.owned_by = t.OWNED_BY LIMIT 1",
+    "supporter_id": (
+        "SELECT sb.supporter_id FROM supported_bys sb WHERE sb.supported_by = t.SUPPORTED_BY LIMIT 1"
+    ),
+    "user_id": "SELECT ub.user_id FROM used_bys ub WHERE ub.used_by = t.USED_BY LIMIT 1",
+    "model_id": """
+        SELECT m.model_id
+        FROM models m
+        LEFT JOIN manufacturers man ON man.manu_id  = m.manu_id
+        LEFT JOIN tbltier1       t1  ON t1.tier1_id = m.tier1_id
+        LEFT JOIN tbltier2       t2  ON t2.tier2_id = m.tier2_id
+        LEFT JOIN tbltier3       t3  ON t3.tier3_id = m.tier3_id
+        WHERE m.model = t.MODEL
+          AND (t.MANUFACTURERNAME IS NULL OR man.manufacturername = t.MANUFACTURERNAME)
+          AND (t.TIER1 IS NULL OR t1.tier1 = t.TIER1)
+          AND (t.TIER2 IS NULL OR t2.tier2 = t.TIER2)
+          AND (t.TIER3 IS NULL OR t3.tier3 = t.TIER3)
+        LIMIT 1
+    """,
+    "costcenter_id": (
+        "SELECT cc.cc_id FROM cost_centers cc WHERE cc.pl_cost_center = t.PL_COST_CENTER LIMIT 1"
+    ),
+    "supplier_id": (
+        "SELECT sup.supplier_id FROM suppliers sup WHERE sup.suppliername = t.SUPPLIERNAME LIMIT 1"
+    ),
+    "room_id": """
+        SELECT r.room_id
+        FROM rooms r
+        JOIN sites s ON s.site_id = r.site_id
+        WHERE s.site = t.SITE
+          AND IFNULL(r.room, '')    = IFNULL(t.ROOM, '')
+          AND IFNULL(r.ci_room, '') = IFNULL(t.CI_ROOM, '')
+        LIMIT 1
+    """,
+    "relation_id": "SELECT rel.relation_id FROM relations rel WHERE rel.relation = t.RELATION LIMIT 1",
+    "department_id": (
+        "SELECT dept.department_id FROM departments dept WHERE dept.department = t.DEPARTMENT LIMIT 1"
+    ),
+    "type_id": "SELECT ty.type_id FROM types ty WHERE ty.type = t.TYPE LIMIT 1",
+    "depot_id": "SELECT dp.depot_id FROM depots dp WHERE dp.depot = t.DEPOT LIMIT 1",
+    "pl_status_id": (
+        "SELECT pls.pl_status_id FROM tblpl_status pls WHERE pls.pl_status = t.PL_STATUS LIMIT 1"
+    ),
+    "ci_status_id": (
+        "SELECT cis.ci_status_id FROM tblci_status cis WHERE cis.ci_status = t.CI_STATUS LIMIT 1"
+    ),
+}
+
+
+class FkResolutionTests(DeviceDbTestCase):
+
+    def test_joins_match_correlated_subqueries(self):
+        def edge_cases(row):
+            # leere Werte: ohne Raum, ohne Lieferant
+            if row["CI_NAME"] == "CI000000002":
+                row.update(ROOM="", CI_ROOM="", SUPPLIERNAME="")
+            return row
+
+        self.import_full(cmdb_csv(60, edit=edge_cases))
+
+        fk_columns = list(SUBQUERY_FKS)
+        by_subquery = self.query(
+            "SELECT {key} AS device_key, {fks} FROM staging_devices t ORDER BY device_key;".format(
+                key=db_sql.DEVICE_KEY_SQL,
+                fks=", ".join(f"({sql}) AS {column}" for column, sql in SUBQUERY_FKS.items()),
+            )
+        )
+        by_join = self.query(
+            f"SELECT device_key, {', '.join(fk_columns)} FROM devices ORDER BY device_key;"
+        )
+
+        self.assertEqual(len(by_join), 60)
+        self.assertEqual(by_join, by_subquery)
+        # kein trivialer Vergleich: Modelle werden tatsächlich aufgelöst
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM devices WHERE model_id IS NULL;"), 0)
+
+
+class LookupTests(DeviceDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rows = list(generate_cmdb_rows(80, 3))
+        self.import_full(cmdb_csv(80, seed=3))
+
+    def distinct(self, *columns):
+        return {
+            tuple(row[column] for column in columns)
+            for row in self.rows
+            if row[columns[0]]
+        }
+
+    def assert_lookups_match_csv(self):
+        for table, column, source in SIMPLE_LOOKUPS:
+            with self.subTest(table=table):
+                values = self.query(f"SELECT {column} FROM {table};")
+                self.assertEqual(len(values), len(set(values)))
+                self.assertEqual(set(values), self.distinct(source))
+
+        self.assertEqual(
+            set(self.query(
+                """
+                SELECT s.site, s.company, s.sitegroup, r.region
+                FROM sites s JOIN regions r ON r.region_id = s.region_id;
+                """
+            )),
+            self.distinct("SITE", "COMPANY", "SITEGROUP", "REGION"),
+        )
+        self.assertEqual(
+            set(self.query(
+                """
+                SELECT s.site, r.room, r.physicalposition, r.ci_room, r.floor
+                FROM rooms r JOIN sites s ON s.site_id = r.site_id;
+                """
+            )),
+            self.distinct("SITE", "ROOM", "PHYSICALPOSITION", "CI_ROOM", "FLOOR"),
+        )
+        models = self.query(
+            """
+            SELECT m.model, man.manufacturername, t1.tier1, t2.tier2, t3.tier3, p.partnumber
+            FROM models m
+            JOIN manufacturers man ON man.manu_id = m.manu_id
+            JOIN tbltier1 t1 ON t1.tier1_id = m.tier1_id
+            JOIN tbltier2 t2 ON t2.tier2_id = m.tier2_id
+            JOIN tbltier3 t3 ON t3.tier3_id = m.tier3_id
+            JOIN partnumbers p ON p.partnumber_id = m.partnumber_id;
+            """
+        )
+        self.assertEqual(len(models), self.scalar("SELECT COUNT(*) FROM models;"))
+        self.assertEqual(
+            set(models),
+            self.distinct("MODEL", "MANUFACTURERNAME", "TIER1", "TIER2", "TIER3", "PARTNUMBER"),
+        )
+
+    def test_full_import(self):
+        self.assert_lookups_match_csv()
+
+    def test_delta_import_keeps_ids(self):
+        ids = self.query("SELECT pl_name_id, pl_name FROM pl_names ORDER BY pl_name_id;")
+
+        db_sql.import_csv_to_staging(cmdb_csv(80, seed=3))
+        db_sql.apply_delta_from_staging()
+
+        self.assert_lookups_match_csv()
+        self.assertEqual(self.query("SELECT pl_name_id, pl_name FROM pl_names ORDER BY pl_name_id;"), ids)
+
+
+class RollupTests(DeviceDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.import_full(cmdb_csv(120, seed=4))
+        db_sql.recreate_device_flat_view()
+        rollup.rebuild_device_rollup()
+
+    def counts(self, conditions, params, uses_search):
+        return self.query(_counts_by_site_query(conditions, uses_search), params)
+
+    def test_counts_match_device_flat(self):
+        self.assertEqual(rollup.count_source()[0], rollup.ROLLUP_TABLE)
+        self.assertTrue(self.counts([], [], uses_search=False))
+        ci_status, tier3 = self.query("SELECT CI_STATUS, TIER3 FROM device_flat LIMIT 1;")[0]
+
+        for filters in (
+            {},
+            {"dach_only": True},
+            {"ci_status": ci_status},
+            {"tier3": tier3},
+            {"dach_only": True, "ci_status": ci_status, "tier3": tier3},
+        ):
+            with self.subTest(filters=filters):
+                conditions, params = _compile_filters(filters)
+                from_rollup = self.counts(conditions, params, uses_search=False)
+                # uses_search=True zählt direkt in device_flat
+                self.assertEqual(from_rollup, self.counts(conditions, params, uses_search=True))
+
+        self.assertEqual(
+            self.scalar(f"SELECT SUM(device_count) FROM {rollup.ROLLUP_TABLE};"),
+            self.scalar("SELECT COUNT(*) FROM device_flat;"),
+        )
+
+    def test_report_counts_match_device_flat(self):
+        sql, params = build_dach_deployed_t3_counts_query()
+        self.assertIn(rollup.ROLLUP_TABLE, sql)
+        self.assertEqual(
+            self.query(sql, params),
+            self.query(sql.replace(rollup.ROLLUP_TABLE, "device_flat")
+                          .replace("CAST(SUM(device_count) AS SIGNED)", "COUNT(*)"), params),
+        )
+
+
+class VerifyIndexesTests(DeviceDbTestCase):
+
+    def test_reports_missing_index_on_small_tables(self):
+        # leere Tabellen: kein falscher Alarm
+        self.assertEqual(db_schema.verify_indexes(), [])
+
+        self.query("DROP INDEX ix_pl_names_pl_name ON pl_names;")
+        self.assertEqual(db_schema.verify_indexes(), ["pl_names.pl_name"])
+
+
+class SqlStatsTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_sql_stats()
+        self.addCleanup(reset_sql_stats)
+
+    def test_record_statement_and_reset(self):
+        record_statement("SELECT * FROM device_flat WHERE SITE = 'BER'", 12.0, 3)
+        record_statement("SELECT * FROM device_flat WHERE SITE = 'MUC'", 8.0, 2)
+
+        (stats,) = sql_stats()["statements"]
+        self.assertEqual(stats["sql"], "SELECT * FROM device_flat WHERE SITE = ?")
+        self.assertEqual((stats["count"], stats["total_ms"], stats["rows"]), (2, 20.0, 5))
+
+        reset_sql_stats()
+        self.assertEqual(sql_stats()["statements"], [])
+
+
+class StreamedSqlStatsTests(TransactionTestCase):
+
+    databases = {"device_db"}
+
+    def setUp(self):
+        reset_sql_stats()
+        self.addCleanup(reset_sql_stats)
+
+    def test_stream_rows_is_recorded(self):
+        rows = list(stream_rows("SELECT 1 AS n UNION ALL SELECT 2 UNION ALL SELECT 3"))
+
+        self.assertEqual(rows[0], ["n"])
+        (stats,) = sql_stats()["statements"]
+        self.assertEqual((stats["count"], stats["rows"]), (1, 3))
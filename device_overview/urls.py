@@ -2,11 +2,32 @@
 
 from django.urls import path
 
-from .views import UploadCsvView, DataBaseView, AnalysisView, PredefinedReportsView
+from .views import (
+    UploadCsvView,
+    ImportJobStatusView,
+    DataBaseView,
+    AnalysisView,
+    AnalysisRowsView,
+    AnalysisCountsView,
+    PredefinedReportsView,
+    ReportCacheStatsView,
+    SqlStatsView,
+    DeviceApiView,
+    ExportView,
+    TableView,
+)
 
 urlpatterns = [
     path("upload-csv/", UploadCsvView.as_view(), name="upload_csv"),
+    path("import-jobs/<int:job_id>/", ImportJobStatusView.as_view(), name="import_job_status"),
     path("database/", DataBaseView.as_view(), name="dataBase"),
     path("analysis/", AnalysisView.as_view(), name="analysis"),
+    path("analysis/rows/", AnalysisRowsView.as_view(), name="analysis_rows"),
+    path("analysis/counts/", AnalysisCountsView.as_view(), name="analysis_counts"),
     path("reports/", PredefinedReportsView.as_view(), name="predefined_reports"),
+    path("reports/cache-stats/", ReportCacheStatsView.as_view(), name="report_cache_stats"),
+    path("stats/sql/", SqlStatsView.as_view(), name="sql_stats"),
+    path("api/devices/", DeviceApiView.as_view(), name="api_devices"),
+    path("export/<slug:dataset>.csv", ExportView.as_view(), name="export"),
+    path("table/<slug:dataset>/", TableView.as_view(), name="table"),
 ]
@@ -1,27 +1,112 @@
 # device_overview/views.py
 
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, QueryDict
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.safestring import mark_safe
 from django.views import View
 from django.views.generic import TemplateView
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db import connections
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 
 from .forms import CsvUploadForm
-from . import db_sql
 from . import db_sql_reports
+from . import import_jobs
+from .report_cache import report_cache
+from .concurrent_db import gather_queries
+from .db_pool import pool_stats
+from .sql_instrumentation import reset_sql_stats, sql_stats
 
 
 import json
 
 from .db_sql_analysis import (
-    fetch_device_rows,
+    build_device_rows_query,
+    fetch_counts_and_total,
+    fetch_device_chunk,
+    fetch_device_columns_page,
+    fetch_device_page,
     fetch_filter_options,
-    fetch_counts_by_site,  # für Counts
+)
+from .streaming import (
+    HTML_TABLE_MARKER,
+    gzip_chunks,
+    iter_csv,
+    iter_html_page,
+    stream_rows,
+    streaming_response,
+)
+from .db_sql import DEVICE_FLAT_COLUMNS
+from .pagination import (
+    PAGE_SIZES,
+    InvalidCursor,
+    decode_cursor,
+    page_links,
+    page_size_from,
 )
 
 
 DEVICE_ALIAS = "device_db"
 
+# GET-Parameter des Analyse-Filterformulars
+FILTER_KEYS = ("dach_only", "ci_status", "tier3", "search")
+
+# Zeilen pro Block der virtuell scrollenden Analyse-Tabelle
+ANALYSIS_CHUNK_SIZE = 200
+
+
+def _search_term(query):
+    """Suchbegriff getrimmt; leer bzw. nur Leerzeichen -> None (keine Suche)."""
+    return (query.get("search") or "").strip() or None
+
+
+def _filters_from_query(query):
+    """
+    Analyse-Filter aus den GET-Parametern.
+    DACH-Default nur beim ersten Aufruf (Blättern zählt nicht als Filter).
+    """
+    if any(key in query for key in FILTER_KEYS):
+        dach_only = query.get("dach_only") in ("1", "on")
+    else:
+        dach_only = True
+
+    return {
+        "dach_only": dach_only,
+        "ci_status": query.get("ci_status") or None,
+        "tier3": query.get("tier3") or None,
+        "search": _search_term(query),
+    }
+
+
+def _filters_query_string(filters):
+    """
+    Filter als Query-String für die JSON-Endpunkte der Analyse; dach_only
+    immer explizit, damit dort kein Default greift.
+    """
+    query = QueryDict(mutable=True)
+    query["dach_only"] = "1" if filters["dach_only"] else "0"
+    for key in ("ci_status", "tier3", "search"):
+        if filters[key]:
+            query[key] = filters[key]
+    return query.urlencode()
+
+
+def _page_context(request, page):
+    """
+    Template-Kontext für pagination.html: Position, Gesamtanzahl, Links.
+    """
+    links = page_links(request, page["next_cursor"])
+    page_size = page_size_from(request.GET)
+    start = (links["page"] - 1) * page_size + 1 if page["rows"] else 0
+    return {
+        **links,
+        "total": page["total"],
+        "start": start,
+        "end": start + len(page["rows"]) - 1 if page["rows"] else 0,
+        "page_size": page_size,
+        "page_sizes": PAGE_SIZES,
+    }
+
 
 class IndexView(TemplateView):
     template_name = "index.html"
@@ -46,16 +131,22 @@ class UploadCsvView(View):
 
         csv_file = form.cleaned_data["csv_file"]
 
-        # 1. Tabellen leeren
-        db_sql.clear_all_tables()
-        # 2. CSV -> Staging
-        db_sql.import_csv_to_staging(csv_file)
-        # 3. Staging -> normalisierte DB
-        db_sql.populate_normalized_from_staging()
-        # 4. device_flat-View sicherstellen (optional)
-        db_sql.recreate_device_flat_view()
+        # Import läuft im Hintergrund; Fortschritt über ImportJobStatusView
+        job_id = import_jobs.submit_import(csv_file)
+
+        return redirect(f"{reverse('dataBase')}?import_job={job_id}")
 
-        return redirect("dataBase")
+
+class ImportJobStatusView(View):
+    """
+    Fortschritt eines Import-Jobs als JSON (Phase, Zeilen, Laufzeit).
+    """
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = import_jobs.get_job(job_id)
+        if job is None:
+            raise Http404("Import-Job nicht gefunden")
+        return JsonResponse(job)
 
 
 class DataBaseView(TemplateView):
@@ -65,64 +156,115 @@ class DataBaseView(TemplateView):
     template_name = "dataBase.html"
 
     def post(self, request, *args, **kwargs):
-        db_sql.clear_all_tables()
+        try:
+            import_jobs.clear_database()
+        except import_jobs.ImportLockError as exc:
+            return HttpResponse(f"Clear Database nicht möglich: {exc}", status=409)
         return redirect("dataBase")
 
+    def get(self, request, *args, **kwargs):
+        try:
+            return super().get(request, *args, **kwargs)
+        except InvalidCursor:
+            return HttpResponseBadRequest("Ungültiger Cursor")
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
+        query = self.request.GET
 
-        conn = connections[DEVICE_ALIAS]
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM device_flat;")
-            rows = cur.fetchall()
-            columns = [col[0] for col in cur.description]
+        # seitenweise statt SELECT * über den ganzen Bestand
+        page = fetch_device_page(
+            {},
+            after=decode_cursor(query.get("after")),
+            page_size=page_size_from(query),
+        )
 
-        ctx["columns"] = columns
-        ctx["rows"] = rows
+        ctx["columns"] = page["columns"]
+        ctx["rows"] = page["rows"]
+        ctx["page"] = _page_context(self.request, page)
+        ctx["import_job"] = query.get("import_job", "")
         return ctx
 
 
 class AnalysisView(TemplateView):
-    template_name = "analysis.html"
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-
-        query = self.request.GET
-
-        # DACH-Default nur beim ersten Aufruf
-        if query:
-            dach_only = query.get("dach_only") in ("1", "on")
-        else:
-            dach_only = True
+    """
+    Analyse-Seite (async): Dropdown-Werte, Counts und der erste Zeilenblock
+    werden parallel geladen (siehe concurrent_db.py) und in die Seite
+    eingebettet; weitere Blöcke lädt die Tabelle per JS nach
+    (AnalysisRowsView).
+    """
 
-        ci_status = query.get("ci_status") or None
-        tier3 = query.get("tier3") or None
-        search = query.get("search") or None
+    template_name = "analysis.html"
 
-        filters = {
-            "dach_only": dach_only,
-            "ci_status": ci_status,
-            "tier3": tier3,
-            "search": search,
-        }
+    async def get(self, request, *args, **kwargs):
+        filters = _filters_from_query(request.GET)
 
-        # Daten aus der View device_flat (via db_sql_analysis)
-        columns, rows = fetch_device_rows(filters)
-        filter_options = fetch_filter_options()
-        counts_by_site = fetch_counts_by_site(filters)
+        filter_options, counts, chunk = await gather_queries(
+            (fetch_filter_options,),
+            (fetch_counts_and_total, filters),
+            (fetch_device_chunk, filters, None, None, ANALYSIS_CHUNK_SIZE),
+        )
 
+        context = self.get_context_data(**kwargs)
         context.update(
             {
                 "nav_active": "analysis",
                 "filters": filters,
-                "columns": columns,
-                "rows": rows,
+                "filters_query": _filters_query_string(filters),
+                "columns": DEVICE_FLAT_COLUMNS,
                 "filter_options": filter_options,
-                "counts_by_site": counts_by_site,
+                "chunk_size": ANALYSIS_CHUNK_SIZE,
+                "initial_data": {
+                    "total": counts["total"],
+                    "counts_by_site": counts["counts_by_site"],
+                    "rows": [list(row) for row in chunk["rows"]],
+                    "next_cursor": chunk["next_cursor"],
+                },
             }
         )
-        return context
+        return self.render_to_response(context)
+
+
+class AnalysisRowsView(View):
+    """
+    Zeilenblöcke für die virtuell scrollende Analyse-Tabelle (JSON).
+
+    Parameter: Analyse-Filter, after (Cursor) oder start (Position), limit.
+    """
+
+    MAX_LIMIT = 1000
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET
+        try:
+            limit = min(max(int(query.get("limit", ANALYSIS_CHUNK_SIZE)), 1), self.MAX_LIMIT)
+            start = max(int(query.get("start", 0)), 0)
+        except ValueError:
+            return JsonResponse({"error": "limit/start müssen Zahlen sein"}, status=400)
+
+        try:
+            chunk = fetch_device_chunk(
+                _filters_from_query(query),
+                after=decode_cursor(query.get("after")),
+                start=start,
+                limit=limit,
+            )
+        except InvalidCursor:
+            return JsonResponse({"error": "Ungültiger Cursor"}, status=400)
+
+        return JsonResponse({
+            "rows": [list(row) for row in chunk["rows"]],
+            "next_cursor": chunk["next_cursor"],
+        })
+
+
+class AnalysisCountsView(View):
+    """
+    Anzahl pro Site + Gesamtanzahl zu den Analyse-Filtern (JSON).
+    """
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(fetch_counts_and_total(_filters_from_query(request.GET)))
 
 
 class PredefinedReportsView(TemplateView):
@@ -135,16 +277,43 @@ class PredefinedReportsView(TemplateView):
 
     template_name = "predefined_reports.html"
 
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
         report = request.GET.get("report")  # 'devices' oder 'counts'
 
         columns = []
         rows = []
+        page = None
 
+        # Ergebnisse ändern sich nur per Import -> Report-Cache; Seite und
+        # Gesamtanzahl laufen parallel in Worker-Threads (concurrent_db.py)
         if report == "devices":
-            columns, rows = db_sql_reports.fetch_dach_deployed_t3_devices()
+            after = decode_cursor(request.GET.get("after"))
+            page_size = page_size_from(request.GET)
+            try:
+                (rows, next_cursor), total = await gather_queries(
+                    (
+                        report_cache.get_or_compute,
+                        "dach_deployed_t3_devices",
+                        lambda: db_sql_reports.fetch_dach_deployed_t3_devices_rows(
+                            after=after, page_size=page_size,
+                        ),
+                        tuple(after or ()),
+                        page_size,
+                    ),
+                    (db_sql_reports.fetch_dach_deployed_t3_devices_total,),
+                )
+            except InvalidCursor:
+                return HttpResponseBadRequest("Ungültiger Cursor")
+            columns = DEVICE_FLAT_COLUMNS
+            page = _page_context(request, {
+                "rows": rows, "next_cursor": next_cursor, "total": total,
+            })
         elif report == "counts":
-            columns, rows = db_sql_reports.fetch_dach_deployed_t3_counts_by_site()
+            ((columns, rows),) = await gather_queries((
+                report_cache.get_or_compute,
+                "dach_deployed_t3_counts",
+                db_sql_reports.fetch_dach_deployed_t3_counts_by_site,
+            ))
 
         context = self.get_context_data(**kwargs)
         context.update({
@@ -152,5 +321,180 @@ class PredefinedReportsView(TemplateView):
             "report": report or "",
             "columns": columns,
             "rows": rows,
+            "page": page,
         })
         return self.render_to_response(context)
+
+
+class ReportCacheStatsView(UserPassesTestMixin, View):
+    """
+    Kennzahlen des Report-Caches als JSON (nur für Staff).
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(report_cache.stats())
+
+
+class SqlStatsView(UserPassesTestMixin, View):
+    """
+    device_db-Abfragen der letzten Requests + teuerste Statements als JSON,
+    dazu die Kennzahlen des Connection-Pools (nur für Staff, siehe
+    sql_instrumentation.py und db_pool.py). POST setzt die Statistik zurück.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({**sql_stats(), "pool": pool_stats("device_db")})
+
+    def post(self, request, *args, **kwargs):
+        reset_sql_stats()
+        return self.get(request, *args, **kwargs)
+
+
+class DeviceApiView(View):
+    """
+    JSON-API über device_flat:
+
+    - columns:   kommagetrennte Spalten aus DEVICE_FLAT_COLUMNS
+                 (Default: alle); nur diese werden gelesen und serialisiert
+    - dach_only, ci_status, tier3, search: Filter wie in der Analyse
+                 (dach_only hier ohne Default)
+    - after:     Cursor aus next_cursor der vorigen Antwort
+    - limit:     Zeilen pro Seite (1..API_MAX_LIMIT)
+    - total=1:   zusätzlich Gesamtanzahl zu den Filtern
+    """
+
+    API_DEFAULT_LIMIT = 100
+    API_MAX_LIMIT = 1000
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET
+
+        columns = [c.strip().upper() for c in query.get("columns", "").split(",") if c.strip()]
+        unknown = [c for c in columns if c not in DEVICE_FLAT_COLUMNS]
+        if unknown:
+            return JsonResponse(
+                {"error": "Unbekannte Spalten", "columns": unknown}, status=400,
+            )
+
+        try:
+            limit = int(query.get("limit", self.API_DEFAULT_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= self.API_MAX_LIMIT:
+            return JsonResponse(
+                {"error": f"limit muss zwischen 1 und {self.API_MAX_LIMIT} liegen"},
+                status=400,
+            )
+
+        filters = {
+            "dach_only": query.get("dach_only") in ("1", "on", "true"),
+            "ci_status": query.get("ci_status") or None,
+            "tier3": query.get("tier3") or None,
+            "search": _search_term(query),
+        }
+
+        try:
+            page = fetch_device_columns_page(
+                filters,
+                columns or list(DEVICE_FLAT_COLUMNS),
+                after=decode_cursor(query.get("after")),
+                page_size=limit,
+                with_total=query.get("total") == "1",
+            )
+        except InvalidCursor:
+            return JsonResponse({"error": "Ungültiger Cursor"}, status=400)
+
+        next_url = None
+        if page["next_cursor"]:
+            next_query = query.copy()
+            next_query["after"] = page["next_cursor"]
+            next_url = f"{request.path}?{next_query.urlencode()}"
+
+        return JsonResponse({
+            "columns": page["columns"],
+            "rows": [list(row) for row in page["rows"]],
+            "next_cursor": page["next_cursor"],
+            "next": next_url,
+            "total": page["total"],
+        })
+
+
+# Titel der Datensätze für Export und Komplettansicht
+DATASET_TITLES = {
+    "database": "Geräteübersicht (device_flat)",
+    "analysis": "Analyse",
+    "report-devices": "Report: Geräteliste",
+    "report-counts": "Report: Geräteanzahl je Standort",
+}
+
+
+def _dataset_query(request, dataset):
+    """SQL + Parameter zu einem Datensatz aus DATASET_TITLES."""
+    if dataset == "database":
+        return build_device_rows_query({})
+    if dataset == "analysis":
+        return build_device_rows_query(_filters_from_query(request.GET))
+    if dataset == "report-devices":
+        return db_sql_reports.build_dach_deployed_t3_devices_query()
+    if dataset == "report-counts":
+        return db_sql_reports.build_dach_deployed_t3_counts_query()
+    raise Http404("Unbekannter Datensatz")
+
+
+class ExportView(View):
+    """
+    CSV-Export (optional gzip) als Stream direkt vom Server-Side-Cursor:
+
+    - database:       komplettes device_flat
+    - analysis:       device_flat mit den Analyse-Filtern aus dem Query-String
+    - report-devices: Report 1
+    - report-counts:  Report 2
+    """
+
+    def get(self, request, dataset, *args, **kwargs):
+        sql, params = _dataset_query(request, dataset)
+
+        chunks = iter_csv(stream_rows(sql, params))
+        filename = f"{dataset}.csv"
+        content_type = "text/csv; charset=utf-8"
+
+        if request.GET.get("gzip") in ("1", "on"):
+            chunks = gzip_chunks(chunks)
+            filename += ".gz"
+            content_type = "application/gzip"
+
+        response = streaming_response(request, chunks, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class TableView(View):
+    """
+    Komplette Tabelle eines Datensatzes (wie ExportView) als HTML-Stream:
+    Seitengerüst aus table_stream.html, die Zeilen kommen blockweise vom
+    Server-Side-Cursor und werden ohne Template-Engine escaped ausgegeben.
+    Speicherbedarf bleibt konstant, der Browser zeichnet sofort.
+    """
+
+    template_name = "table_stream.html"
+
+    def get(self, request, dataset, *args, **kwargs):
+        sql, params = _dataset_query(request, dataset)
+
+        page_html = render_to_string(self.template_name, {
+            "title": DATASET_TITLES[dataset],
+            "dataset": dataset,
+            "query": request.GET.urlencode(),
+            "table_marker": mark_safe(HTML_TABLE_MARKER),
+        }, request=request)
+
+        chunks = iter_html_page(page_html, stream_rows(sql, params))
+        return streaming_response(
+            request, chunks, content_type="text/html; charset=utf-8",
+        )